@@ -8,19 +8,141 @@
 # Rheolwyr is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
 
+"""
+Clipboard access for the listener.
+
+On X11 the clipboard is owned by one long-lived helper process
+(clipboard_helper.py), so copying and reading cost a pipe round trip instead
+of a process spawn. ``copy`` returns once the new content is available to
+other applications. Wayland only lets a client without a focused window set
+the selection through tools such as wl-copy, so there, and whenever the
+helper cannot start, the command-line tools are used as before.
+
+Expansions that paste save the user's clipboard with ``snapshot`` and hand it
+to ``restore_later``, which puts it back on a timer once the target
+application has had time to paste, unless the user has copied something else
+in the meantime, or to ``discard`` if the expansion fails. The helper keeps
+every MIME type on offer; wl-copy and xclip can only offer one, so the tools
+keep the richest.
+"""
+import functools
+import json
+import os
+import select
 import shutil
 import subprocess
+import sys
+import threading
+
+# Seconds to wait for the helper to start or answer before giving up on it
+HELPER_TIMEOUT = 2.0
+# Seconds between pasting an expansion and restoring the previous clipboard
+RESTORE_DELAY = 0.5
+# With the tools, which saved type to restore: the first of these on offer
+TOOL_TYPES = ("image/png", "image/jpeg", "text/html", "text/uri-list",
+              "text/plain;charset=utf-8", "UTF8_STRING", "text/plain")
+
+
+@functools.lru_cache(maxsize=None)
+def _which(tool):
+    return shutil.which(tool)
 
 
 def is_wayland():
-    import os
     return "WAYLAND_DISPLAY" in os.environ or os.environ.get("XDG_SESSION_TYPE") == "wayland"
 
 
+class _Helper:
+    """Client for clipboard_helper.py, started on first use."""
+    def __init__(self, args=None):
+        self.args = args or [sys.executable, "-m", "rheolwyr.clipboard_helper"]
+        self.proc = None
+        self.failed = False
+        self._buffer = b""
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _start(self):
+        try:
+            self.proc = subprocess.Popen(
+                self.args,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                # So "-m rheolwyr..." resolves to this package, installed or not
+                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            )
+        except OSError as e:
+            print(f"Clipboard helper unavailable: {e}")
+            return False
+        ready = self._read_reply()
+        if not (ready and ready.get("ok")):
+            print(f"Clipboard helper unavailable: {(ready or {}).get('error', 'no reply')}")
+            self._stop()
+            return False
+        return True
+
+    def _stop(self):
+        if self.proc:
+            self.proc.kill()
+            self.proc.wait()
+            self.proc = None
+        self._buffer = b""
+
+    def _read_reply(self):
+        fd = self.proc.stdout.fileno()
+        while b"\n" not in self._buffer:
+            ready, _, _ = select.select([fd], [], [], HELPER_TIMEOUT)
+            chunk = os.read(fd, 65536) if ready else b""
+            if not chunk:
+                return None
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+
+    def request(self, command, **fields):
+        """Send a command and return the reply, or None if the helper is unusable."""
+        with self._lock:
+            if self.failed:
+                return None
+            if self.proc is None and not self._start():
+                self.failed = True
+                return None
+            self._next_id += 1
+            request_id = self._next_id
+            try:
+                line = json.dumps({"id": request_id, "command": command, **fields})
+                self.proc.stdin.write(line.encode() + b"\n")
+                self.proc.stdin.flush()
+                reply = self._read_reply()
+            except OSError:
+                reply = None
+            if reply is None or reply.get("id") != request_id:
+                # Dead or out of step; the next request starts a fresh one
+                print("Clipboard helper stopped responding")
+                self._stop()
+                return None
+            return reply
+
+
+_helper = _Helper()
+
+
+def _use_helper():
+    return not is_wayland() and bool(os.environ.get("DISPLAY"))
+
+
 def copy(text):
+    if _use_helper():
+        reply = _helper.request("copy", text=text)
+        if reply and reply.get("ok"):
+            return
+
+    # wl-copy and xclip return once they own the selection
     text_bytes = text.encode('utf-8')
     if is_wayland():
-        if shutil.which("wl-copy"):
+        if _which("wl-copy"):
             try:
                 subprocess.run(["wl-copy"], input=text_bytes, check=True)
                 return
@@ -28,26 +150,186 @@ def copy(text):
                 pass
 
     # Fallback to xclip or if not wayland
-    if shutil.which("xclip"):
+    if _which("xclip"):
         try:
             subprocess.run(["xclip", "-selection", "clipboard"], input=text_bytes, check=True)
         except subprocess.CalledProcessError:
             pass
 
 def paste():
+    if _use_helper():
+        reply = _helper.request("paste")
+        if reply and reply.get("ok"):
+            return (reply.get("text") or "").encode('utf-8')
+
     if is_wayland():
-        if shutil.which("wl-paste"):
+        if _which("wl-paste"):
             try:
-                result = subprocess.run(["wl-paste"], capture_output=True, check=True)
+                # wl-paste appends a newline to text unless told not to
+                result = subprocess.run(
+                    ["wl-paste", "--no-newline"], capture_output=True, check=True
+                )
                 return result.stdout
             except subprocess.CalledProcessError:
                 pass
 
-    if shutil.which("xclip"):
+    if _which("xclip"):
         try:
-            result = subprocess.run(["xclip", "-selection", "clipboard", "-o"], capture_output=True, check=True)
+            result = subprocess.run(
+                ["xclip", "-selection", "clipboard", "-o"], capture_output=True, check=True
+            )
             return result.stdout
         except subprocess.CalledProcessError:
             pass
 
     return b""
+
+
+class Snapshot:
+    """The clipboard as it was before an expansion."""
+    def __init__(self, helper_id=None, mime_type=None, data=None):
+        # Kept inside the helper process, or one type read through the tools
+        self.helper_id = helper_id
+        self.mime_type = mime_type
+        self.data = data
+
+    def __bool__(self):
+        return self.helper_id is not None or bool(self.data)
+
+
+def _run(args):
+    """Run a clipboard tool that reads; returns its output or None if it failed."""
+    try:
+        return subprocess.run(args, capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _write(args, data):
+    """
+    Run a clipboard tool that takes ownership of the selection.
+
+    wl-copy and xclip leave a process behind serving the selection, which
+    inherits our stdout and stderr; piping them would make run() wait for it.
+    """
+    try:
+        subprocess.run(args, input=data, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Failed to restore clipboard: {e}")
+
+
+def _tool_commands():
+    """(list types, read type, write type) argument prefixes for this session."""
+    if is_wayland() and _which("wl-paste") and _which("wl-copy"):
+        return (["wl-paste", "--list-types"], ["wl-paste", "--no-newline", "--type"],
+                ["wl-copy", "--type"])
+    if _which("xclip"):
+        xclip = ["xclip", "-selection", "clipboard"]
+        return xclip + ["-o", "-t", "TARGETS"], xclip + ["-o", "-t"], xclip + ["-t"]
+    return None
+
+
+def _take_snapshot():
+    if _use_helper():
+        reply = _helper.request("snapshot")
+        if reply and reply.get("ok"):
+            return Snapshot(helper_id=reply.get("snapshot"))
+
+    commands = _tool_commands()
+    if commands is None:
+        return Snapshot()
+    list_types, read_type, _ = commands
+    offered = (_run(list_types) or b"").decode('utf-8', 'replace').split()
+    for mime_type in TOOL_TYPES:
+        if mime_type in offered:
+            return Snapshot(mime_type=mime_type, data=_run(read_type + [mime_type]))
+    return Snapshot()
+
+
+def _restore(snap, expected):
+    if snap.helper_id is not None:
+        # The helper checks that the clipboard still holds the expansion
+        _helper.request("restore", snapshot=snap.helper_id)
+        return
+    commands = _tool_commands()
+    if commands is None or not snap:
+        return
+    if paste() != expected.encode('utf-8'):
+        return  # The user copied something else since
+    _write(commands[2] + [snap.mime_type], snap.data)
+
+
+class _PendingRestore:
+    def __init__(self, snap, expected, delay):
+        self.snap = snap
+        self.expected = expected
+        self._lock = threading.Lock()
+        self._state = "waiting"
+        self._timer = threading.Timer(delay, self._run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            if self._state != "waiting":
+                return
+            self._state = "running"
+        try:
+            _restore(self.snap, self.expected)
+        except Exception as e:
+            print(f"Failed to restore clipboard: {e}")
+
+    def cancel(self) -> bool:
+        """Stop the restore unless it has started. Returns True if stopped."""
+        with self._lock:
+            if self._state != "waiting":
+                return False
+            self._state = "cancelled"
+        self._timer.cancel()
+        return True
+
+    def join(self):
+        self._timer.join()
+
+
+_pending = None
+_pending_lock = threading.Lock()
+
+
+def snapshot():
+    """
+    Save the clipboard before replacing it.
+
+    If an earlier expansion's restore is still waiting, its snapshot (the
+    user's clipboard, not that expansion) is taken over instead.
+    """
+    global _pending
+    with _pending_lock:
+        pending, _pending = _pending, None
+    if pending is not None:
+        if pending.cancel():
+            return pending.snap
+        pending.join()
+    return _take_snapshot()
+
+
+def restore_later(snap, expected, delay=RESTORE_DELAY):
+    """
+    Put ``snap`` back after ``delay`` seconds without blocking the caller,
+    provided the clipboard still holds ``expected`` (the pasted expansion).
+    """
+    global _pending
+    if not snap:
+        return
+    with _pending_lock:
+        previous, _pending = _pending, _PendingRestore(snap, expected, delay)
+    # Normally snapshot() has already taken the previous one over
+    if previous is not None and previous.cancel() and previous.snap is not snap:
+        discard(previous.snap)
+
+
+def discard(snap):
+    """Let go of ``snap`` without restoring it, e.g. when the expansion failed."""
+    if snap is not None and snap.helper_id is not None:
+        _helper.request("drop", snapshot=snap.helper_id)
@@ -0,0 +1,186 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+"""
+Long-lived clipboard owner, run as a child process of the listener.
+
+It keeps a Gdk display open and serves clipboard requests read from stdin,
+one line of JSON each (``{"id": n, "command": ..., ...}``), answering each on
+stdout with ``{"id": n, "ok": ..., ...}``. Requests are handled one at a
+time, in order. Setting the clipboard is answered once Gdk has claimed it, so
+the content is available when the reply arrives.
+
+Snapshots of the previous clipboard are kept here, every MIME type on offer,
+and only an id crosses the pipe; restoring one puts them all back.
+
+Gdk is loaded here rather than in the listener so the daemon stays free of
+the GUI stack; see clipboard.py for the client side.
+"""
+import json
+import sys
+import threading
+from collections import deque
+
+import gi
+
+gi.require_version('Gdk', '4.0')
+
+from gi.repository import Gdk, Gio, GLib
+
+# Snapshots stop collecting MIME types once they hold this much data
+MAX_SNAPSHOT_BYTES = 16 * 1024 * 1024
+
+
+class ClipboardHelper:
+    def __init__(self, display):
+        self.clipboard = display.get_clipboard()
+        self.loop = GLib.MainLoop()
+        self._out = threading.Lock()
+        self._requests = deque()
+        self._busy = False
+        # The provider behind our last copy, to tell whether the user has
+        # copied something else since
+        self._expansion = None
+        self._snapshots = {}
+        self._next_snapshot = 0
+
+    def reply(self, request_id, **fields):
+        line = json.dumps({"id": request_id, **fields})
+        with self._out:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+    def _done(self, request_id, **fields):
+        self.reply(request_id, **fields)
+        self._busy = False
+        self._next()
+
+    def enqueue(self, request):
+        self._requests.append(request)
+        self._next()
+        return GLib.SOURCE_REMOVE
+
+    def _next(self):
+        if self._busy or not self._requests:
+            return
+        self._busy = True
+        request = self._requests.popleft()
+        request_id = request.get("id")
+        command = request.get("command")
+        handler = getattr(self, f"_cmd_{command}", None)
+        if handler is None:
+            self._done(request_id, ok=False, error=f"Unknown command: {command}")
+            return
+        try:
+            handler(request_id, request)
+        except Exception as e:
+            self._done(request_id, ok=False, error=str(e))
+
+    def _cmd_copy(self, request_id, request):
+        self._expansion = Gdk.ContentProvider.new_for_value(request["text"])
+        self.clipboard.set_content(self._expansion)
+        self._done(request_id, ok=self.clipboard.is_local())
+
+    def _cmd_paste(self, request_id, request):
+        self.clipboard.read_text_async(None, self._on_text, request_id)
+
+    def _on_text(self, clipboard, result, request_id):
+        try:
+            text = clipboard.read_text_finish(result)
+        except GLib.Error as e:
+            # Empty clipboard or no text on offer
+            self._done(request_id, ok=True, text=None, error=e.message)
+            return
+        self._done(request_id, ok=True, text=text)
+
+    def _cmd_snapshot(self, request_id, request):
+        mime_types = list(self.clipboard.get_formats().get_mime_types() or [])
+        self._read_next(request_id, mime_types, {}, 0)
+
+    def _read_next(self, request_id, pending, items, size):
+        if not pending or size >= MAX_SNAPSHOT_BYTES:
+            if not items:
+                self._done(request_id, ok=True, snapshot=None)
+                return
+            self._next_snapshot += 1
+            self._snapshots[self._next_snapshot] = items
+            self._done(request_id, ok=True, snapshot=self._next_snapshot, types=list(items))
+            return
+        mime_type = pending.pop(0)
+        self.clipboard.read_async(
+            [mime_type], GLib.PRIORITY_DEFAULT, None, self._on_stream,
+            (request_id, mime_type, pending, items, size),
+        )
+
+    def _on_stream(self, clipboard, result, state):
+        request_id, mime_type, pending, items, size = state
+        try:
+            stream, _ = clipboard.read_finish(result)
+        except GLib.Error:
+            self._read_next(request_id, pending, items, size)
+            return
+        out = Gio.MemoryOutputStream.new_resizable()
+        flags = Gio.OutputStreamSpliceFlags.CLOSE_SOURCE | Gio.OutputStreamSpliceFlags.CLOSE_TARGET
+        out.splice_async(stream, flags, GLib.PRIORITY_DEFAULT, None, self._on_read, state)
+
+    def _on_read(self, out, result, state):
+        request_id, mime_type, pending, items, size = state
+        try:
+            out.splice_finish(result)
+            data = out.steal_as_bytes()
+            items[mime_type] = data
+            size += data.get_size()
+        except GLib.Error:
+            pass
+        self._read_next(request_id, pending, items, size)
+
+    def _cmd_restore(self, request_id, request):
+        items = self._snapshots.pop(request["snapshot"], None)
+        # Leave whatever the user copied after the expansion alone
+        if not items or self.clipboard.get_content() is not self._expansion:
+            self._done(request_id, ok=True, restored=False)
+            return
+        providers = [Gdk.ContentProvider.new_for_bytes(mime_type, data)
+                     for mime_type, data in items.items()]
+        self.clipboard.set_content(Gdk.ContentProvider.new_union(providers))
+        self._expansion = None
+        self._done(request_id, ok=True, restored=True)
+
+    def _cmd_drop(self, request_id, request):
+        self._snapshots.pop(request["snapshot"], None)
+        self._done(request_id, ok=True)
+
+    def read_requests(self):
+        for line in sys.stdin:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                continue
+            GLib.idle_add(self.enqueue, request)
+        # The listener went away
+        GLib.idle_add(self.loop.quit)
+
+    def run(self):
+        threading.Thread(target=self.read_requests, daemon=True).start()
+        self.reply(None, ok=True, ready=True)
+        self.loop.run()
+
+
+def main():
+    display = Gdk.Display.open(None)
+    if display is None:
+        print(json.dumps({"id": None, "ok": False, "error": "No display"}), flush=True)
+        return 1
+    ClipboardHelper(display).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,16 +9,30 @@
 # but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
 
 import json
+import os
 from pathlib import Path
 
-from gi.repository import Adw
-
 APP_NAME = "rheolwyr"
 CONFIG_DIR = Path.home() / ".config" / APP_NAME
 CONFIG_FILE = CONFIG_DIR / "config.json"
 
 DEFAULT_CONFIG = {
-    "theme": "system"
+    "theme": "system",
+    # XKB layout for decoding and typing keys, e.g. "de" or "fr(azerty)".
+    # Empty means detect it from the system, falling back to US.
+    "keyboard_layout": "",
+    # Keystroke pacing for uinput injection, per compositor. Profiles are
+    # keyed by an XDG_CURRENT_DESKTOP entry; "default" applies everywhere.
+    "injection": {
+        "default": {
+            "key_delay_ms": 0,
+            "burst_size": 8,
+            "burst_delay_ms": 2,
+        },
+    },
+    # How expansions are injected: "auto" picks typing or the clipboard by
+    # measured cost; "type" or "paste" forces one (untypable text is pasted).
+    "expansion_method": "auto",
 }
 
 def load_config():
@@ -43,6 +57,9 @@ def save_config(data):
 
 def get_theme_scheme():
     """Get the Adw.ColorScheme based on stored config."""
+    # Imported here so the headless daemon never loads Adw
+    from gi.repository import Adw
+
     config = load_config()
     theme = config.get("theme", "system")
 
@@ -55,6 +72,8 @@ def get_theme_scheme():
 
 def set_theme_preference(scheme):
     """Save the theme preference based on the scheme enum."""
+    from gi.repository import Adw
+
     config = load_config()
 
     if scheme == Adw.ColorScheme.FORCE_LIGHT:
@@ -65,3 +84,36 @@ def set_theme_preference(scheme):
         config["theme"] = "system"
 
     save_config(config)
+
+def get_keyboard_layout():
+    """Get the configured XKB layout spec, or None to detect it."""
+    return load_config().get("keyboard_layout") or None
+
+def get_injection_pacing():
+    """
+    Get the uinput pacing for the running compositor.
+
+    Returns keyword arguments for UInputController: the delay after each
+    keystroke, how many keystrokes to write at once and the pause between
+    such bursts (delays in seconds).
+    """
+    profiles = dict(DEFAULT_CONFIG["injection"])
+    profiles.update(load_config().get("injection", {}))
+
+    pacing = dict(DEFAULT_CONFIG["injection"]["default"])
+    pacing.update(profiles.get("default", {}))
+    for desktop in os.environ.get("XDG_CURRENT_DESKTOP", "").split(":"):
+        if desktop in profiles:
+            pacing.update(profiles[desktop])
+            break
+
+    return {
+        "key_delay": pacing["key_delay_ms"] / 1000.0,
+        "burst_size": max(1, int(pacing["burst_size"])),
+        "burst_delay": pacing["burst_delay_ms"] / 1000.0,
+    }
+
+def get_expansion_method():
+    """Get the expansion method: "auto", "type" or "paste"."""
+    method = load_config().get("expansion_method", "auto")
+    return method if method in ("auto", "type", "paste") else "auto"
@@ -0,0 +1,131 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+"""
+Headless expansion daemon.
+
+Runs the snippet listener on its own, without Gtk or Adw, so the always-on
+part of Rheolwyr (e.g. started at login) costs only what expansion needs. The
+editor window is a separate process started on demand with ``rheolwyr``; it
+starts the daemon if none is running and talks to it over ipc.py, so nothing
+the editor does competes with key handling for the interpreter.
+
+Only one daemon runs at a time: the one holding the listener lock.
+"""
+import fcntl
+import json
+import os
+import signal
+import sys
+import threading
+
+from .ipc import IPCServer, request, runtime_dir
+from .listener import SnippetListener
+
+LOCK_NAME = "rheolwyr-listener.lock"
+
+
+class ListenerLock:
+    """
+    Advisory lock held by the process running the snippet listener.
+
+    The holder's pid is written to the file so other processes can find it.
+    The kernel drops the lock when the holder exits, however it exits.
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(runtime_dir(), LOCK_NAME)
+        self._fd = None
+
+    def acquire(self) -> bool:
+        """Take the lock without waiting. Returns False if another process has it."""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def holder(self):
+        """The pid recorded by the last process to take the lock, or None."""
+        try:
+            with open(self.path, 'r') as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+
+def print_status():
+    """Print the running daemon's status (``rheolwyr-daemon --status``)."""
+    reply = request("status")
+    if reply is None:
+        print("Rheolwyr: daemon not running")
+        return 1
+    print(json.dumps(reply, indent=4))
+    return 0
+
+
+def main():
+    if "--status" in sys.argv[1:]:
+        return print_status()
+
+    try:
+        lock = ListenerLock()
+        acquired = lock.acquire()
+    except OSError as e:
+        print(f"Error starting listener: {e}", file=sys.stderr)
+        return 1
+    if not acquired:
+        print(f"Rheolwyr: listener already running (pid {lock.holder()})")
+        return 0
+
+    try:
+        listener = SnippetListener()
+        listener.start()
+    except Exception as e:
+        print(f"Error starting listener: {e}", file=sys.stderr)
+        lock.release()
+        return 1
+
+    def changed():
+        # The editor wrote to the library from its own process
+        listener.db.external_change()
+
+    def status():
+        return {"pid": os.getpid(), **listener.status()}
+
+    server = IPCServer({"changed": changed, "status": status})
+    server.start()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    print("Rheolwyr daemon running.")
+    stop.wait()
+
+    server.stop()
+    listener.stop()
+    lock.release()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,113 +2,721 @@
 # Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
 # Licensed under GPLv3 or later
 
+import codecs
+import gzip
+import hashlib
+import json
 import os
+import re
 import sqlite3
-from typing import List, Optional, Tuple
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
 
-from gi.repository import GLib
+from .matcher import MappedTriggerMatcher, TriggerMatcher, trigger_fingerprint
+
+
+def _user_data_dir() -> str:
+    # Same as GLib.get_user_data_dir(), without loading GLib
+    default = os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.environ.get("XDG_DATA_HOME") or default
+
+
+class _ChangeHub:
+    """
+    Change notifications for one database file.
+
+    Shared by every Database instance opened on the same path, so a write made
+    through the editor's instance reaches the listener's instance.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.callbacks = {}
+        self.next_handler_id = 1
+        # Serializes rewrites of the trigger index, so the last one to finish
+        # has read the newest library
+        self.index_lock = threading.Lock()
+
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def _get_hub(db_path: str) -> _ChangeHub:
+    key = os.path.realpath(db_path)
+    with _hubs_lock:
+        hub = _hubs.get(key)
+        if hub is None:
+            hub = _hubs[key] = _ChangeHub()
+        return hub
+
+
+class DuplicateTriggerError(ValueError):
+    """Raised when a snippet's trigger is already used by another snippet."""
+
+
+class OperationCancelled(Exception):
+    """Raised when an import or export is cancelled through its ``cancel`` event."""
+
+
+def _content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _blank_duplicate_triggers(conn):
+    # Before triggers became unique, the first snippet by name won; keep that
+    # one and clear the trigger on the rest so nothing is lost.
+    conn.execute("UPDATE snippets SET trigger = '' WHERE trigger IS NULL")
+    # One pass over the table, ranking each trigger's snippets by name
+    cursor = conn.execute("""
+        UPDATE snippets SET trigger = ''
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY trigger ORDER BY name, id) AS rank
+                FROM snippets WHERE trigger <> ''
+            )
+            WHERE rank > 1
+        )
+    """)
+    if cursor.rowcount > 0:
+        print(f"Database: cleared {cursor.rowcount} duplicate snippet triggers")
+
+
+def _create_search_index(conn):
+    # External-content FTS5 index over the snippets table, kept in step by
+    # triggers. Builds of SQLite without FTS5 skip it; search() then falls
+    # back to a plain LIKE scan.
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE snippets_fts USING fts5(
+                name, trigger, content,
+                content='snippets', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"Database: full-text search unavailable ({e})")
+        return
+    conn.execute("""
+        CREATE TRIGGER snippets_fts_insert AFTER INSERT ON snippets BEGIN
+            INSERT INTO snippets_fts (rowid, name, trigger, content)
+            VALUES (new.id, new.name, new.trigger, new.content);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER snippets_fts_delete AFTER DELETE ON snippets BEGIN
+            INSERT INTO snippets_fts (snippets_fts, rowid, name, trigger, content)
+            VALUES ('delete', old.id, old.name, old.trigger, old.content);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER snippets_fts_update AFTER UPDATE OF name, trigger, content ON snippets
+        BEGIN
+            INSERT INTO snippets_fts (snippets_fts, rowid, name, trigger, content)
+            VALUES ('delete', old.id, old.name, old.trigger, old.content);
+            INSERT INTO snippets_fts (rowid, name, trigger, content)
+            VALUES (new.id, new.name, new.trigger, new.content);
+        END
+    """)
+    conn.execute("INSERT INTO snippets_fts (snippets_fts) VALUES ('rebuild')")
+
+
+def _search_terms(query: str) -> List[str]:
+    # Words as the unicode61 tokenizer sees them; punctuation such as the ";"
+    # in ";sig" separates tokens rather than being part of them.
+    return re.findall(r"\w+", query)
+
+
+# Schema migrations, applied in order. PRAGMA user_version records how many
+# have run, so each runs once per database file. Steps are SQL statements or
+# callables taking the connection. Only ever append to this list.
+_MIGRATIONS = (
+    # 1: the original table
+    (
+        """
+        CREATE TABLE IF NOT EXISTS snippets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            trigger TEXT,
+            shortcut TEXT,
+            content TEXT NOT NULL
+        )
+        """,
+    ),
+    # 2: indexed trigger lookups; non-empty triggers are unique
+    (
+        "CREATE INDEX idx_snippets_trigger ON snippets (trigger)",
+        _blank_duplicate_triggers,
+        "CREATE UNIQUE INDEX idx_snippets_unique_trigger ON snippets (trigger) WHERE trigger <> ''",
+    ),
+    # 3: content hash for indexed dedup, and timestamps
+    (
+        "ALTER TABLE snippets ADD COLUMN content_hash TEXT",
+        "ALTER TABLE snippets ADD COLUMN created_at TEXT",
+        "ALTER TABLE snippets ADD COLUMN updated_at TEXT",
+        """
+        UPDATE snippets SET content_hash = content_hash(content),
+            created_at = datetime('now'), updated_at = datetime('now')
+        """,
+        "CREATE INDEX idx_snippets_content_hash ON snippets (content_hash)",
+    ),
+    # 4: full-text search
+    (
+        _create_search_index,
+    ),
+)
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+
+_JSON_WHITESPACE = " \t\r\n"
+
+
+def _iter_json_array(stream, chunk_size: int = 1 << 16):
+    """
+    Yield the items of the top-level JSON array in binary ``stream``.
+
+    Only the item being decoded is held in memory, so arbitrarily large
+    exports import in constant space. Raises ValueError on malformed input.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8-sig")()
+    buf = ""
+    pos = 0
+    eof = False
+    started = False
+    expect_item = True
+
+    while True:
+        while pos < len(buf) and buf[pos] in _JSON_WHITESPACE:
+            pos += 1
+
+        need_more = pos == len(buf)
+        if not need_more and started and expect_item and buf[pos] != "]":
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                need_more = True
+            else:
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(buf) or eof:
+                    yield item
+                    pos = end
+                    expect_item = False
+                    continue
+                need_more = True
+
+        if need_more:
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            # Read at least as much as is buffered, so an item spanning many
+            # chunks is re-decoded a logarithmic number of times
+            buf = buf[pos:]
+            pos = 0
+            chunk = stream.read(max(chunk_size, len(buf)))
+            if chunk:
+                buf += text.decode(chunk)
+            else:
+                buf += text.decode(b"", final=True)
+                eof = True
+            continue
+
+        char = buf[pos]
+        pos += 1
+        if not started:
+            if char != "[":
+                raise ValueError("Expected a JSON array of snippets")
+            started = True
+        elif char == "]":
+            return
+        elif char == "," and not expect_item:
+            expect_item = True
+        else:
+            raise ValueError(f"Unexpected {char!r} in JSON array")
 
 
 class Database:
+    """
+    The snippet library.
+
+    Each thread gets its own long-lived connection, opened on first use. The
+    file is in WAL mode, so a thread reading (the listener) never waits for
+    another thread writing (the editor), and the other way around.
+
+    Next to the file, ``snippets.idx`` holds the compiled trigger automaton
+    (see matcher.MappedTriggerMatcher). It is rewritten after every change
+    made through this class, so a listener can start without compiling the
+    triggers; it only reads them to check the index is current.
+    """
+    # Prepared statements kept per connection; the queries below are fixed
+    # strings, so they are compiled once per thread.
+    CACHED_STATEMENTS = 64
+    # How long a writer waits for another writer before giving up, in seconds
+    BUSY_TIMEOUT = 5.0
+    # Rows written between progress reports and cancellation checks on export
+    EXPORT_BATCH = 500
+    # Snippet bodies kept in memory by get_content()
+    CONTENT_CACHE_SIZE = 128
+
     def __init__(self, db_path: str = None):
         if db_path is None:
-            data_dir = os.path.join(GLib.get_user_data_dir(), "rheolwyr")
+            data_dir = os.path.join(_user_data_dir(), "rheolwyr")
             os.makedirs(data_dir, exist_ok=True)
             self.db_path = os.path.join(data_dir, "snippets.db")
         else:
             self.db_path = db_path
+        self.index_path = os.path.splitext(self.db_path)[0] + ".idx"
+        self._hub = _get_hub(self.db_path)
+        self._local = threading.local()
+        # (thread, connection) for every connection opened, so close() can
+        # reach them all and connections of finished threads can be reclaimed
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # id -> content, least recently used first. Emptied whenever the
+        # library changes (the generation moves on).
+        self._content_cache = OrderedDict()
+        self._content_cache_generation = None
+        self._content_cache_lock = threading.Lock()
+        # Whether the FTS5 table exists; looked up on first search
+        self._search_index = None
         self._init_db()
 
+    @property
+    def generation(self) -> int:
+        """Counter bumped on every change to the snippet library."""
+        return self._hub.generation
+
+    def connect_changed(self, callback: Callable[[str, Optional[int]], None]) -> int:
+        """
+        Register ``callback(change, snippet_id)`` to run after every write.
+
+        ``change`` is one of "added", "updated", "deleted", "imported" or
+        "external"; ``snippet_id`` is None for bulk changes. Callbacks run on the thread that
+        made the change. Returns a handler id for disconnect_changed().
+        """
+        with self._hub.lock:
+            handler_id = self._hub.next_handler_id
+            self._hub.next_handler_id += 1
+            self._hub.callbacks[handler_id] = callback
+        return handler_id
+
+    def disconnect_changed(self, handler_id: int):
+        with self._hub.lock:
+            self._hub.callbacks.pop(handler_id, None)
+
+    def external_change(self):
+        """Note that another process changed the file (e.g. the editor)."""
+        self._notify_changed("external")
+
+    def _notify_changed(self, change: str, snippet_id: Optional[int] = None):
+        # Another process has already rewritten the index for external changes
+        if change != "external":
+            self.write_trigger_index()
+        with self._hub.lock:
+            self._hub.generation += 1
+            callbacks = list(self._hub.callbacks.values())
+        for callback in callbacks:
+            try:
+                callback(change, snippet_id)
+            except Exception as e:
+                print(f"Error in change callback: {e}")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+
+        # Only ever used by the thread that opened it; close() may run
+        # elsewhere, hence check_same_thread=False.
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.BUSY_TIMEOUT,
+            cached_statements=self.CACHED_STATEMENTS,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Safe with WAL: a power cut may lose the last commits, never corrupt
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.create_function("content_hash", 1, _content_hash, deterministic=True)
+        self._local.conn = conn
+
+        with self._connections_lock:
+            alive = []
+            for thread, other in self._connections:
+                if thread.is_alive():
+                    alive.append((thread, other))
+                else:
+                    other.close()
+            alive.append((threading.current_thread(), conn))
+            self._connections = alive
+        return conn
+
+    def close(self):
+        """Close every connection this instance has opened."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for _, conn in connections:
+            conn.close()
+        # Threads reopen on next use
+        self._local = threading.local()
+
     def _init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS snippets (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    trigger TEXT,
-                    shortcut TEXT,
-                    content TEXT NOT NULL
-                )
-            """)
-            conn.commit()
+        """Bring the schema up to date, one migration at a time."""
+        conn = self._connection()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        while version < SCHEMA_VERSION:
+            try:
+                # Take the write lock first so two processes starting at
+                # once cannot both run the same migration
+                conn.execute("BEGIN IMMEDIATE")
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version < SCHEMA_VERSION:
+                    for step in _MIGRATIONS[version]:
+                        if callable(step):
+                            step(conn)
+                        else:
+                            conn.execute(step)
+                    version += 1
+                    conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
 
     def add_snippet(self, name: str, content: str, trigger: str = "") -> int:
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO snippets (name, content, trigger) VALUES (?, ?, ?)",
-                (name, content, trigger)
-            )
-            return cursor.lastrowid
+        snippet_id = self._insert_snippet(name, content, trigger)
+        self._notify_changed("added", snippet_id)
+        return snippet_id
+
+    def _insert_snippet(self, name: str, content: str, trigger: str) -> int:
+        try:
+            with self._connection() as conn:
+                cursor = conn.execute(
+                    "INSERT INTO snippets (name, content, trigger, content_hash, created_at,"
+                    " updated_at) VALUES (?, ?, ?, ?, datetime('now'), datetime('now'))",
+                    (name, content, trigger or "", _content_hash(content))
+                )
+                return cursor.lastrowid
+        except sqlite3.IntegrityError as e:
+            raise DuplicateTriggerError(f"Trigger {trigger!r} is already in use") from e
 
     def update_snippet(self, snippet_id: int, name: str, content: str, trigger: str):
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE snippets SET name = ?, content = ?, trigger = ? WHERE id = ?",
-                (name, content, trigger, snippet_id)
-            )
+        try:
+            with self._connection() as conn:
+                conn.execute(
+                    "UPDATE snippets SET name = ?, content = ?, trigger = ?, content_hash = ?,"
+                    " updated_at = datetime('now') WHERE id = ?",
+                    (name, content, trigger or "", _content_hash(content), snippet_id)
+                )
+        except sqlite3.IntegrityError as e:
+            raise DuplicateTriggerError(f"Trigger {trigger!r} is already in use") from e
+        self._notify_changed("updated", snippet_id)
 
     def delete_snippet(self, snippet_id: int):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM snippets WHERE id = ?", (snippet_id,))
+        self._notify_changed("deleted", snippet_id)
 
     def get_all_snippets(self) -> List[Tuple]:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT id, name, content, trigger FROM snippets ORDER BY name")
             return cursor.fetchall()
 
+    def list_snippets(self) -> List[Tuple[int, str]]:
+        """(id, name) of every snippet, by name. No bodies are read."""
+        return self._connection().execute(
+            "SELECT id, name FROM snippets ORDER BY name"
+        ).fetchall()
+
+    def get_trigger_map(self) -> Dict[str, int]:
+        """
+        Map of every non-empty trigger to its snippet id, in snippet name
+        order, which is the priority order of overlapping triggers.
+        """
+        rows = self._connection().execute(
+            "SELECT trigger, id FROM snippets WHERE trigger <> '' ORDER BY name, id"
+        )
+        return dict(rows)
+
+    def write_trigger_index(self):
+        """Compile the triggers and atomically replace the trigger index."""
+        with self._hub.index_lock:
+            entries = list(self.get_trigger_map().items())
+            data = TriggerMatcher(entries).to_bytes(trigger_fingerprint(entries))
+            directory = os.path.dirname(os.path.abspath(self.index_path))
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snippets-", suffix=".idx")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                # Readers keep whichever file they mapped; the rename never
+                # changes a mapping under them
+                os.replace(tmp_path, self.index_path)
+            except OSError as e:
+                print(f"Error writing trigger index: {e}")
+                if tmp_path and os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+    def open_trigger_index(self) -> Optional[MappedTriggerMatcher]:
+        """
+        Map the trigger index, rewriting it first if it is missing, unreadable
+        or stale: its fingerprint must match the library's current triggers,
+        whoever changed them (a crash before the rewrite, another program, a
+        replaced snippets.db). Returns None if it cannot be written.
+        """
+        expected = trigger_fingerprint(self.get_trigger_map().items())
+        try:
+            matcher = MappedTriggerMatcher(self.index_path)
+            if matcher.fingerprint == expected:
+                return matcher
+            matcher.close()
+        except (OSError, ValueError):
+            pass
+        self.write_trigger_index()
+        try:
+            return MappedTriggerMatcher(self.index_path)
+        except (OSError, ValueError) as e:
+            print(f"Error reading trigger index: {e}")
+            return None
+
+    def get_content(self, snippet_id: int) -> Optional[str]:
+        """A snippet's body, through a small LRU cache."""
+        cache = self._content_cache
+        with self._content_cache_lock:
+            if self._content_cache_generation != self.generation:
+                cache.clear()
+                self._content_cache_generation = self.generation
+            content = cache.get(snippet_id)
+            if content is not None:
+                cache.move_to_end(snippet_id)
+                return content
+            generation = self._content_cache_generation
+
+        row = self._connection().execute(
+            "SELECT content FROM snippets WHERE id = ?", (snippet_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        with self._content_cache_lock:
+            # Do not cache a body read across a concurrent change
+            if generation == self.generation:
+                cache[snippet_id] = row[0]
+                if len(cache) > self.CONTENT_CACHE_SIZE:
+                    cache.popitem(last=False)
+        return row[0]
+
+    def search(self, query: str, limit: int = 50) -> List[Tuple[int, str]]:
+        """
+        (id, name) of the snippets best matching ``query``, best first.
+
+        Every word must match the start of a word in the name, trigger or
+        content, so results narrow as the user types. Name matches rank above
+        trigger matches, which rank above content matches.
+        """
+        terms = _search_terms(query)
+        if not terms:
+            return []
+        conn = self._connection()
+        if self._has_search_index(conn):
+            match = " ".join('"' + term + '"*' for term in terms)
+            return conn.execute("""
+                SELECT snippets.id, snippets.name
+                FROM snippets_fts JOIN snippets ON snippets.id = snippets_fts.rowid
+                WHERE snippets_fts MATCH ?
+                ORDER BY bm25(snippets_fts, 10.0, 5.0, 1.0)
+                LIMIT ?
+            """, (match, limit)).fetchall()
+
+        where = " AND ".join(
+            ["(name LIKE ? OR trigger LIKE ? OR content LIKE ?)"] * len(terms)
+        )
+        params = [f"%{term}%" for term in terms for _ in range(3)]
+        return conn.execute(
+            f"SELECT id, name FROM snippets WHERE {where} ORDER BY name LIMIT ?",
+            params + [limit]
+        ).fetchall()
+
+    def _has_search_index(self, conn) -> bool:
+        if self._search_index is None:
+            self._search_index = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'snippets_fts'"
+            ).fetchone() is not None
+        return self._search_index
+
     def get_snippet_by_id(self, snippet_id: int) -> Optional[Tuple]:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT id, name, content, trigger FROM snippets WHERE id = ?", (snippet_id,))
             return cursor.fetchone()
 
-    def export_snippets(self, filepath: str) -> bool:
+    def export_snippets(
+        self,
+        filepath: str,
+        compact: bool = False,
+        compress: Optional[bool] = None,
+        progress: Optional[Callable[[float], None]] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> bool:
+        """
+        Write the library to ``filepath`` as a JSON array.
+
+        Rows are streamed from a cursor and written one at a time, so memory
+        use does not grow with the library. ``compact`` drops the indentation;
+        ``compress`` gzips the file and defaults to whether the name ends in
+        ".gz". ``progress(fraction)`` is called every EXPORT_BATCH rows; once
+        ``cancel`` is set the partial file is removed and OperationCancelled
+        is raised.
+        """
+        if compress is None:
+            compress = filepath.endswith(".gz")
+        if compact:
+            encoder = json.JSONEncoder(separators=(",", ":"))
+            first, separator, last = "[", ",", "]"
+        else:
+            # Same layout as json.dump(..., indent=4)
+            encoder = json.JSONEncoder(indent=4)
+            first, separator, last = "[\n", ",\n", "\n]"
+
         try:
-            snippets = self.get_all_snippets()
-            data = []
-            for s in snippets:
-                # s: id, name, content, trigger
-                data.append({
-                    "name": s[1],
-                    "content": s[2],
-                    "trigger": s[3] if s[3] else ""
-                })
-            import json
-            with open(filepath, 'w') as f:
-                json.dump(data, f, indent=4)
+            opener = gzip.open if compress else open
+            with opener(filepath, 'wt', encoding="utf-8") as f:
+                conn = self._connection()
+                total = conn.execute("SELECT count(*) FROM snippets").fetchone()[0] or 1
+                rows = conn.execute(
+                    "SELECT name, content, trigger FROM snippets ORDER BY name"
+                )
+                count = 0
+                for name, content, trigger in rows:
+                    if count % self.EXPORT_BATCH == 0 and count:
+                        if cancel is not None and cancel.is_set():
+                            raise OperationCancelled()
+                        if progress:
+                            progress(min(count / total, 1.0))
+                    item = encoder.encode({
+                        "name": name,
+                        "content": content,
+                        "trigger": trigger if trigger else ""
+                    })
+                    if not compact:
+                        item = "    " + item.replace("\n", "\n    ")
+                    f.write((separator if count else first) + item)
+                    count += 1
+                f.write(last if count else "[]")
+            if progress:
+                progress(1.0)
             return True
+        except OperationCancelled:
+            os.remove(filepath)
+            raise
         except Exception as e:
             print(f"Error exporting snippets: {e}")
             return False
 
-    def import_snippets(self, filepath: str) -> int:
+    def import_snippets(
+        self,
+        filepath: str,
+        progress: Optional[Callable[[float], None]] = None,
+        batch_size: int = 500,
+        cancel: Optional[threading.Event] = None,
+    ) -> int:
+        """
+        Import snippets from a JSON export (optionally gzipped), skipping ones
+        already present. A snippet whose trigger is already in use is added
+        without its trigger.
+
+        The file is parsed incrementally and inserted in batches inside a
+        single transaction, so memory stays flat and either the whole file is
+        imported or none of it. ``progress(fraction)`` is called after every
+        batch. Returns the number of snippets added, or -1 on error. Setting
+        ``cancel`` rolls the import back and raises OperationCancelled.
+        """
         imported_count = 0
         try:
-            import json
-            with open(filepath, 'r') as f:
-                data = json.load(f)
-
-            existing = self.get_all_snippets()
-            # Create a set of (name, content, trigger) for quick dedup
-            existing_set = {(s[1], s[2], s[3] if s[3] else "") for s in existing}
+            conn = self._connection()
+            with open(filepath, 'rb') as f, conn:
+                total = os.fstat(f.fileno()).st_size or 1
+                stream = f
+                if f.read(2) == b"\x1f\x8b":
+                    stream = gzip.GzipFile(fileobj=f, mode='rb')
+                f.seek(0)
+                batch = []
+                for item in _iter_json_array(stream):
+                    if not isinstance(item, dict):
+                        continue
+                    name = item.get("name")
+                    content = item.get("content")
+                    trigger = item.get("trigger") or ""
 
-            for item in data:
-                name = item.get("name")
-                content = item.get("content")
-                trigger = item.get("trigger", "")
+                    if not name or not isinstance(content, str) or not content:
+                        continue
 
-                if not name or not content:
-                    continue
-
-                if (name, content, trigger) not in existing_set:
-                    self.add_snippet(name, content, trigger)
-                    imported_count += 1
+                    batch.append((name, content, trigger, _content_hash(content)))
+                    if len(batch) >= batch_size:
+                        if cancel is not None and cancel.is_set():
+                            raise OperationCancelled()
+                        imported_count += self._import_batch(conn, batch)
+                        batch = []
+                        if progress:
+                            progress(min(f.tell() / total, 1.0))
+                imported_count += self._import_batch(conn, batch)
+            if progress:
+                progress(1.0)
             return imported_count
+        except OperationCancelled:
+            imported_count = 0
+            raise
         except Exception as e:
+            # The transaction was rolled back
+            imported_count = 0
             print(f"Error importing snippets: {e}")
             return -1
+        finally:
+            if imported_count:
+                self._notify_changed("imported")
+
+    def _import_batch(self, conn, batch) -> int:
+        # Identical snippets are found through the content hash index and
+        # skipped. A snippet whose trigger is already taken keeps its content
+        # and loses the trigger, as in the unique-trigger migration.
+        if not batch:
+            return 0
+        triggers = list({trigger for _, _, trigger, _ in batch if trigger})
+        taken = set()
+        if triggers:
+            placeholders = ", ".join("?" * len(triggers))
+            taken.update(row[0] for row in conn.execute(
+                f"SELECT trigger FROM snippets WHERE trigger IN ({placeholders})", triggers
+            ))
+        kept, cleared = [], []
+        for name, content, trigger, content_hash in batch:
+            if trigger and trigger in taken:
+                cleared.append((name, content, trigger, content_hash, ""))
+            else:
+                kept.append((name, content, trigger, content_hash, trigger))
+                taken.add(trigger)
+
+        insert = """
+            INSERT INTO snippets
+                (name, content, trigger, content_hash, created_at, updated_at)
+            SELECT ?1, ?2, ?5, ?4, datetime('now'), datetime('now')
+            WHERE NOT EXISTS (
+                SELECT 1 FROM snippets
+                WHERE content_hash = ?4 AND name = ?1 AND content = ?2
+                  AND trigger IN (?3, ?5)
+            )
+        """
+        added = max(conn.executemany(insert, kept).rowcount, 0) if kept else 0
+        if cleared:
+            count = max(conn.executemany(insert, cleared).rowcount, 0)
+            if count:
+                print(f"Database: imported {count} snippets without their triggers, "
+                      "which were already in use")
+            added += count
+        return added
@@ -9,11 +9,20 @@
 # but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
 
 
-import select
+import ctypes
+import ctypes.util
+import glob
+import os
+import selectors
+import struct
 import threading
 
 import evdev
 
+from . import keymap
+from .keymap import CAPS, LEVEL3, SHIFT, STATES, DeadKey
+from .uinput_controller import DEVICE_NAME, DEVICE_PHYS
+
 # Try to import pynput keys for compatibility
 try:
     from pynput.keyboard import Key, KeyCode
@@ -47,80 +56,296 @@ except ImportError:
         def __init__(self, char=None):
             self.char = char
 
+# Non-character keys. These decode the same in every modifier state.
+_ec = evdev.ecodes
+SPECIAL_KEYS = {
+    _ec.KEY_BACKSPACE: Key.backspace,
+    _ec.KEY_TAB: Key.tab,
+    _ec.KEY_ENTER: Key.enter,
+    _ec.KEY_ESC: Key.esc,
+    _ec.KEY_SPACE: Key.space,
+    _ec.KEY_DELETE: Key.delete,
+    _ec.KEY_UP: Key.up,
+    _ec.KEY_DOWN: Key.down,
+    _ec.KEY_LEFT: Key.left,
+    _ec.KEY_RIGHT: Key.right,
+    _ec.KEY_HOME: Key.home,
+    _ec.KEY_END: Key.end,
+    _ec.KEY_PAGEUP: Key.page_up,
+    _ec.KEY_PAGEDOWN: Key.page_down,
+    _ec.KEY_LEFTSHIFT: Key.shift,
+    _ec.KEY_RIGHTSHIFT: Key.shift_r,
+    _ec.KEY_LEFTCTRL: Key.ctrl_l,
+    _ec.KEY_RIGHTCTRL: Key.ctrl_r,
+    _ec.KEY_LEFTALT: Key.alt_l,
+    _ec.KEY_RIGHTALT: Key.alt_r,
+    _ec.KEY_LEFTMETA: Key.cmd,
+    _ec.KEY_RIGHTMETA: Key.cmd,
+    _ec.KEY_CAPSLOCK: Key.caps_lock,
+    _ec.KEY_F1: Key.f1, _ec.KEY_F2: Key.f2,
+    _ec.KEY_F3: Key.f3, _ec.KEY_F4: Key.f4,
+    _ec.KEY_F5: Key.f5, _ec.KEY_F6: Key.f6,
+    _ec.KEY_F7: Key.f7, _ec.KEY_F8: Key.f8,
+    _ec.KEY_F9: Key.f9, _ec.KEY_F10: Key.f10,
+    _ec.KEY_F11: Key.f11, _ec.KEY_F12: Key.f12,
+}
+SHIFT_KEYS = frozenset((_ec.KEY_LEFTSHIFT, _ec.KEY_RIGHTSHIFT))
+
+
+def compile_decode_table(layout):
+    """
+    Build the flat key press table for ``layout``.
+
+    Indexed by ``keycode * STATES + modifier state``; entries are pynput
+    Key/KeyCode objects (created once, here), keymap.DeadKey or None.
+    """
+    table = [None] * ((_ec.KEY_MAX + 1) * STATES)
+    for index, symbol in enumerate(layout.decode_table()):
+        if isinstance(symbol, str):
+            table[index] = KeyCode(char=symbol)
+        elif symbol is not None:
+            table[index] = symbol
+    for code, key in SPECIAL_KEYS.items():
+        for state in range(STATES):
+            table[code * STATES + state] = key
+    return table
+
+
+# inotify(7) constants; see <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+INPUT_DIR = "/dev/input"
+
+# Selector data for the non-device fds in the poll set
+_HOTPLUG = "hotplug"
+_WAKEUP = "wakeup"
+
+
+class _DirectoryWatch:
+    """Minimal inotify watch on a single directory, through libc."""
+    def __init__(self, path, mask):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, f"inotify_add_watch failed for {path}")
+        self.fd = fd
+
+    def fileno(self):
+        return self.fd
+
+    def read(self):
+        """Return (mask, name) for every pending event."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+                offset += length
+                events.append((mask, name))
+
+    def close(self):
+        os.close(self.fd)
+
+
 class EvdevListener:
-    def __init__(self, on_press=None):
+    def __init__(self, on_press=None, layout=None):
         self.on_press = on_press
         self.running = False
         self.thread = None
-        self._stop_event = threading.Event()
+        # eventfd in the poll set; stop() writes to it so the thread can
+        # sleep without a timeout while idle and still exit at once
+        self._wakeup_fd = None
 
         self.pressed_keys = set()
 
-        # Modifier state
-        self.modifiers = {
-            'shift': False,
-            'caps': False,
-            'ctrl': False,
-            'alt': False,
-            'meta': False
-        }
+        # Keyboards being read, by device path. Devices come and go while
+        # running (hotplug, resume from suspend) via the /dev/input watch.
+        self.keyboards = {}
+        self._selector = None
+        self._watch = None
+        # Event nodes that could not be opened for lack of permission
+        self._denied = 0
+
+        # Key decoding: one flat table for the layout, indexed by keycode and
+        # the modifier state bits (keymap.SHIFT, CAPS, LEVEL3)
+        self.layout = layout or keymap.US
+        self._decode = compile_decode_table(self.layout)
+        self.modifier_state = 0
+        self._dead_key = None
 
     def start(self):
         if self.running:
             return
 
-        # Find keyboards
-        devices = [evdev.InputDevice(path) for path in evdev.list_devices()]
-        self.keyboards = []
-        for dev in devices:
-            cap = dev.capabilities()
-            if evdev.ecodes.EV_KEY in cap:
-                keys = cap[evdev.ecodes.EV_KEY]
-                if evdev.ecodes.KEY_A in keys:
-                    self.keyboards.append(dev)
-
-        if not self.keyboards:
+        # Watch before scanning, so a keyboard that appears in between, or
+        # after none was found at all, is still picked up
+        try:
+            self._watch = _DirectoryWatch(
+                INPUT_DIR, IN_CREATE | IN_ATTRIB | IN_DELETE | IN_MOVED_TO
+            )
+        except OSError as e:
+            print(f"EvdevListener: Hotplug disabled, cannot watch {INPUT_DIR}: {e}")
+            self._watch = None
+
+        # Find keyboards. Every event node is tried, not just the ones
+        # evdev.list_devices() reports as accessible, so that a user who may
+        # not open any of them is told so rather than left waiting.
+        self.keyboards = {}
+        self._denied = 0
+        nodes = sorted(glob.glob(os.path.join(INPUT_DIR, "event*")))
+        for path in nodes:
+            self._add_device(path)
+
+        if self.keyboards:
+            print(f"EvdevListener: Listening on {len(self.keyboards)} devices.")
+        elif nodes and self._denied == len(nodes):
+            print(f"EvdevListener: No keyboards found; no device in {INPUT_DIR} can be opened.")
+            self._close_watch()
+            return
+        elif self._watch:
+            print("EvdevListener: No keyboards found; waiting for one to be plugged in.")
+        else:
             print("EvdevListener: No keyboards found.")
             return
 
-        print(f"EvdevListener: Listening on {len(self.keyboards)} devices.")
+        self._wakeup_fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        self._selector = selectors.DefaultSelector()
+        for dev in self.keyboards.values():
+            self._selector.register(dev.fd, selectors.EVENT_READ, dev)
+        if self._watch:
+            self._selector.register(self._watch.fd, selectors.EVENT_READ, _HOTPLUG)
+        self._selector.register(self._wakeup_fd, selectors.EVENT_READ, _WAKEUP)
+
         self.running = True
-        self._stop_event.clear()
         self.thread = threading.Thread(target=self._run)
         self.thread.daemon = True
         self.thread.start()
 
     def stop(self):
+        if self._wakeup_fd is None:
+            return
         self.running = False
-        self._stop_event.set()
-        if self.thread:
-            self.thread.join(timeout=1.0)
+        os.eventfd_write(self._wakeup_fd, 1)
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+            os.close(self._wakeup_fd)
+            self._wakeup_fd = None
+
+    def _add_device(self, path):
+        """Open ``path`` and keep it if it is a keyboard. Returns the device or None."""
+        if path in self.keyboards:
+            return None
+        try:
+            dev = evdev.InputDevice(path)
+        except PermissionError:
+            self._denied += 1
+            return None
+        except OSError:
+            # Not readable (yet); udev may still be applying permissions
+            return None
 
-    def _run(self):
-        # We need a map of FD -> Device
-        fds = {dev.fd: dev for dev in self.keyboards}
+        # Our own uinput keyboard looks like any other; reading it would feed
+        # every injected key back into matching
+        if dev.name == DEVICE_NAME or dev.phys == DEVICE_PHYS:
+            dev.close()
+            return None
 
-        while self.running and not self._stop_event.is_set():
-            try:
-                r, w, x = select.select(fds, [], [], 0.5)
-            except Exception as e:
-                print(f"EvdevListener select error: {e}")
-                break
+        keys = dev.capabilities().get(evdev.ecodes.EV_KEY, [])
+        if evdev.ecodes.KEY_A not in keys:
+            dev.close()
+            return None
 
-            if not r:
-                continue
+        self.keyboards[path] = dev
+        return dev
 
-            for fd in r:
-                dev = fds.get(fd)
-                if not dev: continue
+    def _remove_device(self, dev):
+        if self.keyboards.pop(dev.path, None) is None:
+            return
+        try:
+            self._selector.unregister(dev.fd)
+        except (KeyError, ValueError):
+            pass
+        try:
+            dev.close()
+        except OSError:
+            pass
+        # Keys held on a vanished device will never report a release
+        self.pressed_keys.clear()
+        print(f"EvdevListener: Removed {dev.path}")
+
+    def _handle_hotplug(self):
+        for mask, name in self._watch.read():
+            if not name.startswith("event"):
+                continue
+            path = os.path.join(INPUT_DIR, name)
+            if mask & IN_DELETE:
+                dev = self.keyboards.get(path)
+                if dev:
+                    self._remove_device(dev)
+                continue
+            dev = self._add_device(path)
+            if dev:
+                self._selector.register(dev.fd, selectors.EVENT_READ, dev)
+                print(f"EvdevListener: Added {dev.path} ({dev.name})")
 
+    def _run(self):
+        try:
+            while self.running:
                 try:
-                    for event in dev.read():
-                        if event.type == evdev.ecodes.EV_KEY:
-                            self._process_key(event)
-                except OSError:
-                    # Device lost
-                    del fds[fd]
+                    ready = self._selector.select()
+                except OSError as e:
+                    print(f"EvdevListener select error: {e}")
+                    break
+
+                for selector_key, _ in ready:
+                    dev = selector_key.data
+                    if dev is _WAKEUP:
+                        return
+                    if dev is _HOTPLUG:
+                        self._handle_hotplug()
+                        continue
+
+                    try:
+                        for event in dev.read():
+                            if event.type == evdev.ecodes.EV_KEY:
+                                self._process_key(event)
+                    except BlockingIOError:
+                        pass
+                    except OSError:
+                        # Device lost (unplugged or gone with suspend)
+                        self._remove_device(dev)
+        finally:
+            self.running = False
+            self._close()
+
+    def _close(self):
+        for dev in list(self.keyboards.values()):
+            try:
+                dev.close()
+            except OSError:
+                pass
+        self.keyboards = {}
+        self._close_watch()
+        self._selector.close()
+
+    def _close_watch(self):
+        if self._watch:
+            self._watch.close()
+            self._watch = None
 
     def _process_key(self, event):
         # value 0=up, 1=down, 2=hold
@@ -136,14 +361,12 @@ class EvdevListener:
             self.pressed_keys.discard(key_code)
 
         # Update modifiers
-        if key_code in [evdev.ecodes.KEY_LEFTSHIFT, evdev.ecodes.KEY_RIGHTSHIFT]:
-            self.modifiers['shift'] = (val > 0)
-        elif key_code in [evdev.ecodes.KEY_LEFTCTRL, evdev.ecodes.KEY_RIGHTCTRL]:
-            self.modifiers['ctrl'] = (val > 0)
-        elif key_code in [evdev.ecodes.KEY_LEFTALT, evdev.ecodes.KEY_RIGHTALT]:
-            self.modifiers['alt'] = (val > 0)
+        if key_code in SHIFT_KEYS:
+            self._set_modifier(SHIFT, val > 0)
+        elif key_code in self.layout.level3_keys:
+            self._set_modifier(LEVEL3, val > 0)
         elif key_code == evdev.ecodes.KEY_CAPSLOCK and val == 1:
-            self.modifiers['caps'] = not self.modifiers['caps']
+            self.modifier_state ^= CAPS
 
         if val == 1: # Key Press
             key_obj = self._map_key(key_code)
@@ -153,93 +376,30 @@ class EvdevListener:
                 except Exception as e:
                     print(f"Error in on_press: {e}")
 
+    def _set_modifier(self, bit, down):
+        if down:
+            self.modifier_state |= bit
+        else:
+            self.modifier_state &= ~bit
+
     def _map_key(self, code):
-        # Map evdev code to pynput Key or KeyCode
-
-        # 1. Check for special keys
-        special_map = {
-            evdev.ecodes.KEY_BACKSPACE: Key.backspace,
-            evdev.ecodes.KEY_TAB: Key.tab,
-            evdev.ecodes.KEY_ENTER: Key.enter,
-            evdev.ecodes.KEY_ESC: Key.esc,
-            evdev.ecodes.KEY_SPACE: Key.space,
-            evdev.ecodes.KEY_DELETE: Key.delete,
-            evdev.ecodes.KEY_UP: Key.up,
-            evdev.ecodes.KEY_DOWN: Key.down,
-            evdev.ecodes.KEY_LEFT: Key.left,
-            evdev.ecodes.KEY_RIGHT: Key.right,
-            evdev.ecodes.KEY_HOME: Key.home,
-            evdev.ecodes.KEY_END: Key.end,
-            evdev.ecodes.KEY_PAGEUP: Key.page_up,
-            evdev.ecodes.KEY_PAGEDOWN: Key.page_down,
-            evdev.ecodes.KEY_LEFTSHIFT: Key.shift,
-            evdev.ecodes.KEY_RIGHTSHIFT: Key.shift_r,
-            evdev.ecodes.KEY_LEFTCTRL: Key.ctrl_l,
-            evdev.ecodes.KEY_RIGHTCTRL: Key.ctrl_r,
-            evdev.ecodes.KEY_LEFTALT: Key.alt_l,
-            evdev.ecodes.KEY_RIGHTALT: Key.alt_r,
-            evdev.ecodes.KEY_LEFTMETA: Key.cmd,
-            evdev.ecodes.KEY_RIGHTMETA: Key.cmd,
-            evdev.ecodes.KEY_CAPSLOCK: Key.caps_lock,
-            evdev.ecodes.KEY_F1: Key.f1, evdev.ecodes.KEY_F2: Key.f2,
-            evdev.ecodes.KEY_F3: Key.f3, evdev.ecodes.KEY_F4: Key.f4,
-            evdev.ecodes.KEY_F5: Key.f5, evdev.ecodes.KEY_F6: Key.f6,
-            evdev.ecodes.KEY_F7: Key.f7, evdev.ecodes.KEY_F8: Key.f8,
-            evdev.ecodes.KEY_F9: Key.f9, evdev.ecodes.KEY_F10: Key.f10,
-            evdev.ecodes.KEY_F11: Key.f11, evdev.ecodes.KEY_F12: Key.f12,
-        }
-
-        if code in special_map:
-            return special_map[code]
-
-        # 2. Check for char keys
-        # Uses evdev key names to derive chars
-        key_name = evdev.ecodes.keys.get(code)
-        if isinstance(key_name, list): key_name = key_name[0]
-
-        if not key_name or not isinstance(key_name, str):
+        # Map evdev code to pynput Key or KeyCode with one table lookup
+        try:
+            key = self._decode[code * STATES + self.modifier_state]
+        except IndexError:
+            return None
+        if key is None or code in SHIFT_KEYS or code in self.layout.level3_keys:
+            return key
+
+        # Dead keys produce nothing themselves; they change the next key
+        if type(key) is DeadKey:
+            self._dead_key = key
             return None
 
-        base_char = None
-        if key_name.startswith('KEY_'):
-            suffix = key_name[4:]
-            if len(suffix) == 1 and suffix.isalpha():
-                base_char = suffix.lower()
-            elif suffix.isdigit():
-                base_char = suffix
-            elif suffix == 'MINUS': base_char = '-'
-            elif suffix == 'EQUAL': base_char = '='
-            elif suffix == 'LEFTBRACE': base_char = '['
-            elif suffix == 'RIGHTBRACE': base_char = ']'
-            elif suffix == 'SEMICOLON': base_char = ';'
-            elif suffix == 'APOSTROPHE': base_char = "'"
-            elif suffix == 'GRAVE': base_char = '`'
-            elif suffix == 'BACKSLASH': base_char = '\\'
-            elif suffix == 'COMMA': base_char = ','
-            elif suffix == 'DOT': base_char = '.'
-            elif suffix == 'SLASH': base_char = '/'
-
-        if base_char:
-            # Apply modifiers
-            char = base_char
-            shift = self.modifiers['shift']
-            caps = self.modifiers['caps']
-
-            if base_char.isalpha():
-                if shift != caps:
-                    char = base_char.upper()
-            else:
-                if shift:
-                    # Symbol map
-                    sym_map = {
-                        '1':'!', '2':'@', '3':'#', '4':'$', '5':'%',
-                        '6':'^', '7':'&', '8':'*', '9':'(', '0':')',
-                        '-':'_', '=':'+', '[':'{', ']':'}',
-                        ';':':', "'":'"', '`':'~', '\\':'|',
-                        ',':'<', '.':'>', '/':'?'
-                    }
-                    char = sym_map.get(base_char, base_char)
-
-            return KeyCode(char=char)
-
-        return None
+        dead, self._dead_key = self._dead_key, None
+        if dead is not None:
+            if key == Key.space:
+                return KeyCode(char=keymap.compose(dead.combining, " "))
+            if isinstance(key, KeyCode):
+                return KeyCode(char=keymap.compose(dead.combining, key.char))
+        return key
@@ -0,0 +1,156 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+"""
+Local IPC between the editor and the expansion daemon.
+
+The daemon listens on a Unix socket in the user's runtime directory. Each
+request is one line of JSON, ``{"command": name}``, answered by one line of
+JSON: ``{"ok": true, ...}`` on success or ``{"ok": false, "error": ...}``.
+"""
+import json
+import os
+import socket
+import socketserver
+import stat
+import tempfile
+import threading
+from typing import Callable, Dict, Optional
+
+SOCKET_NAME = "rheolwyr.sock"
+REQUEST_TIMEOUT = 1.0
+
+
+def runtime_dir() -> str:
+    """
+    Per-user directory for the socket, lock file and daemon log.
+
+    Without XDG_RUNTIME_DIR a directory in /tmp is used, which anyone could
+    have created first; PermissionError is raised unless it is a real
+    directory owned by this user and private to it.
+    """
+    path = os.environ.get("XDG_RUNTIME_DIR")
+    if path:
+        return path
+    path = os.path.join(tempfile.gettempdir(), f"rheolwyr-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid()
+            or stat.S_IMODE(st.st_mode) != 0o700):
+        raise PermissionError(f"{path} is not a private directory owned by this user")
+    return path
+
+
+def socket_path() -> str:
+    return os.path.join(runtime_dir(), SOCKET_NAME)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("expected a JSON object")
+                command = request.get("command")
+                if not isinstance(command, str):
+                    raise ValueError("command must be a string")
+                reply = self.server.dispatch(command)
+            except ValueError as e:
+                reply = {"ok": False, "error": f"Bad request: {e}"}
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, handlers):
+        self.handlers = handlers
+        super().__init__(path, _Handler)
+
+    def dispatch(self, command):
+        handler = self.handlers.get(command)
+        if handler is None:
+            return {"ok": False, "error": f"Unknown command: {command}"}
+        try:
+            reply = handler() or {}
+        except Exception as e:
+            print(f"Error handling IPC command {command}: {e}")
+            return {"ok": False, "error": str(e)}
+        return {"ok": True, **reply}
+
+
+class IPCServer:
+    """
+    Serves ``handlers`` (command name -> callable returning a dict) on a
+    background thread. Only the daemon holding the listener lock should run
+    one, since starting replaces whatever socket is already at ``path``.
+    """
+    def __init__(self, handlers: Dict[str, Callable[[], Optional[dict]]], path=None):
+        self.path = path or socket_path()
+        self.handlers = handlers
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if self._server:
+            return
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        # Created private rather than chmod-ed after bind, which would leave
+        # it open to other users in between
+        umask = os.umask(0o177)
+        try:
+            self._server = _Server(self.path, self.handlers)
+        finally:
+            os.umask(umask)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._server:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join(timeout=1.0)
+        self._server = None
+        self._thread = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def request(command: str, path=None, timeout=REQUEST_TIMEOUT) -> Optional[dict]:
+    """
+    Send ``command`` to the daemon and return its reply.
+
+    Returns None if no daemon is listening or it does not answer in time.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path or socket_path())
+            sock.sendall(json.dumps({"command": command}).encode() + b"\n")
+            with sock.makefile("rb") as reply:
+                line = reply.readline()
+    except OSError:
+        return None
+    if not line:
+        return None
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
@@ -0,0 +1,498 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+"""
+Keyboard layout tables and injection plans.
+
+A Keymap describes which character each key produces at each shift level. It
+is either the built-in US layout or loaded from an XKB symbols file (the same
+format as /usr/share/X11/xkb/symbols), and is compiled once into flat tables:
+one for decoding evdev key presses, one for typing characters back.
+
+A snippet's content is compiled once into an InjectionPlan: the evdev keycodes
+(with Shift/AltGr state, and dead-key sequences) needed to type it, and the
+characters the layout cannot produce. Expansion then replays the plan without
+any per-character lookups.
+"""
+import os
+import re
+import unicodedata
+from typing import Dict, FrozenSet, NamedTuple, Optional, Tuple
+
+from evdev import ecodes as e
+
+# Modifier state bits. Decode tables are indexed by ``keycode << 3 | state``.
+SHIFT = 1
+CAPS = 2
+LEVEL3 = 4
+STATES = 8
+
+# Characters produced by each key on a US layout, without and with shift.
+US_KEYS = (
+    (e.KEY_A, 'a', 'A'), (e.KEY_B, 'b', 'B'), (e.KEY_C, 'c', 'C'), (e.KEY_D, 'd', 'D'),
+    (e.KEY_E, 'e', 'E'), (e.KEY_F, 'f', 'F'), (e.KEY_G, 'g', 'G'), (e.KEY_H, 'h', 'H'),
+    (e.KEY_I, 'i', 'I'), (e.KEY_J, 'j', 'J'), (e.KEY_K, 'k', 'K'), (e.KEY_L, 'l', 'L'),
+    (e.KEY_M, 'm', 'M'), (e.KEY_N, 'n', 'N'), (e.KEY_O, 'o', 'O'), (e.KEY_P, 'p', 'P'),
+    (e.KEY_Q, 'q', 'Q'), (e.KEY_R, 'r', 'R'), (e.KEY_S, 's', 'S'), (e.KEY_T, 't', 'T'),
+    (e.KEY_U, 'u', 'U'), (e.KEY_V, 'v', 'V'), (e.KEY_W, 'w', 'W'), (e.KEY_X, 'x', 'X'),
+    (e.KEY_Y, 'y', 'Y'), (e.KEY_Z, 'z', 'Z'),
+    (e.KEY_1, '1', '!'), (e.KEY_2, '2', '@'), (e.KEY_3, '3', '#'), (e.KEY_4, '4', '$'),
+    (e.KEY_5, '5', '%'), (e.KEY_6, '6', '^'), (e.KEY_7, '7', '&'), (e.KEY_8, '8', '*'),
+    (e.KEY_9, '9', '('), (e.KEY_0, '0', ')'),
+    (e.KEY_MINUS, '-', '_'), (e.KEY_EQUAL, '=', '+'),
+    (e.KEY_LEFTBRACE, '[', '{'), (e.KEY_RIGHTBRACE, ']', '}'),
+    (e.KEY_SEMICOLON, ';', ':'), (e.KEY_APOSTROPHE, "'", '"'),
+    (e.KEY_GRAVE, '`', '~'), (e.KEY_BACKSLASH, '\\', '|'),
+    (e.KEY_COMMA, ',', '<'), (e.KEY_DOT, '.', '>'), (e.KEY_SLASH, '/', '?'),
+    (e.KEY_SPACE, ' ', None), (e.KEY_ENTER, '\n', None), (e.KEY_TAB, '\t', None),
+)
+
+# XKB key names for the keys a layout may remap (evdev code = XKB code - 8)
+XKB_KEYCODES = {
+    "TLDE": e.KEY_GRAVE, "BKSL": e.KEY_BACKSLASH, "AC12": e.KEY_BACKSLASH,
+    "LSGT": e.KEY_102ND, "SPCE": e.KEY_SPACE,
+    "RALT": e.KEY_RIGHTALT, "LALT": e.KEY_LEFTALT,
+    "RCTL": e.KEY_RIGHTCTRL, "MENU": e.KEY_COMPOSE,
+}
+XKB_KEYCODES.update({f"AE{i:02d}": e.KEY_1 + i - 1 for i in range(1, 13)})
+XKB_KEYCODES.update({f"AD{i:02d}": e.KEY_Q + i - 1 for i in range(1, 13)})
+XKB_KEYCODES.update({f"AC{i:02d}": e.KEY_A + i - 1 for i in range(1, 12)})
+XKB_KEYCODES.update({f"AB{i:02d}": e.KEY_Z + i - 1 for i in range(1, 11)})
+
+# Keysyms that select the third shift level (AltGr)
+LEVEL3_KEYSYMS = frozenset(("ISO_Level3_Shift", "ISO_Level3_Latch", "Mode_switch"))
+
+# Dead keysyms and the combining mark each one adds to the next character
+DEAD_KEYS = {
+    "dead_grave": "\u0300", "dead_acute": "\u0301", "dead_circumflex": "\u0302",
+    "dead_tilde": "\u0303", "dead_macron": "\u0304", "dead_breve": "\u0306",
+    "dead_abovedot": "\u0307", "dead_diaeresis": "\u0308", "dead_abovering": "\u030a",
+    "dead_doubleacute": "\u030b", "dead_caron": "\u030c", "dead_belowdot": "\u0323",
+    "dead_cedilla": "\u0327", "dead_ogonek": "\u0328",
+}
+
+# Spacing forms of the combining marks, typed as dead key + space
+SPACING_ACCENTS = {
+    "\u0300": "`", "\u0301": "\u00b4", "\u0302": "^", "\u0303": "~",
+    "\u0304": "\u00af", "\u0306": "\u02d8", "\u0307": "\u02d9", "\u0308": "\u00a8",
+    "\u030a": "\u02da", "\u030b": "\u02dd", "\u030c": "\u02c7", "\u0327": "\u00b8",
+    "\u0328": "\u02db",
+}
+
+# Named keysyms that cannot be derived from Unicode character names. Anything
+# else is looked up in keysymdef.h when the X11 headers are installed.
+KEYSYM_NAMES = {
+    "space": " ", "exclam": "!", "quotedbl": '"', "numbersign": "#", "dollar": "$",
+    "percent": "%", "ampersand": "&", "apostrophe": "'", "quoteright": "'",
+    "parenleft": "(", "parenright": ")", "asterisk": "*", "plus": "+", "comma": ",",
+    "minus": "-", "period": ".", "slash": "/", "colon": ":", "semicolon": ";",
+    "less": "<", "equal": "=", "greater": ">", "question": "?", "at": "@",
+    "bracketleft": "[", "backslash": "\\", "bracketright": "]", "asciicircum": "^",
+    "underscore": "_", "grave": "`", "quoteleft": "`", "braceleft": "{", "bar": "|",
+    "braceright": "}", "asciitilde": "~",
+    "nobreakspace": "\u00a0", "exclamdown": "¡", "cent": "¢",
+    "sterling": "£", "currency": "¤", "yen": "¥", "brokenbar": "¦",
+    "section": "§", "diaeresis": "¨", "copyright": "©",
+    "ordfeminine": "ª", "guillemotleft": "«", "notsign": "¬",
+    "hyphen": "\u00ad", "registered": "®", "macron": "¯", "degree": "°",
+    "plusminus": "±", "twosuperior": "²", "threesuperior": "³",
+    "acute": "´", "mu": "µ", "paragraph": "¶", "periodcentered": "·",
+    "cedilla": "¸", "onesuperior": "¹", "masculine": "º",
+    "guillemotright": "»", "onequarter": "¼", "onehalf": "½",
+    "threequarters": "¾", "questiondown": "¿", "multiply": "×",
+    "division": "÷", "ssharp": "ß", "ae": "æ", "AE": "Æ",
+    "oslash": "ø", "Ooblique": "Ø", "Oslash": "Ø", "eth": "ð",
+    "ETH": "Ð", "thorn": "þ", "THORN": "Þ", "oe": "œ", "OE": "Œ",
+    "idotless": "ı", "EuroSign": "€", "endash": "–", "emdash": "—",
+    "ellipsis": "…", "leftsinglequotemark": "‘",
+    "rightsinglequotemark": "’", "singlelowquotemark": "‚",
+    "leftdoublequotemark": "“", "rightdoublequotemark": "”",
+    "doublelowquotemark": "„",
+}
+
+# Accent suffixes of Latin keysym names such as "eacute" or "Ccaron"
+_ACCENT_NAMES = {
+    "grave": "GRAVE", "acute": "ACUTE", "circumflex": "CIRCUMFLEX", "tilde": "TILDE",
+    "diaeresis": "DIAERESIS", "ring": "RING ABOVE", "cedilla": "CEDILLA",
+    "caron": "CARON", "breve": "BREVE", "ogonek": "OGONEK", "macron": "MACRON",
+    "abovedot": "DOT ABOVE", "belowdot": "DOT BELOW", "doubleacute": "DOUBLE ACUTE",
+    "stroke": "STROKE",
+}
+_LATIN_ACCENTED = re.compile(r"^([A-Za-z])(" + "|".join(_ACCENT_NAMES) + r")$")
+
+KEYSYM_HEADERS = (
+    "/usr/include/X11/keysymdef.h",
+    "/usr/include/xkbcommon/xkbcommon-keysyms.h",
+)
+_KEYSYM_DEFINE = re.compile(
+    r"#define\s+(?:XK|XKB_KEY)_(\w+)\s+0x([0-9a-fA-F]+)\s*(?:/\*\s*U\+([0-9a-fA-F]+))?"
+)
+_header_keysyms = None
+
+SYMBOLS_PATH = (
+    os.path.join(os.path.expanduser("~"), ".config", "rheolwyr", "xkb", "symbols"),
+    os.path.join(os.environ.get("XKB_CONFIG_ROOT", "/usr/share/X11/xkb"), "symbols"),
+)
+
+
+class DeadKey(NamedTuple):
+    """A dead key: adds ``combining`` to the next character typed."""
+    combining: str
+
+
+def compose(combining: str, char: str) -> str:
+    """Return what a dead key with ``combining`` followed by ``char`` produces."""
+    if char == " ":
+        return SPACING_ACCENTS.get(combining, combining)
+    composed = unicodedata.normalize("NFC", char + combining)
+    return composed if len(composed) == 1 else char
+
+
+def _load_header_keysyms():
+    global _header_keysyms
+    if _header_keysyms is None:
+        _header_keysyms = {}
+        for path in KEYSYM_HEADERS:
+            try:
+                with open(path, 'r', errors='replace') as f:
+                    text = f.read()
+            except OSError:
+                continue
+            for name, value, codepoint in _KEYSYM_DEFINE.findall(text):
+                value = int(value, 16)
+                if codepoint:
+                    _header_keysyms.setdefault(name, chr(int(codepoint, 16)))
+                elif value < 0x100:
+                    _header_keysyms.setdefault(name, chr(value))
+                elif value >= 0x1000000:
+                    _header_keysyms.setdefault(name, chr(value - 0x1000000))
+            break
+    return _header_keysyms
+
+
+def resolve_keysym(name: str):
+    """Resolve an XKB keysym name to a character, a DeadKey or None."""
+    if len(name) == 1:
+        return name
+    if name in KEYSYM_NAMES:
+        return KEYSYM_NAMES[name]
+    if name in DEAD_KEYS:
+        return DeadKey(DEAD_KEYS[name])
+    if re.fullmatch(r"U[0-9a-fA-F]{4,6}", name):
+        return chr(int(name[1:], 16))
+    if re.fullmatch(r"0x[0-9a-fA-F]+", name):
+        value = int(name, 16)
+        if value >= 0x1000000:
+            return chr(value - 0x1000000)
+        return chr(value) if 0x20 <= value < 0x100 else None
+
+    match = _LATIN_ACCENTED.match(name)
+    if match:
+        letter, accent = match.groups()
+        case = "CAPITAL" if letter.isupper() else "SMALL"
+        try:
+            return unicodedata.lookup(
+                f"LATIN {case} LETTER {letter.upper()} WITH {_ACCENT_NAMES[accent]}"
+            )
+        except KeyError:
+            pass
+
+    return _load_header_keysyms().get(name)
+
+
+class Keymap:
+    """
+    Characters produced by each key at the four XKB shift levels.
+
+    ``keys`` maps an evdev keycode to a tuple of up to four symbols (base,
+    shift, AltGr, AltGr+shift); each symbol is a character, a DeadKey or None.
+    ``level3_keys`` are the keycodes that select the AltGr levels.
+    """
+    def __init__(self, keys: Dict[int, Tuple], level3_keys=(), name="us"):
+        self.name = name
+        self.keys = {code: tuple(syms) + (None,) * (4 - len(syms)) for code, syms in keys.items()}
+        self.level3_keys = frozenset(level3_keys)
+
+    def _alphabetic(self, low, high):
+        return (
+            isinstance(low, str) and isinstance(high, str)
+            and low != high and low.upper() == high
+        )
+
+    def symbol(self, code: int, state: int):
+        """Return the symbol ``code`` produces in modifier ``state``."""
+        syms = self.keys.get(code)
+        if syms is None:
+            return None
+        shift = bool(state & SHIFT)
+        if state & CAPS and self._alphabetic(syms[0], syms[1]):
+            shift = not shift
+        level = 2 if state & LEVEL3 else 0
+        if state & LEVEL3 and state & CAPS and self._alphabetic(syms[2], syms[3]):
+            level += not bool(state & SHIFT)
+        else:
+            level += shift
+        # Keys without the requested level fall back to the levels below it
+        for candidate in (level, level & ~1, level & 1, 0):
+            if syms[candidate] is not None:
+                return syms[candidate]
+        return None
+
+    def decode_table(self):
+        """
+        Flat table of symbols indexed by ``keycode << 3 | state``.
+
+        Built once, so decoding a key press is a single list index.
+        """
+        size = (max(self.keys, default=0) + 1) * STATES
+        table = [None] * size
+        for code in self.keys:
+            for state in range(STATES):
+                table[code * STATES + state] = self.symbol(code, state)
+        return table
+
+    @property
+    def level3_key(self) -> Optional[int]:
+        """The key to hold for the AltGr levels, or None if there is none."""
+        if e.KEY_RIGHTALT in self.level3_keys:
+            return e.KEY_RIGHTALT
+        return min(self.level3_keys, default=None)
+
+    def char_table(self):
+        """
+        Reverse table: character -> keystrokes that type it.
+
+        Keystrokes are ``(keycode, modifiers)`` pairs, where modifiers is a
+        SHIFT/LEVEL3 mask. Most characters are a single keystroke; characters
+        only reachable through a dead key are two (the dead key, then the
+        base character). Simpler sequences win: plain keys over shifted keys,
+        shifted over AltGr, and any single keystroke over a dead-key sequence.
+        """
+        levels = (0, SHIFT)
+        if self.level3_key is not None:
+            levels += (LEVEL3, LEVEL3 | SHIFT)
+
+        table = {}
+        dead_keys = []
+        for mods in levels:
+            for code in sorted(self.keys):
+                symbol = self.symbol(code, mods)
+                if isinstance(symbol, DeadKey):
+                    dead_keys.append(((code, mods), symbol))
+                elif symbol is not None:
+                    table.setdefault(symbol, ((code, mods),))
+
+        bases = [(char, strokes[0]) for char, strokes in table.items() if len(char) == 1]
+        for stroke, dead in dead_keys:
+            for char, base in bases:
+                composed = compose(dead.combining, char)
+                if composed != char:
+                    table.setdefault(composed, (stroke, base))
+        return table
+
+
+def _us_keymap():
+    keys = {}
+    for code, base, shifted in US_KEYS:
+        keys[code] = (base, shifted) if shifted else (base,)
+    return Keymap(keys)
+
+
+US = _us_keymap()
+
+
+_COMMENTS = re.compile(r"//[^\n]*|/\*.*?\*/", re.S)
+_SECTION = re.compile(r"((?:\w+\s+)*)xkb_symbols\s+\"([^\"]+)\"\s*\{")
+_STATEMENT = re.compile(r"\binclude\s+\"([^\"]+)\"|\bkey\s+<(\w+)>\s*\{")
+_SYMBOL_LIST = re.compile(r"symbols\[\s*Group1\s*\]\s*=\s*\[([^\]]*)\]")
+_BRACKETED = re.compile(r"\w+\[\s*\w+\s*\]")
+
+
+def _matching_brace(text, start):
+    """Index just past the ``}`` matching the ``{`` at ``start``."""
+    depth = 0
+    for index in range(start, len(text)):
+        char = text[index]
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return index + 1
+    raise ValueError("Unbalanced braces in XKB symbols")
+
+
+def _find_section(text, variant):
+    sections = []
+    for match in _SECTION.finditer(text):
+        body_start = match.end() - 1
+        body = text[body_start + 1:_matching_brace(text, body_start) - 1]
+        sections.append((match.group(2), "default" in match.group(1).split(), body))
+    if not sections:
+        return None
+    for name, is_default, body in sections:
+        if variant is None and is_default or name == variant:
+            return body
+    return sections[0][2] if variant is None else None
+
+
+def _split_spec(spec):
+    """Split "de(nodeadkeys)" into ("de", "nodeadkeys")."""
+    match = re.fullmatch(r"\s*([^()\s]+)\s*(?:\(\s*([^()\s]+)\s*\))?\s*", spec)
+    if not match:
+        raise ValueError(f"Invalid XKB layout spec: {spec!r}")
+    return match.group(1), match.group(2)
+
+
+def _find_symbols_file(name, search_path):
+    if os.path.isabs(name):
+        return name if os.path.isfile(name) else None
+    for directory in search_path:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _parse_symbols(spec, search_path, keys, level3_keys, depth=0):
+    if depth > 8:
+        return
+    name, variant = _split_spec(spec)
+    path = _find_symbols_file(name, search_path)
+    if path is None:
+        raise FileNotFoundError(f"XKB symbols file not found: {name}")
+    with open(path, 'r', errors='replace') as f:
+        text = _COMMENTS.sub("", f.read())
+    body = _find_section(text, variant)
+    if body is None:
+        raise ValueError(f"No xkb_symbols section {variant!r} in {path}")
+
+    for match in _STATEMENT.finditer(body):
+        include, key_name = match.groups()
+        if include:
+            for part in re.split(r"[+|]", include):
+                if part.strip():
+                    try:
+                        _parse_symbols(part, search_path, keys, level3_keys, depth + 1)
+                    except (OSError, ValueError) as err:
+                        print(f"Keymap: skipping include {part!r}: {err}")
+            continue
+
+        code = XKB_KEYCODES.get(key_name)
+        key_end = _matching_brace(body, match.end() - 1)
+        key_body = body[match.end():key_end - 1]
+        if code is None:
+            continue
+
+        listed = _SYMBOL_LIST.search(key_body)
+        if listed is None:
+            listed = re.search(r"\[([^\]]*)\]", _BRACKETED.sub("", key_body))
+        if listed is None:
+            continue
+
+        names = [sym.strip() for sym in listed.group(1).split(",")]
+        if names and names[0] in LEVEL3_KEYSYMS:
+            level3_keys.add(code)
+            continue
+
+        # Later definitions override earlier ones level by level
+        syms = list(keys.get(code, (None,) * 4))
+        for level, sym_name in enumerate(names[:4]):
+            if sym_name and sym_name not in ("NoSymbol", "VoidSymbol"):
+                syms[level] = resolve_keysym(sym_name)
+        keys[code] = tuple(syms)
+
+
+def load_layout(spec: str, search_path=SYMBOLS_PATH) -> Keymap:
+    """
+    Load a layout from XKB symbols, e.g. "de", "fr(azerty)" or a file path.
+
+    ``include`` statements are followed, so stock layouts from
+    /usr/share/X11/xkb/symbols work as-is. Files in
+    ~/.config/rheolwyr/xkb/symbols take precedence.
+    """
+    keys = {code: syms for code, syms in US.keys.items()}
+    level3_keys = set()
+    parsed = {}
+    _parse_symbols(spec, search_path, parsed, level3_keys)
+    # Keys the layout leaves alone (space, enter, tab) keep their US meaning
+    keys.update(parsed)
+    return Keymap(keys, level3_keys, name=spec)
+
+
+def detect_layout() -> Optional[str]:
+    """Best guess at the system layout from XKB_DEFAULT_* or /etc/default/keyboard."""
+    layout = os.environ.get("XKB_DEFAULT_LAYOUT")
+    variant = os.environ.get("XKB_DEFAULT_VARIANT")
+    if not layout:
+        try:
+            with open("/etc/default/keyboard", 'r') as f:
+                settings = dict(
+                    line.strip().split("=", 1) for line in f if "=" in line
+                )
+        except OSError:
+            return None
+        layout = settings.get("XKBLAYOUT", "").strip('"')
+        variant = settings.get("XKBVARIANT", "").strip('"')
+    # Only the first of several configured layouts is active by default
+    layout = layout.split(",")[0].strip()
+    variant = (variant or "").split(",")[0].strip()
+    if not layout:
+        return None
+    return f"{layout}({variant})" if variant else layout
+
+
+def load_keymap(spec: Optional[str] = None) -> Keymap:
+    """
+    Load the keymap named by ``spec``, or the detected system layout.
+
+    Falls back to the built-in US layout when nothing is configured or the
+    layout cannot be read.
+    """
+    spec = spec or detect_layout()
+    if not spec or spec == "us":
+        return US
+    try:
+        return load_layout(spec)
+    except (OSError, ValueError) as err:
+        print(f"Keymap: cannot load layout {spec!r} ({err}), using US")
+        return US
+
+
+# char -> keystrokes that type it on the built-in US layout
+CHAR_TABLE = US.char_table()
+
+
+class InjectionPlan(NamedTuple):
+    """Precompiled keystrokes for one snippet body."""
+    keystrokes: Tuple[Tuple[int, int], ...]
+    untypable: FrozenSet[str]
+
+    @property
+    def typable(self) -> bool:
+        """True when every character can be typed directly."""
+        return not self.untypable
+
+
+def compile_plan(text: str, table=CHAR_TABLE) -> InjectionPlan:
+    """Compile ``text`` into the keystrokes that type it on ``table``'s layout."""
+    keystrokes = []
+    untypable = set()
+    for char in text:
+        strokes = table.get(char)
+        if strokes is None:
+            # Canonically equivalent characters (e.g. OHM SIGN for OMEGA)
+            # type as the form the layout has
+            strokes = table.get(unicodedata.normalize("NFC", char))
+        if strokes is None:
+            untypable.add(char)
+        else:
+            keystrokes.extend(strokes)
+    return InjectionPlan(tuple(keystrokes), frozenset(untypable))
@@ -13,10 +13,15 @@ Listener module for handling keyboard input and snippet expansion.
 """
 import logging
 import os
+import queue
+import threading
 import time
+from collections import OrderedDict
 
-from . import clipboard
+from . import clipboard, config
 from .database import Database
+from .matcher import KeystrokeBuffer, TriggerMatcher
+from .strategy import PYNPUT_KEY_COST, TYPE, InjectionStrategy
 
 try:
     from pynput import keyboard
@@ -39,6 +44,12 @@ try:
 except ImportError:
     UInputController = None
 
+try:
+    from .keymap import compile_plan, load_keymap
+except ImportError:
+    compile_plan = None
+    load_keymap = None
+
 
 
 try:
@@ -46,11 +57,52 @@ try:
 except ImportError:
     EvdevListener = None
 
+# How long after an injection its keys may still arrive at a listener that
+# sees them (pynput on X11), in seconds
+INJECTION_ECHO_GRACE = 0.1
+# Injection plans kept, least recently expanded dropped first; the same bound as
+# the database's content cache, which holds the bodies they were compiled from
+PLAN_CACHE_SIZE = 128
+
 class SnippetListener:
     def __init__(self):
         self.db = Database()
-        self.buffer = ""
         self.max_buffer_size = 50
+        # Recent keystrokes, each paired with the automaton state after it
+        self.keys = KeystrokeBuffer(self.max_buffer_size)
+
+        # Trigger automaton. The lock guards swapping in a rebuilt automaton
+        # while the input thread is matching.
+        self._lock = threading.Lock()
+        self.matcher = None
+        # Injection plans per snippet id, as (content, plan). Bodies are only
+        # read when a snippet is first expanded; the plan is compiled then and
+        # reused for as long as the content is unchanged.
+        self.plans = OrderedDict()
+        self._generation = None
+        self._changed_handler = None
+
+        # Keyboard layout, used both to decode evdev key presses and to type
+        # snippets back through uinput
+        self.keymap = load_keymap(config.get_keyboard_layout()) if load_keymap else None
+        self.char_table = self.keymap.char_table() if self.keymap else None
+        self.reload_snippets()
+
+        # Expansions run on their own worker so the input thread never sleeps.
+        # Keys that arrive while an expansion is being injected are deferred
+        # and replayed into the buffer once it has finished.
+        self._expansions = queue.Queue()
+        self._worker = None
+        self._injecting = False
+        self._deferred_keys = []
+        # Whether the active listener also receives the keys we inject.
+        # EvdevListener skips our uinput device; pynput's X11 listener
+        # cannot, so keys there are dropped for the injection window.
+        self._sees_injection = False
+        self._echo_deadline = 0.0
+
+        pacing = config.get_injection_pacing()
+
         # Check for Wayland
         self.is_wayland = os.environ.get("XDG_SESSION_TYPE", "").lower() == "wayland" or os.environ.get("WAYLAND_DISPLAY")
 
@@ -60,7 +112,9 @@ class SnippetListener:
         if self.is_wayland:
             if UInputController:
                 try:
-                    self.keyboard_controller = UInputController()
+                    self.keyboard_controller = UInputController(
+                        layout=self.keymap, **pacing
+                    )
                     print("Using UInputController for injection")
                 except Exception as e:
                     print(f"Failed to initialize UInputController: {e}")
@@ -73,6 +127,13 @@ class SnippetListener:
              # X11 fallback
              self.keyboard_controller = PynputController()
 
+        # Typing vs. clipboard, from costs measured on this controller
+        method = config.get_expansion_method()
+        if hasattr(self.keyboard_controller, 'send_plan'):
+            self.strategy = InjectionStrategy.for_uinput(**pacing, method=method)
+        else:
+            self.strategy = InjectionStrategy(PYNPUT_KEY_COST, method=method)
+
         self.listener = None
         self.running = False
 
@@ -81,19 +142,25 @@ class SnippetListener:
             return
         self.running = True
 
+        # Pick up edits made while we were stopped, then follow new ones
+        if self._generation != self.db.generation:
+            self.reload_snippets()
+        self._changed_handler = self.db.connect_changed(self._on_library_changed)
+
+        self._worker = threading.Thread(target=self._expansion_worker, daemon=True)
+        self._worker.start()
+
         # Use EvdevListener if on Wayland and available
         if self.is_wayland:
             if EvdevListener:
                 print("Starting EvdevListener (Wayland detected)...")
                 try:
-                    self.listener = EvdevListener(on_press=self.on_press)
+                    self.listener = EvdevListener(on_press=self.on_press, layout=self.keymap)
                     self.listener.start()
 
-                    # Verify if listener actually found devices
-                    # Wait a bit for thread to start?
-                    # logic inside EvdevListener.start checks for keyboards.
-                    # We might want EvdevListener to raise if no keyboards found.
-                    if not self.listener.keyboards:
+                    # Not running means no keyboard was found and none can
+                    # be picked up later either
+                    if not self.listener.running:
                          raise PermissionError("No keyboards detected. Please ensure you are in the 'input' group.")
 
                     return
@@ -104,6 +171,7 @@ class SnippetListener:
                  raise ImportError("evdev not found.")
 
         print("Starting pynput Listener...")
+        self._sees_injection = True
         try:
             self.listener = keyboard.Listener(on_press=self.on_press)
             self.listener.start()
@@ -113,53 +181,152 @@ class SnippetListener:
     def stop(self):
         if self.listener:
             self.listener.stop()
+        if self._changed_handler is not None:
+            self.db.disconnect_changed(self._changed_handler)
+            self._changed_handler = None
+        if self._worker:
+            self._expansions.put(None)
+            self._worker.join(timeout=1.0)
+            self._worker = None
         self.running = False
 
-    def on_press(self, key):
-        if not self.running:
+    def status(self):
+        """Summary of the running listener, as reported to the editor."""
+        with self._lock:
+            triggers = len(self.matcher) if self.matcher else 0
+        return {
+            "running": self.running,
+            "input": type(self.listener).__name__ if self.listener else None,
+            "injection": type(self.keyboard_controller).__name__,
+            "triggers": triggers,
+            "generation": self._generation,
+            "strategy": self.strategy.stats(),
+        }
+
+    def reload_snippets(self):
+        """Compile the trigger automaton from the current snippet library."""
+        generation = self.db.generation
+        # Normally the automaton is mapped from the index the database keeps
+        # next to the library; compile it here only if that is unavailable.
+        matcher = self.db.open_trigger_index()
+        if matcher is None:
+            matcher = TriggerMatcher(self.db.get_trigger_map().items())
+        with self._lock:
+            self.matcher = matcher
+            self.keys.rebase(matcher)
+            self._generation = generation
+
+    def _load_expansion(self, snippet_id):
+        """Return the (content, plan) to expand, or None if the snippet is gone."""
+        content = self.db.get_content(snippet_id)
+        if content is None:
+            return None
+        cached = self.plans.get(snippet_id)
+        if cached is not None and cached[0] == content:
+            self.plans.move_to_end(snippet_id)
+            return cached
+        plan = compile_plan(content, self.char_table) if compile_plan else None
+        self.plans[snippet_id] = (content, plan)
+        self.plans.move_to_end(snippet_id)
+        if len(self.plans) > PLAN_CACHE_SIZE:
+            self.plans.popitem(last=False)
+        return content, plan
+
+    @property
+    def buffer(self):
+        """The recently typed text, oldest character first."""
+        return str(self.keys)
+
+    def _on_library_changed(self, change, snippet_id):
+        # Called on the thread that wrote to the database (usually the GUI).
+        # Rebuilding here keeps the cost off the key press path entirely.
+        if self._generation != self.db.generation:
+            self.reload_snippets()
+
+    def on_press(self, key, injected=False):
+        # pynput 1.8+ tags synthetic events itself
+        if not self.running or injected:
             return
 
         try:
-            if hasattr(key, 'char') and key.char:
-                self.buffer += key.char
-            elif key == Key.space:
-                self.buffer += " "
-            elif key == Key.backspace:
-                self.buffer = self.buffer[:-1]
-            elif key == Key.enter:
-                self.buffer = "" # Reset on enter usually
-            else:
-                # Other special keys might reset buffer or be ignored
-                # For now let's not reset on shift/ctrl etc.
-                pass
-
-            # Trim buffer
-            if len(self.buffer) > self.max_buffer_size:
-                self.buffer = self.buffer[-self.max_buffer_size:]
-
+            with self._lock:
+                if self._sees_injection and (
+                    self._injecting or time.monotonic() < self._echo_deadline
+                ):
+                    # Our own keys coming back; nothing the user typed
+                    return
+                if self._injecting:
+                    self._deferred_keys.append(key)
+                    return
+                self._handle_key(key)
             self.check_match()
         except Exception as e:
             print(f"Error in listener: {e}")
 
+    def _handle_key(self, key):
+        keys = self.keys
+        if hasattr(key, 'char') and key.char:
+            for char in key.char:
+                keys.push(char, self.matcher.step(keys.state, char))
+        elif key == Key.space:
+            keys.push(" ", self.matcher.step(keys.state, " "))
+        elif key == Key.backspace:
+            keys.pop()
+        elif key == Key.enter:
+            keys.clear() # Reset on enter usually
+        else:
+            # Other special keys might reset buffer or be ignored
+            # For now let's not reset on shift/ctrl etc.
+            pass
+
     def check_match(self):
-        # We need to check if the *end* of the buffer matches any trigger.
-        # This is a bit inefficient (checking all triggers on every keypress).
-        # Optimization: Get all triggers once or cache them?
-        # For now, querying DB is safest for consistency, but maybe slow.
-        # Let's optimize by getting all snippets triggers and checking in memory.
-        # Since we are in the main thread (mostly), let's just query to be safe technically sqlite is fast enough for small DBs.
-        # Use get_all_snippets()
-
-        snippets = self.db.get_all_snippets()
-        for s in snippets:
-            # s: id, name, content, trigger
-            trigger = s[3]
-            if trigger and self.buffer.endswith(trigger):
-                self.expand_snippet(trigger, s[2])
-                self.buffer = "" # Reset buffer after expansion
+        # The automaton state already encodes every trigger that is a suffix
+        # of the buffer, so this is a single lookup regardless of library size.
+        with self._lock:
+            self._queue_match()
+
+    def _queue_match(self):
+        # Caller holds self._lock
+        match = self.matcher.match(self.keys.state)
+        # Triggers longer than the buffer can never be typed in full
+        if not match or len(match[0]) > self.max_buffer_size:
+            return False
+        trigger, snippet_id = match
+        self.keys.clear() # Reset buffer after expansion
+        self._injecting = True
+        self._expansions.put((trigger, snippet_id))
+        return True
+
+    def _expansion_worker(self):
+        while True:
+            job = self._expansions.get()
+            if job is None:
                 break
+            try:
+                trigger, snippet_id = job
+                expansion = self._load_expansion(snippet_id)
+                if expansion is not None:
+                    self.expand_snippet(trigger, *expansion)
+            except Exception as e:
+                print(f"Error expanding snippet: {e}")
+            finally:
+                self._finish_injection()
+
+    def _finish_injection(self):
+        # Replay whatever was typed during the injection, so the buffer
+        # reflects the text after the expansion rather than before it.
+        with self._lock:
+            self._injecting = False
+            if self._sees_injection:
+                self._echo_deadline = time.monotonic() + INJECTION_ECHO_GRACE
+            deferred, self._deferred_keys = self._deferred_keys, []
+            for index, key in enumerate(deferred):
+                self._handle_key(key)
+                if self._queue_match():
+                    self._deferred_keys = deferred[index + 1:]
+                    break
 
-    def expand_snippet(self, trigger, content):
+    def expand_snippet(self, trigger, content, plan=None):
         print(f"DEBUG: Expanding snippet '{trigger}' -> '{content}'")
 
         # Wait for physical keys to be released to avoid Wayland dropping injected keys
@@ -171,41 +338,60 @@ class SnippetListener:
                 time.sleep(0.01)
 
         # 1. Backspace the trigger
-        # We need to be careful not to delete too fast or too slow.
-        for _ in range(len(trigger)):
-            self.keyboard_controller.tap(Key.backspace)
-            time.sleep(0.01) # Small delay to ensure backspaces register
+        # uinput sends these as one paced batch; other controllers need a
+        # small delay per key to ensure backspaces register.
+        tap_repeated = getattr(self.keyboard_controller, 'tap_repeated', None)
+        if tap_repeated:
+            tap_repeated(Key.backspace, len(trigger))
+        else:
+            for _ in range(len(trigger)):
+                self.keyboard_controller.tap(Key.backspace)
+                time.sleep(0.01)
 
         # 2. Inject content
-        # Strategy: Use direct typing for short snippets (more reliable on Wayland)
-        # Use clipboard for long snippets (faster)
+        # Strategy: type when the layout can produce every character and
+        # typing is expected to be no slower than a clipboard round trip,
+        # going by what earlier expansions measured; paste otherwise.
+        send_plan = getattr(self.keyboard_controller, 'send_plan', None)
+        if send_plan and plan is None and compile_plan:
+            plan = compile_plan(content, self.char_table)
+        if send_plan and plan is not None:
+            keystrokes, typable = len(plan.keystrokes), plan.typable
+        else:
+            keystrokes, typable = len(content), True
+        method = self.strategy.choose(keystrokes, typable)
+        started = time.monotonic()
 
-        if len(content) < 50:
+        if method == TYPE:
             print("Using direct typing for expansion")
-            self.keyboard_controller.type(content)
+            if send_plan and plan is not None:
+                send_plan(plan)
+            else:
+                self.keyboard_controller.type(content)
         else:
             print("Using clipboard for expansion")
-            # 2a. Copy content to clipboard
+            # 2a. Copy content to clipboard, saving what was there (best effort)
             try:
-                # Save old clipboard if possible (best effort)
-                old_clipboard = clipboard.paste().decode('utf-8')
+                saved = clipboard.snapshot()
             except Exception:
                 logging.error('Failed to save old clipboard', exc_info=True)
-                old_clipboard = ""
+                saved = None
 
-            clipboard.copy(content)
-
-            # 2b. Paste
-            # Simulating Ctrl+V
-            # Note: In some terminals Ctrl+Shift+V is needed. This is hard to detect.
-            # But standard GTK/Cosmic apps use Ctrl+V.
-            time.sleep(0.1) # Wait for clipboard to update
+            try:
+                clipboard.copy(content)
+
+                # 2b. Paste
+                # Simulating Ctrl+V. copy() returns once the content is available.
+                # Note: In some terminals Ctrl+Shift+V is needed. This is hard to detect.
+                # But standard GTK/Cosmic apps use Ctrl+V.
+                with self.keyboard_controller.pressed(Key.ctrl):
+                    self.keyboard_controller.tap('v')
+            except Exception:
+                clipboard.discard(saved)
+                raise
 
-            with self.keyboard_controller.pressed(Key.ctrl):
-                self.keyboard_controller.tap('v')
+            # 2c. Put the old clipboard back once the target has had time to
+            # paste, without holding up the worker
+            clipboard.restore_later(saved, content)
 
-            # Give it a moment, then restore clipboard?
-            # Text expanders usually restore clipboard.
-            time.sleep(0.2)
-            if old_clipboard:
-                 clipboard.copy(old_clipboard)
+        self.strategy.record(method, keystrokes, time.monotonic() - started)
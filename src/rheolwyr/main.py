@@ -2,7 +2,9 @@
 # Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
 # Licensed under GPLv3 or later
 
+import os
 import signal
+import subprocess
 import sys
 
 import gi
@@ -12,34 +14,81 @@ gi.require_version('Adw', '1')
 
 from gi.repository import Adw, Gio, GLib
 
-from .listener import SnippetListener
+from . import ipc
 from .window import RheolwyrWindow
 
+DAEMON_LOG = "rheolwyr-daemon.log"
+# How long to watch a freshly spawned daemon for start-up failures, in 250 ms polls
+DAEMON_START_POLLS = 40
+
 
 class RheolwyrApp(Adw.Application):
     def __init__(self):
         super().__init__(application_id='com.taliskerman.rheolwyr',
                          flags=Gio.ApplicationFlags.FLAGS_NONE)
         self.window = None
-        self.listener = None
+        # Expansion runs in rheolwyr-daemon; this is set if we started it
+        self.daemon = None
+        self._daemon_polls = 0
 
     def do_shutdown(self):
-        if self.listener:
-            self.listener.stop()
+        if self.daemon and self.daemon.poll() is None:
+            self.daemon.terminate()
         Adw.Application.do_shutdown(self)
 
     def do_activate(self):
         if not self.window:
-            self.window = RheolwyrWindow(self)
+            self.window = RheolwyrWindow(self, on_ready=self._on_library_ready)
         self.window.present()
 
-        # Start listener
+    def _on_library_ready(self, db):
+        db.connect_changed(self._notify_daemon)
+        # Asking whether a daemon is running can wait out the IPC timeout
+        self.window.run_in_background(ipc.request, "status", on_done=self._ensure_daemon)
+
+    def _ensure_daemon(self, status):
+        """Start rheolwyr-daemon unless one is already answering."""
+        if status is not None:
+            return
         try:
-            self.listener = SnippetListener()
-            self.listener.start()
-        except Exception as e:
-            print(f"Error starting listener: {e}")
-            self.window.show_error_dialog(str(e))
+            log_path = os.path.join(ipc.runtime_dir(), DAEMON_LOG)
+            with open(log_path, 'w') as log:
+                self.daemon = subprocess.Popen(
+                    [sys.executable, "-m", "rheolwyr.daemon"],
+                    stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                    start_new_session=True,
+                )
+        except OSError as e:
+            print(f"Error starting daemon: {e}")
+            self.window.show_message_dialog("Error", str(e))
+            return
+        self._daemon_polls = 0
+        GLib.timeout_add(250, self._check_daemon, log_path)
+
+    def _check_daemon(self, log_path):
+        returncode = self.daemon.poll()
+        if returncode is None:
+            self._daemon_polls += 1
+            if self._daemon_polls < DAEMON_START_POLLS:
+                return GLib.SOURCE_CONTINUE
+            return GLib.SOURCE_REMOVE
+        if returncode != 0:
+            # The daemon prints why it could not start (e.g. permissions)
+            try:
+                with open(log_path, 'r') as log:
+                    message = log.read().strip()
+            except OSError:
+                message = ""
+            message = message or "Text expansion could not start."
+            self.window.show_message_dialog("Error", message)
+        return GLib.SOURCE_REMOVE
+
+    def _notify_daemon(self, change, snippet_id):
+        # Runs on the thread that made the change, never the GTK main loop
+        if change == "external":
+            return
+        if ipc.request("changed") is None:
+            print("Error notifying daemon: no reply")
 
     def do_startup(self):
         Adw.Application.do_startup(self)
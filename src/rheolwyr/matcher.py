@@ -0,0 +1,324 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+"""
+Compiled trigger matcher used by the listener.
+
+Triggers are compiled once into an Aho-Corasick automaton. The listener keeps
+a single integer state and advances it by one transition per typed character,
+so the cost of a key press does not depend on how many snippets exist.
+
+A compiled automaton can also be saved as a flat binary index (to_bytes) and
+used straight from a memory map (MappedTriggerMatcher), so a starting listener
+does not have to rebuild anything. The index records a fingerprint of the
+entries it was built from, so a stale one can be recognised.
+"""
+import hashlib
+import mmap
+import struct
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Trigger index layout, all little-endian:
+#   header
+#   one state record per state, in state order
+#   edges, grouped by state and sorted by code point within a state
+#   one entry record per trigger
+#   trigger text, UTF-8
+INDEX_MAGIC = b"RHTI"
+INDEX_VERSION = 2
+# magic, version, entries fingerprint, states, edges, entries
+_HEADER = struct.Struct("<4sI16sIII")
+_STATE = struct.Struct("<IIIi")  # first edge, edge count, failure link, output entry
+_EDGE = struct.Struct("<II")  # code point, target state
+_ENTRY = struct.Struct("<qII")  # snippet id, text offset, text length
+
+
+def trigger_fingerprint(entries: Iterable[Tuple[str, int]]) -> bytes:
+    """Digest of ``(trigger, snippet id)`` entries, order included."""
+    digest = hashlib.blake2b(digest_size=16)
+    for trigger, value in entries:
+        digest.update(f"{value}\0{trigger}\0".encode("utf-8"))
+    return digest.digest()
+
+
+class TriggerMatcher:
+    """
+    Aho-Corasick automaton over snippet triggers.
+
+    Entries are given in priority order. When several triggers end at the same
+    position (e.g. ";sig" and "sig"), the one given first wins, which mirrors the
+    old behaviour of scanning snippets in name order and taking the first hit.
+    """
+    ROOT = 0
+
+    def __init__(self, entries: Iterable[Tuple[str, object]] = ()):
+        # Trie edges, failure links and the best entry reported at each state.
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[int] = [-1]
+        # Memoized transitions (goto + failure chain) so steady-state typing
+        # is a single dict lookup per key.
+        self._delta: List[Dict[str, int]] = [{}]
+        self._entries: List[Tuple[str, object]] = []
+
+        for trigger, value in entries:
+            self._add(trigger, value)
+        self._build_links()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add(self, trigger, value):
+        if not trigger:
+            return
+        state = self.ROOT
+        for char in trigger:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(-1)
+                self._delta.append({})
+            state = nxt
+        # Keep the first (highest priority) entry for duplicate triggers.
+        if self._out[state] == -1:
+            self._out[state] = len(self._entries)
+            self._entries.append((trigger, value))
+
+    def _build_links(self):
+        queue = deque(self._goto[self.ROOT].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, self.ROOT)
+                self._fail[nxt] = target if target != nxt else self.ROOT
+                # Merge outputs along the failure link, preferring the
+                # entry that was given first.
+                inherited = self._out[self._fail[nxt]]
+                own = self._out[nxt]
+                if own == -1 or (inherited != -1 and inherited < own):
+                    self._out[nxt] = inherited
+
+    def step(self, state: int, char: str) -> int:
+        """Return the state reached from ``state`` after reading ``char``."""
+        delta = self._delta[state]
+        nxt = delta.get(char)
+        if nxt is not None:
+            return nxt
+
+        probe = state
+        while probe and char not in self._goto[probe]:
+            probe = self._fail[probe]
+        nxt = self._goto[probe].get(char, self.ROOT)
+        delta[char] = nxt
+        return nxt
+
+    def feed(self, text: str, state: int = ROOT) -> int:
+        """Advance through every character of ``text``."""
+        for char in text:
+            state = self.step(state, char)
+        return state
+
+    def match(self, state: int) -> Optional[Tuple[str, object]]:
+        """Return the ``(trigger, value)`` ending at ``state``, if any."""
+        index = self._out[state]
+        if index == -1:
+            return None
+        return self._entries[index]
+
+    def to_bytes(self, fingerprint: bytes = b"") -> bytes:
+        """
+        Serialize the automaton as a trigger index for MappedTriggerMatcher.
+
+        Entry values must be integers (snippet ids). ``fingerprint`` (up to 16
+        bytes, see trigger_fingerprint()) is stored in the header.
+        """
+        states = []
+        edges = []
+        for state, goto in enumerate(self._goto):
+            states.append(_STATE.pack(len(edges), len(goto), self._fail[state], self._out[state]))
+            edges.extend(_EDGE.pack(ord(char), nxt) for char, nxt in sorted(goto.items()))
+        entries = []
+        text = bytearray()
+        for trigger, value in self._entries:
+            encoded = trigger.encode("utf-8")
+            entries.append(_ENTRY.pack(value, len(text), len(encoded)))
+            text += encoded
+        header = _HEADER.pack(INDEX_MAGIC, INDEX_VERSION, fingerprint,
+                              len(states), len(edges), len(entries))
+        return b"".join([header, *states, *edges, *entries, bytes(text)])
+
+
+class MappedTriggerMatcher:
+    """
+    TriggerMatcher read directly from a trigger index file.
+
+    The file is memory-mapped and looked up in place: nothing is parsed up
+    front, and processes mapping the same file share its pages. Transitions
+    are memoized as they are taken, like TriggerMatcher.step().
+
+    Raises ValueError if the file is not a trigger index of this version.
+    """
+    ROOT = TriggerMatcher.ROOT
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, fingerprint, states, edges, entries = _HEADER.unpack_from(self._map, 0)
+        except struct.error:
+            raise ValueError(f"{path} is not a trigger index")
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError(f"{path} is not a version {INDEX_VERSION} trigger index")
+        self._states = _HEADER.size
+        self._edges = self._states + states * _STATE.size
+        self._entries = self._edges + edges * _EDGE.size
+        self._text = self._entries + entries * _ENTRY.size
+        self._count = entries
+        self.fingerprint = fingerprint
+        if len(self._map) < self._text or not states:
+            raise ValueError(f"{path} is truncated")
+        self._delta: Dict[int, Dict[str, int]] = {}
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._map.close()
+
+    def _goto(self, state: int, code: int) -> int:
+        """Trie edge from ``state`` on ``code``, or -1."""
+        first, count, _, _ = _STATE.unpack_from(self._map, self._states + state * _STATE.size)
+        lo, hi = first, first + count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            edge_code, target = _EDGE.unpack_from(self._map, self._edges + mid * _EDGE.size)
+            if edge_code == code:
+                return target
+            if edge_code < code:
+                lo = mid + 1
+            else:
+                hi = mid
+        return -1
+
+    def _fail(self, state: int) -> int:
+        return _STATE.unpack_from(self._map, self._states + state * _STATE.size)[2]
+
+    def step(self, state: int, char: str) -> int:
+        """Return the state reached from ``state`` after reading ``char``."""
+        delta = self._delta.get(state)
+        if delta is None:
+            delta = self._delta[state] = {}
+        nxt = delta.get(char)
+        if nxt is not None:
+            return nxt
+
+        code = ord(char)
+        probe = state
+        while True:
+            nxt = self._goto(probe, code)
+            if nxt != -1 or probe == self.ROOT:
+                break
+            probe = self._fail(probe)
+        if nxt == -1:
+            nxt = self.ROOT
+        delta[char] = nxt
+        return nxt
+
+    def feed(self, text: str, state: int = ROOT) -> int:
+        """Advance through every character of ``text``."""
+        for char in text:
+            state = self.step(state, char)
+        return state
+
+    def match(self, state: int) -> Optional[Tuple[str, object]]:
+        """Return the ``(trigger, value)`` ending at ``state``, if any."""
+        index = _STATE.unpack_from(self._map, self._states + state * _STATE.size)[3]
+        if index == -1:
+            return None
+        value, offset, length = _ENTRY.unpack_from(self._map, self._entries + index * _ENTRY.size)
+        start = self._text + offset
+        return self._map[start:start + length].decode("utf-8"), value
+
+
+class KeystrokeBuffer:
+    """
+    Fixed-size ring of recently typed characters.
+
+    Alongside each character the buffer records the matcher state reached after
+    it, so appending and backspacing are O(1) and a backspace rewinds the matcher
+    without re-reading the text. Nothing is allocated per key; the text itself is
+    only assembled when someone asks for it.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._chars = [""] * size
+        self._states = [TriggerMatcher.ROOT] * size
+        self._end = 0
+        self._len = 0
+        self.state = TriggerMatcher.ROOT
+
+    def __len__(self):
+        return self._len
+
+    def __str__(self):
+        return self.suffix(self._len)
+
+    def push(self, char: str, state: int):
+        """Append ``char`` and the matcher state reached after it."""
+        end = self._end
+        self._chars[end] = char
+        self._states[end] = state
+        end += 1
+        self._end = 0 if end == self.size else end
+        if self._len < self.size:
+            self._len += 1
+        self.state = state
+
+    def pop(self) -> int:
+        """Drop the newest character and return the rewound matcher state."""
+        if self._len:
+            self._end = (self._end - 1) % self.size
+            self._len -= 1
+        if self._len:
+            self.state = self._states[(self._end - 1) % self.size]
+        else:
+            self.state = TriggerMatcher.ROOT
+        return self.state
+
+    def clear(self):
+        self._end = 0
+        self._len = 0
+        self.state = TriggerMatcher.ROOT
+
+    def suffix(self, length: int) -> str:
+        """Return the newest ``length`` characters as a string."""
+        length = min(length, self._len)
+        start = (self._end - length) % self.size
+        if start + length <= self.size:
+            return "".join(self._chars[start:start + length])
+        return "".join(self._chars[start:]) + "".join(self._chars[:self._end])
+
+    def rebase(self, matcher: TriggerMatcher):
+        """Recompute the stored states after the automaton has been rebuilt."""
+        state = TriggerMatcher.ROOT
+        index = (self._end - self._len) % self.size
+        for _ in range(self._len):
+            state = matcher.step(state, self._chars[index])
+            self._states[index] = state
+            index = (index + 1) % self.size
+        self.state = state
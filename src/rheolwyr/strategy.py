@@ -0,0 +1,106 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+"""
+Choice between typing an expansion and pasting it through the clipboard.
+
+Typing costs roughly a fixed amount per keystroke, set by the controller and
+its pacing; pasting costs roughly a fixed amount per expansion (saving and
+setting the clipboard, then Ctrl+V). InjectionStrategy keeps a running
+estimate of both, starting from the configured pacing and corrected by
+timing every expansion, and types whenever that is expected to be as fast.
+Content the layout cannot type is always pasted.
+"""
+import threading
+from typing import Optional
+
+TYPE = "type"
+PASTE = "paste"
+AUTO = "auto"
+
+# Weight of each new measurement in the running averages
+SMOOTHING = 0.2
+# Starting estimates, in seconds, before anything has been measured
+PASTE_COST = 0.1
+KEY_WRITE_COST = 0.0001  # One uinput keystroke, on top of its pacing
+PYNPUT_KEY_COST = 0.002  # One pynput keystroke; a round trip to the X server each
+
+
+class InjectionStrategy:
+    """
+    Picks TYPE or PASTE per expansion from estimated cost.
+
+    ``method`` forces one of them instead (see config.get_expansion_method()).
+    Safe to share between threads.
+    """
+    def __init__(self, key_cost: float, paste_cost: float = PASTE_COST, method: str = AUTO):
+        self.key_cost = key_cost
+        self.paste_cost = paste_cost
+        self.method = method
+        self.counts = {TYPE: 0, PASTE: 0}
+        self.last = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_uinput(cls, key_delay=0.0, burst_size=8, burst_delay=0.0, **kwargs):
+        """Starting estimates for UInputController with the given pacing."""
+        key_cost = key_delay + burst_delay / max(1, burst_size) + KEY_WRITE_COST
+        return cls(key_cost, **kwargs)
+
+    def estimate(self, keystrokes: int):
+        """Expected seconds to (type, paste) an expansion of ``keystrokes``."""
+        with self._lock:
+            return keystrokes * self.key_cost, self.paste_cost
+
+    def choose(self, keystrokes: int, typable: bool = True) -> str:
+        """TYPE or PASTE for an expansion of ``keystrokes`` keystrokes."""
+        if not typable:
+            method = PASTE
+        elif self.method in (TYPE, PASTE):
+            method = self.method
+        else:
+            type_cost, paste_cost = self.estimate(keystrokes)
+            method = TYPE if type_cost <= paste_cost else PASTE
+        with self._lock:
+            self.counts[method] += 1
+            self.last = {"method": method, "keystrokes": keystrokes, "seconds": None}
+        return method
+
+    def record(self, method: str, keystrokes: int, seconds: float):
+        """Fold the measured duration of an expansion into the estimates."""
+        with self._lock:
+            if method == TYPE:
+                if keystrokes:
+                    self.key_cost += SMOOTHING * (seconds / keystrokes - self.key_cost)
+            else:
+                self.paste_cost += SMOOTHING * (seconds - self.paste_cost)
+            if self.last is not None and self.last["method"] == method:
+                self.last["seconds"] = seconds
+
+    def crossover(self) -> Optional[int]:
+        """Keystrokes above which pasting is expected to be faster."""
+        with self._lock:
+            if not self.key_cost:
+                return None
+            return int(self.paste_cost / self.key_cost)
+
+    def stats(self) -> dict:
+        """Current estimates and decisions, for status reports and tuning."""
+        crossover = self.crossover()
+        with self._lock:
+            return {
+                "method": self.method,
+                "key_cost_ms": self.key_cost * 1000.0,
+                "paste_cost_ms": self.paste_cost * 1000.0,
+                "crossover_keystrokes": crossover,
+                "typed": self.counts[TYPE],
+                "pasted": self.counts[PASTE],
+                "last": dict(self.last) if self.last else None,
+            }
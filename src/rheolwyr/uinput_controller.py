@@ -8,6 +8,8 @@
 # Rheolwyr is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
 
+import os
+import struct
 import time
 from contextlib import contextmanager
 
@@ -15,19 +17,78 @@ try:
     import evdev
     from evdev import UInput
     from evdev import ecodes as e
+
+    from . import keymap
+    from .keymap import LEVEL3, SHIFT
 except ImportError:
     evdev = None
 
+try:
+    from pynput.keyboard import Key
+except ImportError:
+    class Key:
+        space = "space"
+        enter = "enter"
+        backspace = "backspace"
+        tab = "tab"
+        esc = "esc"
+        delete = "delete"
+        up = "up"
+        down = "down"
+        left = "left"
+        right = "right"
+        home = "home"
+        end = "end"
+        page_up = "page_up"
+        page_down = "page_down"
+        shift = "shift"
+        ctrl = "ctrl"
+        alt = "alt"
+        cmd = "cmd"
+        caps_lock = "caps_lock"
+
+# struct input_event: timeval, type, code, value. uinput ignores the timestamp,
+# so a zeroed timeval is fine and whole sequences can go out in one write().
+_EVENT = struct.Struct('llHHi')
+EV_SYN = 0x00
+EV_KEY = 0x01
+SYN_REPORT = 0
+
+
+def _event(ev_type, code, value):
+    return _EVENT.pack(0, 0, ev_type, code, value)
+
+
+_SYN = _event(EV_SYN, SYN_REPORT, 0)
+
+# Most events written between pauses. The kernel queues up to 64 events per
+# evdev client (63 usable) before dropping them with SYN_DROPPED, so a burst
+# must fit with room to spare for whatever the compositor has not read yet.
+MAX_BURST_EVENTS = 32
+
+# Identity of our virtual keyboard, so EvdevListener can leave it out and
+# injected keys never come back through the listener
+DEVICE_NAME = 'Rheolwyr-UInput-Keyboard'
+DEVICE_PHYS = 'rheolwyr/uinput0'
+
+
 class UInputController:
     """
     A controller that uses /dev/uinput to inject key events.
     This works on Wayland where XTest-based injection (pynput) fails.
     Requires user to be in 'input' or 'uinput' group and /dev/uinput to have correct permissions.
+
+    Keystrokes are encoded up front and written in bursts of at most
+    ``burst_size`` keystrokes and MAX_BURST_EVENTS events, pausing
+    ``burst_delay`` seconds between bursts and ``key_delay`` seconds after
+    every keystroke. See config.get_injection_pacing().
     """
-    def __init__(self):
+    def __init__(self, key_delay=0.0, burst_size=8, burst_delay=0.002, layout=None):
         if evdev is None:
             raise ImportError("evdev library is required for UInputController")
 
+        self.layout = layout or keymap.US
+
         # Define the capabilities of the virtual keyboard
         # We need to support all keys that might be typed or used for shortcuts
         cap = {
@@ -51,88 +112,28 @@ class UInputController:
                 e.KEY_ESC, e.KEY_DELETE, e.KEY_INSERT
             ]
         }
+        # Plus whatever else the layout types with (e.g. the ISO <> key)
+        extra = set(self.layout.keys) | self.layout.level3_keys
+        cap[e.EV_KEY] += sorted(extra.difference(cap[e.EV_KEY]))
 
         try:
-            self.ui = UInput(cap, name='Rheolwyr-UInput-Keyboard', version=0x1)
+            self.ui = UInput(cap, name=DEVICE_NAME, version=0x1, phys=DEVICE_PHYS)
         except PermissionError:
             print("Error: Permission denied for /dev/uinput.")
             print("Please ensure you have run scripts/setup_permissions.sh and logged out/in.")
             raise
 
-        # Mapping from pynput keys/chars to evdev ecodes
-        self.char_map = {
-            'a': e.KEY_A, 'b': e.KEY_B, 'c': e.KEY_C, 'd': e.KEY_D, 'e': e.KEY_E,
-            'f': e.KEY_F, 'g': e.KEY_G, 'h': e.KEY_H, 'i': e.KEY_I, 'j': e.KEY_J,
-            'k': e.KEY_K, 'l': e.KEY_L, 'm': e.KEY_M, 'n': e.KEY_N, 'o': e.KEY_O,
-            'p': e.KEY_P, 'q': e.KEY_Q, 'r': e.KEY_R, 's': e.KEY_S, 't': e.KEY_T,
-            'u': e.KEY_U, 'v': e.KEY_V, 'w': e.KEY_W, 'x': e.KEY_X, 'y': e.KEY_Y,
-            'z': e.KEY_Z,
-            '1': e.KEY_1, '2': e.KEY_2, '3': e.KEY_3, '4': e.KEY_4, '5': e.KEY_5,
-            '6': e.KEY_6, '7': e.KEY_7, '8': e.KEY_8, '9': e.KEY_9, '0': e.KEY_0,
-            '\n': e.KEY_ENTER, '\t': e.KEY_TAB, ' ': e.KEY_SPACE,
-            '-': e.KEY_MINUS, '=': e.KEY_EQUAL, '[': e.KEY_LEFTBRACE, ']': e.KEY_RIGHTBRACE,
-            ';': e.KEY_SEMICOLON, '\'': e.KEY_APOSTROPHE, '`': e.KEY_GRAVE, '\\': e.KEY_BACKSLASH,
-            ',': e.KEY_COMMA, '.': e.KEY_DOT, '/': e.KEY_SLASH
-        }
+        self.key_delay = key_delay
+        self.burst_size = max(1, burst_size)
+        self.burst_delay = burst_delay
 
-        # Upper case mapping (requires shift) - simplistic approach
-        self.shift_chars = {
-            'A': e.KEY_A, 'B': e.KEY_B, 'C': e.KEY_C, 'D': e.KEY_D, 'E': e.KEY_E,
-            'F': e.KEY_F, 'G': e.KEY_G, 'H': e.KEY_H, 'I': e.KEY_I, 'J': e.KEY_J,
-            'K': e.KEY_K, 'L': e.KEY_L, 'M': e.KEY_M, 'N': e.KEY_N, 'O': e.KEY_O,
-            'P': e.KEY_P, 'Q': e.KEY_Q, 'R': e.KEY_R, 'S': e.KEY_S, 'T': e.KEY_T,
-            'U': e.KEY_U, 'V': e.KEY_V, 'W': e.KEY_W, 'X': e.KEY_X, 'Y': e.KEY_Y,
-            'Z': e.KEY_Z,
-            '!': e.KEY_1, '@': e.KEY_2, '#': e.KEY_3, '$': e.KEY_4, '%': e.KEY_5,
-            '^': e.KEY_6, '&': e.KEY_7, '*': e.KEY_8, '(': e.KEY_9, ')': e.KEY_0,
-            '_': e.KEY_MINUS, '+': e.KEY_EQUAL, '{': e.KEY_LEFTBRACE, '}': e.KEY_RIGHTBRACE,
-            ':': e.KEY_SEMICOLON, '"': e.KEY_APOSTROPHE, '~': e.KEY_GRAVE, '|': e.KEY_BACKSLASH,
-            '<': e.KEY_COMMA, '>': e.KEY_DOT, '?': e.KEY_SLASH
-        }
+        # Mapping from chars to keystrokes on the layout, shared with the
+        # snippet plans compiled by keymap.compile_plan()
+        self.char_table = self.layout.char_table()
+        self.level3_key = self.layout.level3_key
 
-    def _get_keycode(self, key):
-        """Resolves a key (char or pynput Key) to an evdev keycode and modifier requirement."""
-        try:
-            from pynput.keyboard import Key
-        except ImportError:
-            class Key:
-                space = "space"
-                enter = "enter"
-                backspace = "backspace"
-                tab = "tab"
-                esc = "esc"
-                delete = "delete"
-                up = "up"
-                down = "down"
-                left = "left"
-                right = "right"
-                home = "home"
-                end = "end"
-                page_up = "page_up"
-                page_down = "page_down"
-                shift = "shift"
-                ctrl = "ctrl"
-                alt = "alt"
-                cmd = "cmd"
-                caps_lock = "caps_lock"
-
-        if hasattr(key, 'char') and key.char:
-             char = key.char
-             if char in self.char_map:
-                 return self.char_map[char], False
-             elif char in self.shift_chars:
-                 return self.shift_chars[char], True
-             else:
-                 return None, False
-        if isinstance(key, str):
-             if len(key) == 1:
-                 if key in self.char_map:
-                     return self.char_map[key], False
-                 elif key in self.shift_chars:
-                     return self.shift_chars[key], True
-
-        # Map common pynput Keys
-        key_map = {
+        # Mapping from pynput keys to evdev ecodes
+        self.key_map = {
             Key.space: e.KEY_SPACE,
             Key.enter: e.KEY_ENTER,
             Key.backspace: e.KEY_BACKSPACE,
@@ -152,49 +153,105 @@ class UInputController:
             Key.alt: e.KEY_LEFTALT,
             Key.cmd: e.KEY_LEFTMETA,
             Key.caps_lock: e.KEY_CAPSLOCK,
-             # Add other mappings as needed
-            'v': e.KEY_V, # Special case for ctrl+v string arg
         }
 
-        if key in key_map:
-            return key_map[key], False
+    def _get_keycode(self, key):
+        """Resolves a key (char or pynput Key) to an evdev keycode and modifier mask."""
+        char = getattr(key, 'char', None) or (key if isinstance(key, str) else None)
+        if char:
+            strokes = self.char_table.get(char)
+            # Dead-key sequences cannot be held or repeated as one key
+            if strokes and len(strokes) == 1:
+                return strokes[0]
+        return self.key_map.get(key), 0
 
-        return None, False
+    def _modifier_events(self, held, wanted):
+        events = b""
+        for bit, ecode in ((SHIFT, e.KEY_LEFTSHIFT), (LEVEL3, self.level3_key)):
+            if (held ^ wanted) & bit and ecode is not None:
+                events += _event(EV_KEY, ecode, 1 if wanted & bit else 0)
+        return events
 
-    def tap(self, key):
-        """Press and release a key."""
-        ecode, need_shift = self._get_keycode(key)
-        if ecode:
-            if need_shift:
-                self.ui.write(e.EV_KEY, e.KEY_LEFTSHIFT, 1)
-                self.ui.syn()
+    def _encode(self, keystrokes):
+        """
+        Encode ``(keycode, modifiers)`` pairs as one chunk of events per keystroke.
 
-            self.ui.write(e.EV_KEY, ecode, 1)
-            self.ui.syn()
-            self.ui.write(e.EV_KEY, ecode, 0)
-            self.ui.syn()
+        Each keystroke costs two SYN frames (press, release). Shift and AltGr
+        are only pressed or released when they change, inside the next press
+        frame, so a run of capitals does not bounce the modifier.
+        """
+        chunks = []
+        held = 0
+        for ecode, mods in keystrokes:
+            mods = int(mods)
+            down = self._modifier_events(held, mods) if mods != held else b""
+            held = mods
+            chunks.append(
+                down + _event(EV_KEY, ecode, 1) + _SYN
+                + _event(EV_KEY, ecode, 0) + _SYN
+            )
+        if held and chunks:
+            chunks[-1] += self._modifier_events(held, 0) + _SYN
+        return chunks
 
-            if need_shift:
-                self.ui.write(e.EV_KEY, e.KEY_LEFTSHIFT, 0)
-                self.ui.syn()
+    def _bursts(self, chunks):
+        """Group encoded keystrokes into writes that respect the burst limits."""
+        burst = []
+        events = 0
+        for chunk in chunks:
+            count = len(chunk) // _EVENT.size
+            if burst and (len(burst) == self.burst_size or events + count > MAX_BURST_EVENTS):
+                yield b"".join(burst)
+                burst = []
+                events = 0
+            burst.append(chunk)
+            events += count
+        if burst:
+            yield b"".join(burst)
 
-            time.sleep(0.01) # Small delay to let input propagate
+    def send(self, keystrokes):
+        """Inject a sequence of ``(keycode, modifiers)`` pairs with the configured pacing."""
+        chunks = self._encode(keystrokes)
+        fd = self.ui.fd
+        if self.key_delay:
+            for chunk in chunks:
+                os.write(fd, chunk)
+                time.sleep(self.key_delay)
+            return
+
+        for index, burst in enumerate(self._bursts(chunks)):
+            if index and self.burst_delay:
+                time.sleep(self.burst_delay)
+            os.write(fd, burst)
+
+    def send_plan(self, plan):
+        """Inject a precompiled keymap.InjectionPlan."""
+        self.send(plan.keystrokes)
+
+    def tap(self, key):
+        """Press and release a key."""
+        self.tap_repeated(key, 1)
+
+    def tap_repeated(self, key, count):
+        """Press and release a key ``count`` times in one batch."""
+        ecode, mods = self._get_keycode(key)
+        if ecode:
+            self.send([(ecode, mods)] * count)
 
     @contextmanager
     def pressed(self, key):
         """Context manager to hold a key down."""
         ecode, _ = self._get_keycode(key)
         if ecode:
-            self.ui.write(e.EV_KEY, ecode, 1)
-            self.ui.syn()
+            os.write(self.ui.fd, _event(EV_KEY, ecode, 1) + _SYN)
             try:
                 yield
             finally:
-                self.ui.write(e.EV_KEY, ecode, 0)
-                self.ui.syn()
-                time.sleep(0.01)
+                os.write(self.ui.fd, _event(EV_KEY, ecode, 0) + _SYN)
+                time.sleep(self.key_delay)
+        else:
+            yield
 
     def type(self, text):
-        """Type a string of characters."""
-        for char in text:
-            self.tap(char)
+        """Type a string of characters, skipping any the layout cannot produce."""
+        self.send_plan(keymap.compile_plan(text, self.char_table))
@@ -3,22 +3,51 @@
 # Licensed under GPLv3 or later
 
 import importlib.metadata
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import gi
 
 gi.require_version('Gtk', '4.0')
 gi.require_version('Adw', '1')
-from gi.repository import Adw, Gio, Gtk
+from gi.repository import Adw, Gio, GLib, GObject, Gtk
 
 from . import config
-from .database import Database
+from .database import Database, DuplicateTriggerError, OperationCancelled
+
+# Most search results shown in the sidebar
+SEARCH_LIMIT = 200
+
+
+class SnippetItem(GObject.Object):
+    """One row of the snippet list: just what the sidebar shows."""
+    __gtype_name__ = "RheolwyrSnippetItem"
+
+    snippet_id = GObject.Property(type=int)
+    name = GObject.Property(type=str)
+
+    def __init__(self, snippet_id, name):
+        super().__init__(snippet_id=snippet_id, name=name)
+
+
+def _compare_items(a, b):
+    # Same order as Database.list_snippets()
+    return (a.name > b.name) - (a.name < b.name) or a.snippet_id - b.snippet_id
 
 
 class RheolwyrWindow(Adw.ApplicationWindow):
-    def __init__(self, app):
+    def __init__(self, app, on_ready=None):
         super().__init__(application=app, title="Rheolwyr")
-        self.db = Database()
+        # Opened on the worker below, since it may migrate the schema;
+        # ``on_ready(db)`` runs on the main loop once it is open
+        self.db = None
+        self._on_ready = on_ready
         self.current_snippet_id = None
+        # Database and file work runs off the main loop. Edits go through one
+        # worker so they apply in order; imports and exports get their own so
+        # a large file never holds up opening or saving a snippet.
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rheolwyr-io")
+        self._bulk_io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rheolwyr-bulk")
 
         # Apply persisted theme
         initial_scheme = config.get_theme_scheme()
@@ -96,13 +125,32 @@ class RheolwyrWindow(Adw.ApplicationWindow):
         self.add_action(action_about)
         sidebar_box.append(sidebar_header)
 
-        # ListBox for snippets
-        self.listbox = Gtk.ListBox()
-        self.listbox.set_selection_mode(Gtk.SelectionMode.SINGLE)
-        self.listbox.connect("row-selected", self.on_row_selected)
+        # Search. search-changed fires once typing pauses, so each query hits
+        # the full-text index at most once per burst of keys.
+        self.search_entry = Gtk.SearchEntry(placeholder_text="Search snippets")
+        self.search_entry.set_search_delay(200)
+        self.search_entry.set_margin_start(6)
+        self.search_entry.set_margin_end(6)
+        self.search_entry.set_margin_bottom(6)
+        self.search_entry.connect("search-changed", self.on_search_changed)
+        sidebar_box.append(self.search_entry)
+
+        # Snippet list. The ListView only creates rows for what is on screen
+        # and recycles them while scrolling; the model is updated item by
+        # item as the library changes.
+        self.store = Gio.ListStore.new(SnippetItem)
+        # The store's items by snippet id, to find one without walking the list
+        self._items = {}
+        self.selection = Gtk.SingleSelection(model=self.store, autoselect=False, can_unselect=True)
+        self.selection.connect("notify::selected-item", self.on_selection_changed)
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self.on_row_setup)
+        factory.connect("bind", self.on_row_bind)
+        self.listview = Gtk.ListView(model=self.selection, factory=factory)
 
         scrolled = Gtk.ScrolledWindow()
-        scrolled.set_child(self.listbox)
+        scrolled.set_child(self.listview)
         scrolled.set_vexpand(True)
         sidebar_box.append(scrolled)
 
@@ -171,53 +219,143 @@ class RheolwyrWindow(Adw.ApplicationWindow):
         self.content_page.set_child(content_box)
         self.split_view.set_content(self.content_page)
 
+        # Nothing can be edited until the library is open
+        self.split_view.set_sensitive(False)
+        self.run_in_background(Database, on_done=self._on_database_opened)
+
+    def _on_database_opened(self, db):
+        self.db = db
+        self.db.connect_changed(self._on_library_changed)
+        self.split_view.set_sensitive(True)
         self.load_snippets()
+        if self._on_ready:
+            self._on_ready(db)
+
+    def run_in_background(self, func, *args, on_done=None, on_error=None, executor=None):
+        """
+        Run ``func(*args)`` on a worker thread.
+
+        ``on_done(result)`` or ``on_error(exception)`` then runs on the main
+        loop. Errors without a handler are shown in a dialog.
+        """
+        future = (executor or self._io).submit(func, *args)
+        future.add_done_callback(
+            lambda f: GLib.idle_add(self._deliver_result, f, on_done, on_error)
+        )
+        return future
+
+    def _deliver_result(self, future, on_done, on_error):
+        try:
+            result = future.result()
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            else:
+                self.show_message_dialog("Error", str(e))
+        else:
+            if on_done:
+                on_done(result)
+        return GLib.SOURCE_REMOVE
 
     def load_snippets(self):
-        # Clear existing
-        while self.listbox.get_first_child():
-            self.listbox.remove(self.listbox.get_first_child())
-
-        snippets = self.db.get_all_snippets()
-        row_to_select = None
-        for s in snippets:
-            # s: id, name, content, trigger
-            row = Gtk.ListBoxRow()
-            label = Gtk.Label(label=s[1], xalign=0, margin_start=10, margin_end=10, margin_top=10, margin_bottom=10)
-            row.set_child(label)
-            row.snippet_id = s[0]
-            self.listbox.append(row)
-
-            if self.current_snippet_id and row.snippet_id == self.current_snippet_id:
-                row_to_select = row
-
-        if row_to_select:
-            self.listbox.select_row(row_to_select)
+        """Replace the whole list, e.g. at startup or for a new search."""
+        query = self.search_entry.get_text().strip()
+        if query:
+            self.run_in_background(
+                self.db.search, query, SEARCH_LIMIT, on_done=self._show_snippets
+            )
+        else:
+            self.run_in_background(self.db.list_snippets, on_done=self._show_snippets)
+
+    def _show_snippets(self, snippets):
+        # s: id, name. One splice is one items-changed signal.
+        items = [SnippetItem(s[0], s[1]) for s in snippets]
+        self._items = {item.snippet_id: item for item in items}
+        self.store.splice(0, self.store.get_n_items(), items)
+        self._select_current()
+
+    def on_row_setup(self, factory, list_item):
+        label = Gtk.Label(xalign=0, margin_start=10, margin_end=10, margin_top=10, margin_bottom=10)
+        list_item.set_child(label)
+
+    def on_row_bind(self, factory, list_item):
+        list_item.get_child().set_label(list_item.get_item().name)
+
+    def _find_item(self, snippet_id):
+        item = self._items.get(snippet_id)
+        if item is None:
+            return None
+        found, position = self.store.find(item)
+        return position if found else None
+
+    def _select_current(self):
+        position = None
+        if self.current_snippet_id:
+            position = self._find_item(self.current_snippet_id)
+        if position is None:
+            position = Gtk.INVALID_LIST_POSITION
+        if self.selection.get_selected() != position:
+            self.selection.set_selected(position)
+
+    def _on_library_changed(self, change, snippet_id):
+        # May be called from any thread that wrote to the database
+        GLib.idle_add(self._apply_library_change, change, snippet_id)
+
+    def _apply_library_change(self, change, snippet_id):
+        if snippet_id is None or self.search_entry.get_text().strip():
+            # Bulk changes, or a filtered list the change may move in or out of
+            self.load_snippets()
+        elif change == "deleted":
+            self._replace_item(snippet_id, None)
+        else:
+            self.run_in_background(
+                self.db.get_snippet_by_id, snippet_id,
+                on_done=lambda row: self._replace_item(snippet_id, row)
+            )
+        return GLib.SOURCE_REMOVE
+
+    def _replace_item(self, snippet_id, row):
+        position = self._find_item(snippet_id)
+        if position is not None:
+            self.store.remove(position)
+            del self._items[snippet_id]
+        if row:
+            item = SnippetItem(row[0], row[1])
+            self._items[item.snippet_id] = item
+            self.store.insert_sorted(item, _compare_items)
+        self._select_current()
+
+    def on_search_changed(self, entry):
+        self.load_snippets()
 
     def on_add_clicked(self, btn):
         self.current_snippet_id = None
         self.name_entry.set_text("New Snippet")
         self.trigger_entry.set_text("")
         self.text_buffer.set_text("")
-        self.listbox.select_row(None)
+        self.selection.set_selected(Gtk.INVALID_LIST_POSITION)
         self.save_btn.set_sensitive(True)
         self.delete_btn.set_sensitive(False)
         self.name_entry.grab_focus()
 
-    def on_row_selected(self, box, row):
-        if row:
-            self.current_snippet_id = row.snippet_id
-            data = self.db.get_snippet_by_id(self.current_snippet_id)
-            if data:
-                self.name_entry.set_text(data[1])
-                self.text_buffer.set_text(data[2])
-                self.trigger_entry.set_text(data[3] if data[3] else "")
-                self.save_btn.set_sensitive(True)
-                self.delete_btn.set_sensitive(True)
-        else:
-            # Maybe clear fields if nothing selected?
-            # But on_add_clicked handles specific clearing.
-            pass
+    def on_selection_changed(self, selection, pspec):
+        item = selection.get_selected_item()
+        # Re-selecting the snippet already in the editor (e.g. after it was
+        # saved and moved) must not reload it over the user's edits
+        if item and item.snippet_id != self.current_snippet_id:
+            self.current_snippet_id = item.snippet_id
+            self.run_in_background(
+                self.db.get_snippet_by_id, item.snippet_id, on_done=self._show_snippet
+            )
+
+    def _show_snippet(self, data):
+        # Ignore a load that finished after the user moved on
+        if data and data[0] == self.current_snippet_id:
+            self.name_entry.set_text(data[1])
+            self.text_buffer.set_text(data[2])
+            self.trigger_entry.set_text(data[3] if data[3] else "")
+            self.save_btn.set_sensitive(True)
+            self.delete_btn.set_sensitive(True)
 
     def on_save_clicked(self, btn):
         name = self.name_entry.get_text()
@@ -231,23 +369,47 @@ class RheolwyrWindow(Adw.ApplicationWindow):
             # Minimal feedback: don't save if empty name
             return
 
+        # The list follows through _on_library_changed
+        self.save_btn.set_sensitive(False)
         if self.current_snippet_id:
-            self.db.update_snippet(self.current_snippet_id, name, content, trigger)
+            self.run_in_background(
+                self.db.update_snippet, self.current_snippet_id, name, content, trigger,
+                on_done=self._on_saved, on_error=lambda e: self._on_save_failed(e, trigger)
+            )
         else:
-            self.current_snippet_id = self.db.add_snippet(name, content, trigger)
+            self.run_in_background(
+                self.db.add_snippet, name, content, trigger,
+                on_done=self._on_saved, on_error=lambda e: self._on_save_failed(e, trigger)
+            )
+
+    def _on_saved(self, snippet_id):
+        if snippet_id is not None:
+            # A new snippet: keep editing it
+            self.current_snippet_id = snippet_id
+            self.delete_btn.set_sensitive(True)
+            self._select_current()
+        self.save_btn.set_sensitive(True)
 
-        self.load_snippets()
+    def _on_save_failed(self, error, trigger):
+        self.save_btn.set_sensitive(True)
+        if isinstance(error, DuplicateTriggerError):
+            self.show_message_dialog(
+                "Trigger Already Used",
+                f"Another snippet already uses the trigger '{trigger}'. "
+                "Choose a different trigger."
+            )
+        else:
+            self.show_message_dialog("Error", f"Failed to save snippet: {error}")
 
     def on_delete_clicked(self, btn):
         if self.current_snippet_id:
-            self.db.delete_snippet(self.current_snippet_id)
+            self.run_in_background(self.db.delete_snippet, self.current_snippet_id)
             self.current_snippet_id = None
             self.name_entry.set_text("")
             self.trigger_entry.set_text("")
             self.text_buffer.set_text("")
             self.save_btn.set_sensitive(False)
             self.delete_btn.set_sensitive(False)
-            self.load_snippets()
 
     def set_theme(self, scheme, save=True):
         manager = Adw.StyleManager.get_default()
@@ -314,6 +476,7 @@ Use the menu to export your snippets to a JSON file for backup, or import snippe
         filter_json.set_name("JSON Files")
         filter_json.add_mime_type("application/json")
         filter_json.add_pattern("*.json")
+        filter_json.add_pattern("*.json.gz")
         filters.append(filter_json)
         dialog.set_filters(filters)
 
@@ -322,18 +485,55 @@ Use the menu to export your snippets to a JSON file for backup, or import snippe
     def on_import_dialog_open_cb(self, dialog, result):
         try:
             file = dialog.open_finish(result)
-            if file:
-                path = file.get_path()
-                count = self.db.import_snippets(path)
-                if count > 0:
-                    self.load_snippets()
-                    self.show_message_dialog("Success", f"Successfully imported {count} snippets.")
-                elif count == 0:
-                    self.show_message_dialog("Information", "Import completed. No new snippets were added (all were duplicates).")
-                else:
-                    self.show_message_dialog("Error", "Failed to import snippets. Check file format.")
-        except gi.repository.GLib.GError:
-            pass # User cancelled or similar
+        except GLib.GError:
+            return # User cancelled or similar
+        if file:
+            self.run_with_progress(
+                "Importing Snippets", self.db.import_snippets, file.get_path(),
+                on_done=self._on_import_done
+            )
+
+    def _on_import_done(self, count):
+        if count > 0:
+            self.show_message_dialog("Success", f"Successfully imported {count} snippets.")
+        elif count == 0:
+            self.show_message_dialog("Information", "Import completed. No new snippets were added (all were duplicates).")
+        else:
+            self.show_message_dialog("Error", "Failed to import snippets. Check file format.")
+
+    def run_with_progress(self, heading, func, path, on_done):
+        """
+        Run an import or export on the bulk worker behind a progress dialog.
+
+        ``func(path, progress=..., cancel=...)`` reports progress from the
+        worker; the dialog's Cancel button sets the cancel event.
+        """
+        cancel = threading.Event()
+        progress_bar = Gtk.ProgressBar(show_text=True)
+        dialog = Adw.MessageDialog(transient_for=self, heading=heading, body=path)
+        dialog.set_extra_child(progress_bar)
+        dialog.add_response("cancel", "Cancel")
+        dialog.connect("response", lambda d, response: cancel.set())
+        dialog.present()
+
+        def progress(fraction):
+            GLib.idle_add(progress_bar.set_fraction, fraction)
+
+        def finish(result):
+            dialog.close()
+            on_done(result)
+
+        def failed(error):
+            dialog.close()
+            if isinstance(error, OperationCancelled):
+                self.show_message_dialog("Cancelled", f"{heading} was cancelled.")
+            else:
+                self.show_message_dialog("Error", str(error))
+
+        self.run_in_background(
+            lambda: func(path, progress=progress, cancel=cancel),
+            on_done=finish, on_error=failed, executor=self._bulk_io
+        )
 
     def on_export_action(self, action, param):
         dialog = Gtk.FileDialog()
@@ -345,14 +545,19 @@ Use the menu to export your snippets to a JSON file for backup, or import snippe
     def on_export_dialog_save_cb(self, dialog, result):
         try:
             file = dialog.save_finish(result)
-            if file:
-                path = file.get_path()
-                if not path.endswith('.json'):
-                    path += '.json'
-                success = self.db.export_snippets(path)
-                if success:
-                    self.show_message_dialog("Success", "Snippets exported successfully.")
-                else:
-                    self.show_message_dialog("Error", "Failed to export snippets.")
-        except gi.repository.GLib.GError:
-            pass # User cancelled
+        except GLib.GError:
+            return # User cancelled
+        if file:
+            path = file.get_path()
+            if not path.endswith(('.json', '.json.gz')):
+                path += '.json'
+            self.run_with_progress(
+                "Exporting Snippets", self.db.export_snippets, path,
+                on_done=self._on_export_done
+            )
+
+    def _on_export_done(self, success):
+        if success:
+            self.show_message_dialog("Success", "Snippets exported successfully.")
+        else:
+            self.show_message_dialog("Error", "Failed to export snippets.")
@@ -0,0 +1,217 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+# Add src to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from rheolwyr import clipboard
+
+# Stands in for clipboard_helper.py: same protocol, clipboard kept in memory
+FAKE_HELPER = """
+import json, sys
+print(json.dumps({"id": None, "ok": True, "ready": True}), flush=True)
+text = None
+for line in sys.stdin:
+    request = json.loads(line)
+    if request["command"] == "copy":
+        text = request["text"]
+        reply = {"ok": True}
+    elif request["command"] == "paste":
+        reply = {"ok": True, "text": text}
+    else:
+        sys.exit(1)
+    print(json.dumps({"id": request["id"], **reply}), flush=True)
+"""
+
+
+class TestClipboardHelper(unittest.TestCase):
+    def setUp(self):
+        self.helper = clipboard._Helper([sys.executable, "-c", FAKE_HELPER])
+        self.addCleanup(self.helper._stop)
+
+    def test_round_trip(self):
+        self.assertEqual(self.helper.request("paste")["text"], None)
+        self.assertTrue(self.helper.request("copy", text="Café\n")["ok"])
+        self.assertEqual(self.helper.request("paste")["text"], "Café\n")
+        # One process serves every request
+        self.assertIsNotNone(self.helper.proc)
+        self.assertIsNone(self.helper.proc.poll())
+
+    def test_restarts_after_crash(self):
+        self.assertIsNone(self.helper.request("crash"))
+        self.assertIsNone(self.helper.proc)
+        self.assertTrue(self.helper.request("copy", text="x")["ok"])
+
+    def test_unusable_helper_falls_back(self):
+        helper = clipboard._Helper([sys.executable, "-c", "print('nope')"])
+        self.assertIsNone(helper.request("paste"))
+        self.assertTrue(helper.failed)
+
+        with patch.object(clipboard, "_helper", helper), \
+                patch.object(clipboard, "_use_helper", return_value=True), \
+                patch.object(clipboard, "is_wayland", return_value=False), \
+                patch.object(clipboard, "_which", return_value="/usr/bin/xclip"), \
+                patch.object(clipboard.subprocess, "run") as run:
+            clipboard.copy("hello")
+        run.assert_called_once()
+        self.assertEqual(run.call_args.kwargs["input"], b"hello")
+
+
+class TestSnapshotRestore(unittest.TestCase):
+    def setUp(self):
+        self.restored = []
+        self.done = threading.Event()
+
+        def restore(snap, expected):
+            self.restored.append((snap.data, expected))
+            self.done.set()
+
+        for name, value in (("_restore", restore), ("_pending", None)):
+            patcher = patch.object(clipboard, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_restore_is_deferred(self):
+        snap = clipboard.Snapshot(mime_type="image/png", data=b"\x89PNG")
+        clipboard.restore_later(snap, "expansion", delay=0.05)
+        # Returns at once; the restore happens on a timer
+        self.assertEqual(self.restored, [])
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.restored, [(b"\x89PNG", "expansion")])
+
+    def test_back_to_back_expansions_keep_user_clipboard(self):
+        user = clipboard.Snapshot(mime_type="text/plain", data=b"user")
+        clipboard.restore_later(user, "first", delay=60)
+        with patch.object(clipboard, "_take_snapshot") as take:
+            # The second expansion takes over the pending restore's snapshot
+            # rather than saving the first expansion
+            self.assertIs(clipboard.snapshot(), user)
+        take.assert_not_called()
+        clipboard.restore_later(user, "second", delay=0.01)
+        self.assertTrue(self.done.wait(2))
+        self.assertEqual(self.restored, [(b"user", "second")])
+
+    def test_replaced_helper_snapshot_is_dropped(self):
+        with patch.object(clipboard, "_helper") as helper:
+            first = clipboard.Snapshot(helper_id=1)
+            clipboard.restore_later(first, "first", delay=60)
+            clipboard.restore_later(clipboard.Snapshot(helper_id=2), "second", delay=60)
+            clipboard._pending.cancel()
+            helper.request.assert_called_once_with("drop", snapshot=1)
+
+            helper.request.reset_mock()
+            clipboard.discard(clipboard.Snapshot(helper_id=3))
+            helper.request.assert_called_once_with("drop", snapshot=3)
+            # Tool snapshots live in this process; nothing to drop
+            helper.request.reset_mock()
+            clipboard.discard(clipboard.Snapshot(mime_type="text/plain", data=b"user"))
+            clipboard.discard(None)
+            helper.request.assert_not_called()
+        self.assertEqual(self.restored, [])
+
+    def test_empty_snapshot_is_not_restored(self):
+        clipboard.restore_later(clipboard.Snapshot(), "expansion", delay=0)
+        self.assertIsNone(clipboard._pending)
+
+
+class TestToolRestore(unittest.TestCase):
+    def test_skipped_after_new_copy(self):
+        snap = clipboard.Snapshot(mime_type="text/html", data=b"<b>old</b>")
+        commands = (["list"], ["read"], ["write", "--type"])
+        with patch.object(clipboard, "_tool_commands", return_value=commands), \
+                patch.object(clipboard, "_write") as write:
+            with patch.object(clipboard, "paste", return_value=b"copied since"):
+                clipboard._restore(snap, "expansion")
+            write.assert_not_called()
+            with patch.object(clipboard, "paste", return_value=b"expansion"):
+                clipboard._restore(snap, "expansion")
+            write.assert_called_once_with(["write", "--type", "text/html"], b"<b>old</b>")
+
+    def test_snapshot_keeps_richest_type(self):
+        outputs = {"list": b"text/plain\ntext/html\nimage/png\n", "read": b"PNG"}
+        commands = (["list"], ["read"], ["write"])
+        with patch.object(clipboard, "_use_helper", return_value=False), \
+                patch.object(clipboard, "_tool_commands", return_value=commands), \
+                patch.object(clipboard, "_run", side_effect=lambda args: outputs[args[0]]) as run:
+            snap = clipboard._take_snapshot()
+        self.assertEqual((snap.mime_type, snap.data), ("image/png", b"PNG"))
+        run.assert_called_with(["read", "image/png"])
+
+# Fake wl-paste/wl-copy: wl-paste adds a newline unless --no-newline, and
+# wl-copy leaves a process behind holding its stdout and stderr, as the real
+# ones do
+FAKE_WL_PASTE = """#!/bin/sh
+if [ "$1" = "--list-types" ]; then echo text/html; echo text/plain; exit 0; fi
+case "$*" in *--no-newline*) printf '%s' "$(cat "$CLIP")" ;; *) cat "$CLIP"; echo ;; esac
+"""
+FAKE_WL_COPY = """#!/bin/sh
+cat > "$CLIP"
+sleep 10 &
+"""
+
+
+class TestWaylandTools(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        for name, script in (("wl-paste", FAKE_WL_PASTE), ("wl-copy", FAKE_WL_COPY)):
+            path = os.path.join(self.tmp.name, name)
+            with open(path, "w") as f:
+                f.write(script)
+            os.chmod(path, 0o755)
+        self.clip = os.path.join(self.tmp.name, "clip")
+        env = {"PATH": self.tmp.name + os.pathsep + os.environ.get("PATH", ""),
+               "CLIP": self.clip, "WAYLAND_DISPLAY": "wayland-0"}
+        patcher = patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        clipboard._which.cache_clear()
+        self.addCleanup(clipboard._which.cache_clear)
+
+    def _set(self, data):
+        with open(self.clip, "wb") as f:
+            f.write(data)
+
+    def test_paste_has_no_added_newline(self):
+        self._set(b"expansion")
+        self.assertEqual(clipboard.paste(), b"expansion")
+
+    def test_snapshot_and_restore(self):
+        self._set(b"<b>old</b>")
+        snap = clipboard._take_snapshot()
+        self.assertEqual((snap.mime_type, snap.data), ("text/html", b"<b>old</b>"))
+
+        # The expansion is still on the clipboard, so it is put back, and the
+        # process wl-copy leaves behind does not hold up the restore
+        self._set(b"expansion")
+        started = time.monotonic()
+        clipboard._restore(snap, "expansion")
+        self.assertLess(time.monotonic() - started, 5)
+        with open(self.clip, "rb") as f:
+            self.assertEqual(f.read(), b"<b>old</b>")
+
+    def test_no_restore_after_new_copy(self):
+        snap = clipboard.Snapshot(mime_type="text/html", data=b"<b>old</b>")
+        self._set(b"copied since")
+        clipboard._restore(snap, "expansion")
+        with open(self.clip, "rb") as f:
+            self.assertEqual(f.read(), b"copied since")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,351 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+import io
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# Add src to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from rheolwyr.database import (
+    SCHEMA_VERSION,
+    Database,
+    DuplicateTriggerError,
+    OperationCancelled,
+    _iter_json_array,
+)
+from rheolwyr.matcher import TriggerMatcher
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmp.name, "snippets.db"))
+
+    def tearDown(self):
+        self.db.close()
+        self.tmp.cleanup()
+
+    def test_connection_per_thread(self):
+        conn = self.db._connection()
+        self.assertIs(self.db._connection(), conn)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.db._connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+
+    def test_reader_not_blocked_by_writer(self):
+        self.db.add_snippet("Signature", "My Name", ";sig")
+
+        # Hold a write transaction open on this thread
+        writer = self.db._connection()
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("UPDATE snippets SET content = 'Changed'")
+
+        rows = []
+        thread = threading.Thread(target=lambda: rows.extend(self.db.get_all_snippets()))
+        thread.start()
+        thread.join(timeout=2.0)
+        writer.rollback()
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual([row[2] for row in rows], ["My Name"])
+
+    def test_close_reopens_on_use(self):
+        self.db.add_snippet("Signature", "My Name", ";sig")
+        self.db.close()
+        self.assertEqual(len(self.db.get_all_snippets()), 1)
+
+
+    def test_projections(self):
+        sig = self.db.add_snippet("Signature", "My Name", ";sig")
+        addr = self.db.add_snippet("Address", "1 Street", "")
+        self.assertEqual(self.db.list_snippets(), [(addr, "Address"), (sig, "Signature")])
+        self.assertEqual(self.db.get_trigger_map(), {";sig": sig})
+
+    def test_trigger_index(self):
+        sig = self.db.add_snippet("Signature", "My Name", ";sig")
+        mapped = self.db.open_trigger_index()
+        self.assertEqual(mapped.match(mapped.feed("x;sig")), (";sig", sig))
+
+        # Rewritten on every change
+        addr = self.db.add_snippet("Address", "1 Street", ";addr")
+        mapped = self.db.open_trigger_index()
+        self.assertEqual(mapped.match(mapped.feed(";addr")), (";addr", addr))
+        self.db.delete_snippet(sig)
+        mapped = self.db.open_trigger_index()
+        self.assertIsNone(mapped.match(mapped.feed(";sig")))
+
+    def test_overlapping_triggers_ranked_by_name(self):
+        a = self.db.add_snippet("A", "First", "sig")
+        self.db.add_snippet("Z", "Last", ";sig")
+        mapped = self.db.open_trigger_index()
+        self.assertEqual(mapped.match(mapped.feed(";sig")), ("sig", a))
+        matcher = TriggerMatcher(self.db.get_trigger_map().items())
+        self.assertEqual(matcher.match(matcher.feed(";sig")), ("sig", a))
+
+    def test_trigger_index_repaired(self):
+        sig = self.db.add_snippet("Signature", "My Name", ";sig")
+        for data in (b"garbage", None):
+            if data is None:
+                os.unlink(self.db.index_path)
+            else:
+                with open(self.db.index_path, "wb") as f:
+                    f.write(data)
+            mapped = self.db.open_trigger_index()
+            self.assertEqual(mapped.match(mapped.feed(";sig")), (";sig", sig))
+
+        # Written by another process before a trigger was added behind our back
+        self.db._connection().execute(
+            "INSERT INTO snippets (name, content, trigger) VALUES ('A', 'a', ';a')"
+        )
+        self.db._connection().commit()
+        mapped = self.db.open_trigger_index()
+        self.assertEqual(len(mapped), 2)
+
+        # Same number of triggers, but one changed without a rewrite
+        self.db._connection().execute("UPDATE snippets SET trigger = ';new' WHERE id = ?", (sig,))
+        self.db._connection().commit()
+        mapped = Database(self.db.db_path).open_trigger_index()
+        self.assertIsNone(mapped.match(mapped.feed(";sig")))
+        self.assertEqual(mapped.match(mapped.feed(";new")), (";new", sig))
+
+    def test_content_cache(self):
+        self.db.CONTENT_CACHE_SIZE = 2
+        ids = [self.db.add_snippet(f"S{i}", f"Body {i}", "") for i in range(3)]
+        for snippet_id in ids:
+            self.db.get_content(snippet_id)
+        self.assertEqual(list(self.db._content_cache), ids[1:])
+
+        # Edits invalidate cached bodies, from any instance on the file
+        other = Database(self.db.db_path)
+        other.update_snippet(ids[2], "S2", "Changed", "")
+        other.close()
+        self.assertEqual(self.db.get_content(ids[2]), "Changed")
+        self.assertIsNone(self.db.get_content(12345))
+
+    def test_search(self):
+        sig = self.db.add_snippet("Signature", "Best regards", ";sig")
+        addr = self.db.add_snippet("Address", "1 Caf\u00e9 Street", ";addr")
+        regards = self.db.add_snippet("Regards", "See my signature", "")
+
+        # Prefix matches, names ranked above content
+        self.assertEqual(self.db.search("sig"), [(sig, "Signature"), (regards, "Regards")])
+        self.assertEqual(self.db.search(";ad"), [(addr, "Address")])
+        self.assertEqual(self.db.search("cafe street"), [(addr, "Address")])
+        self.assertEqual(self.db.search("  "), [])
+
+        # Kept in step with edits
+        self.db.update_snippet(addr, "Home", "2 Road", ";home")
+        self.assertEqual(self.db.search("cafe"), [])
+        self.assertEqual(self.db.search("home"), [(addr, "Home")])
+        self.db.delete_snippet(addr)
+        self.assertEqual(self.db.search("home"), [])
+
+    def test_duplicate_trigger_rejected(self):
+        self.db.add_snippet("Signature", "My Name", ";sig")
+        with self.assertRaises(DuplicateTriggerError):
+            self.db.add_snippet("Other", "Other Name", ";sig")
+        # Empty triggers may repeat
+        self.db.add_snippet("A", "a", "")
+        self.db.add_snippet("B", "b", "")
+        self.assertEqual(len(self.db.get_all_snippets()), 3)
+
+    def test_import_streams_and_dedups(self):
+        self.db.add_snippet("Signature", "My Name", ";sig")
+        items = [
+            {"name": "Signature", "content": "My Name", "trigger": ";sig"},
+            {"name": "Taken", "content": "Other", "trigger": ";sig"},
+            {"name": "Empty", "content": ""},
+        ] + [{"name": f"S{i}", "content": f"Body {i}", "trigger": f";s{i}"} for i in range(25)]
+        path = os.path.join(self.tmp.name, "export.json")
+        with open(path, "w") as f:
+            json.dump(items, f, indent=4)
+
+        progress = []
+        count = self.db.import_snippets(path, progress=progress.append, batch_size=10)
+        self.assertEqual(count, 26)
+        self.assertEqual(len(self.db.get_all_snippets()), 27)
+        self.assertEqual(progress[-1], 1.0)
+        self.assertGreater(len(progress), 2)
+
+        # Importing the same file again adds nothing
+        self.assertEqual(self.db.import_snippets(path), 0)
+
+    def test_import_with_clashing_trigger_keeps_content(self):
+        sig = self.db.add_snippet("Signature", "My Name", ";sig")
+        items = [
+            {"name": "Work signature", "content": "Work Name", "trigger": ";sig"},
+            {"name": "New", "content": "New body", "trigger": ";new"},
+            {"name": "Also new", "content": "Another body", "trigger": ";new"},
+        ]
+        path = os.path.join(self.tmp.name, "export.json")
+        with open(path, "w") as f:
+            json.dump(items, f)
+
+        self.assertEqual(self.db.import_snippets(path), 3)
+        rows = dict(self.db._connection().execute("SELECT name, trigger FROM snippets"))
+        self.assertEqual(rows, {
+            "Signature": ";sig", "Work signature": "", "New": ";new", "Also new": "",
+        })
+        self.assertEqual(self.db.get_trigger_map()[";sig"], sig)
+
+        # Importing the same file again adds nothing
+        self.assertEqual(self.db.import_snippets(path), 0)
+
+    def test_failed_import_adds_nothing(self):
+        path = os.path.join(self.tmp.name, "broken.json")
+        with open(path, "w") as f:
+            f.write('[{"name": "A", "content": "a"}, {"name": ')
+        self.assertEqual(self.db.import_snippets(path), -1)
+        self.assertEqual(self.db.get_all_snippets(), [])
+
+    def test_export_round_trip(self):
+        self.db.add_snippet("Signature", "My Name\nLine \"two\"", ";sig")
+        self.db.add_snippet("Address", "1 Street", "")
+        expected = [
+            {"name": s[1], "content": s[2], "trigger": s[3]}
+            for s in self.db.get_all_snippets()
+        ]
+
+        path = os.path.join(self.tmp.name, "export.json")
+        self.assertTrue(self.db.export_snippets(path))
+        with open(path) as f:
+            # Byte for byte what json.dump(..., indent=4) used to write
+            self.assertEqual(f.read(), json.dumps(expected, indent=4))
+
+        self.assertTrue(self.db.export_snippets(path, compact=True))
+        with open(path) as f:
+            self.assertEqual(json.load(f), expected)
+
+        gz_path = os.path.join(self.tmp.name, "export.json.gz")
+        self.assertTrue(self.db.export_snippets(gz_path))
+        other = Database(os.path.join(self.tmp.name, "other.db"))
+        try:
+            self.assertEqual(other.import_snippets(gz_path), 2)
+        finally:
+            other.close()
+
+    def test_cancelled_import_and_export(self):
+        for i in range(30):
+            self.db.add_snippet(f"S{i}", f"Body {i}", f";s{i}")
+        self.db.EXPORT_BATCH = 10
+        cancel = threading.Event()
+        cancel.set()
+
+        path = os.path.join(self.tmp.name, "export.json")
+        with self.assertRaises(OperationCancelled):
+            self.db.export_snippets(path, cancel=cancel)
+        self.assertFalse(os.path.exists(path))
+
+        self.assertTrue(self.db.export_snippets(path))
+        other = Database(os.path.join(self.tmp.name, "other.db"))
+        try:
+            with self.assertRaises(OperationCancelled):
+                other.import_snippets(path, batch_size=10, cancel=cancel)
+            self.assertEqual(other.get_all_snippets(), [])
+        finally:
+            other.close()
+
+    def test_iter_json_array_across_chunks(self):
+        items = [{"name": "caf\u00e9", "content": "x" * 100}, 12345, [1, 2]]
+        stream = io.BytesIO(json.dumps(items).encode("utf-8"))
+        self.assertEqual(list(_iter_json_array(stream, chunk_size=3)), items)
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "snippets.db")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_upgrade_from_unversioned_schema(self):
+        # A database as created before migrations existed
+        conn = sqlite3.connect(self.path)
+        conn.execute("""
+            CREATE TABLE snippets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                trigger TEXT,
+                shortcut TEXT,
+                content TEXT NOT NULL
+            )
+        """)
+        conn.executemany(
+            "INSERT INTO snippets (name, content, trigger) VALUES (?, ?, ?)",
+            [("B", "second", ";x"), ("A", "first", ";x"), ("C", "none", None)]
+        )
+        conn.commit()
+        conn.close()
+
+        db = Database(self.path)
+        try:
+            conn = db._connection()
+            self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], SCHEMA_VERSION)
+            rows = conn.execute(
+                "SELECT name, trigger, content_hash IS NOT NULL FROM snippets ORDER BY name"
+            ).fetchall()
+            # The first snippet by name keeps the shared trigger
+            self.assertEqual(rows, [("A", ";x", 1), ("B", "", 1), ("C", "", 1)])
+
+            plan = conn.execute(
+                "EXPLAIN QUERY PLAN SELECT id FROM snippets WHERE trigger = ?", (";x",)
+            ).fetchall()
+            self.assertIn("idx_snippets_trigger", " ".join(row[-1] for row in plan))
+        finally:
+            db.close()
+
+        # Opening again runs nothing
+        db = Database(self.path)
+        db.close()
+
+    def test_upgrade_large_library_quickly(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("""
+            CREATE TABLE snippets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                trigger TEXT,
+                shortcut TEXT,
+                content TEXT NOT NULL
+            )
+        """)
+        # Every trigger shared by two snippets
+        conn.executemany(
+            "INSERT INTO snippets (name, content, trigger) VALUES (?, ?, ?)",
+            ((f"Snippet {i:05d}", f"Body {i}", f";t{i // 2}") for i in range(8000))
+        )
+        conn.commit()
+        conn.close()
+
+        started = time.monotonic()
+        db = Database(self.path)
+        try:
+            self.assertLess(time.monotonic() - started, 2.0)
+            self.assertEqual(len(db.get_trigger_map()), 4000)
+            self.assertEqual(db.get_trigger_map()[";t1"], 3)
+        finally:
+            db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
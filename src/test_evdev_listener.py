@@ -0,0 +1,186 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+# Add src to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from evdev import InputEvent
+from evdev import ecodes as e
+
+from rheolwyr import evdev_listener
+from rheolwyr.evdev_listener import EvdevListener
+from rheolwyr.uinput_controller import DEVICE_NAME, DEVICE_PHYS
+
+KEYBOARD_KEYS = [e.KEY_A, e.KEY_B, e.KEY_LEFTSHIFT]
+
+
+class FakeDevice:
+    """Stands in for evdev.InputDevice; a pipe provides the fd to poll."""
+    def __init__(self, path, name="Keyboard", phys="usb-0000:00:14.0-1/input0",
+                 keys=KEYBOARD_KEYS):
+        self.path = path
+        self.name = name
+        self.phys = phys
+        self.keys = keys
+        self.fd, self._write_fd = os.pipe()
+        self._events = []
+        self.closed = False
+
+    def capabilities(self):
+        return {e.EV_KEY: list(self.keys)}
+
+    def press(self, code):
+        self._events.append(InputEvent(0, 0, e.EV_KEY, code, 1))
+        os.write(self._write_fd, b"x")
+
+    def read(self):
+        os.read(self.fd, 4096)
+        events, self._events = self._events, []
+        return events
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            os.close(self.fd)
+            os.close(self._write_fd)
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestEvdevListener(unittest.TestCase):
+    def setUp(self):
+        # A temporary directory stands in for /dev/input; each file in it is
+        # opened as whichever fake device was registered for its path
+        self.tmp = tempfile.TemporaryDirectory()
+        self.devices = {}
+        self.patchers = [
+            patch.object(evdev_listener, "INPUT_DIR", self.tmp.name),
+            patch.object(evdev_listener.evdev, "InputDevice", self._open),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.pressed = []
+        self.listener = EvdevListener(on_press=self.pressed.append)
+
+    def tearDown(self):
+        self.listener.stop()
+        for patcher in self.patchers:
+            patcher.stop()
+        for dev in self.devices.values():
+            if dev is not None:
+                dev.close()
+        self.tmp.cleanup()
+
+    def _open(self, path):
+        if path not in self.devices:
+            raise FileNotFoundError(path)
+        if self.devices[path] is None:
+            raise PermissionError(13, "Permission denied", path)
+        return self.devices[path]
+
+    def plug(self, node, **kwargs):
+        path = os.path.join(self.tmp.name, node)
+        self.devices[path] = FakeDevice(path, **kwargs)
+        open(path, "w").close()
+        return self.devices[path]
+
+    def test_reads_keyboards(self):
+        keyboard = self.plug("event0")
+        self.plug("event1", name="Mouse", keys=[e.BTN_LEFT])
+        self.listener.start()
+        self.assertEqual(list(self.listener.keyboards), [keyboard.path])
+
+        keyboard.press(e.KEY_A)
+        self.assertTrue(wait_for(lambda: self.pressed))
+        self.assertEqual(self.pressed[0].char, "a")
+
+    def test_own_device_is_skipped(self):
+        self.plug("event0", name=DEVICE_NAME)
+        self.plug("event1", phys=DEVICE_PHYS)
+        keyboard = self.plug("event2")
+        self.listener.start()
+        self.assertEqual(list(self.listener.keyboards), [keyboard.path])
+
+    def test_hotplug_without_keyboards_at_start(self):
+        self.listener.start()
+        self.assertTrue(self.listener.running)
+        self.assertEqual(self.listener.keyboards, {})
+
+        keyboard = self.plug("event3")
+        self.assertTrue(wait_for(lambda: keyboard.path in self.listener.keyboards))
+        keyboard.press(e.KEY_B)
+        self.assertTrue(wait_for(lambda: self.pressed))
+        self.assertEqual(self.pressed[0].char, "b")
+
+        os.unlink(keyboard.path)
+        self.assertTrue(wait_for(lambda: not self.listener.keyboards))
+        self.assertTrue(keyboard.closed)
+
+    def test_hotplugged_own_device_is_skipped(self):
+        self.listener.start()
+        self.plug("event4", name=DEVICE_NAME)
+        keyboard = self.plug("event5")
+        self.assertTrue(wait_for(lambda: keyboard.path in self.listener.keyboards))
+        self.assertEqual(list(self.listener.keyboards), [keyboard.path])
+
+    def test_stop_wakes_idle_thread(self):
+        self.plug("event0")
+        self.listener.start()
+        thread = self.listener.thread
+        # Idle: the thread is blocked in select() without a timeout
+        time.sleep(0.05)
+        started = time.monotonic()
+        self.listener.stop()
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(self.listener.running)
+        self.assertEqual(self.listener.keyboards, {})
+
+    def deny(self, node):
+        path = os.path.join(self.tmp.name, node)
+        self.devices[path] = None
+        open(path, "w").close()
+
+    def test_no_permission_is_a_failure(self):
+        # Not in the 'input' group: the nodes are there but none opens
+        self.deny("event0")
+        self.deny("event1")
+        self.listener.start()
+        self.assertFalse(self.listener.running)
+        self.assertIsNone(self.listener._watch)
+
+    def test_some_devices_denied(self):
+        self.deny("event0")
+        keyboard = self.plug("event1")
+        self.listener.start()
+        self.assertEqual(list(self.listener.keyboards), [keyboard.path])
+
+    def test_no_keyboards_and_no_watch(self):
+        with patch.object(evdev_listener, "_DirectoryWatch", side_effect=OSError("no inotify")):
+            self.listener.start()
+        self.assertFalse(self.listener.running)
+
+
+if __name__ == '__main__':
+    unittest.main()
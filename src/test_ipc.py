@@ -0,0 +1,122 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+import os
+import socket
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# Add src to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from rheolwyr import ipc
+
+
+class TestIPC(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, ipc.SOCKET_NAME)
+        self.changes = []
+        self.server = ipc.IPCServer({
+            "changed": lambda: self.changes.append(True),
+            "status": lambda: {"triggers": 3},
+            "broken": lambda: 1 / 0,
+        }, path=self.path)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def test_commands(self):
+        self.assertEqual(ipc.request("changed", path=self.path), {"ok": True})
+        self.assertEqual(self.changes, [True])
+        self.assertEqual(ipc.request("status", path=self.path), {"ok": True, "triggers": 3})
+
+    def test_errors_are_replies(self):
+        reply = ipc.request("nope", path=self.path)
+        self.assertFalse(reply["ok"])
+        self.assertIn("nope", reply["error"])
+        self.assertFalse(ipc.request("broken", path=self.path)["ok"])
+        # The server keeps going
+        self.assertTrue(ipc.request("status", path=self.path)["ok"])
+
+    def test_non_object_request(self):
+        for request in (b'["status"]', b'{"command": []}', b'{"command": {}}', b'{}'):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(1.0)
+                sock.connect(self.path)
+                sock.sendall(request + b"\n")
+                with sock.makefile("rb") as reply:
+                    line = reply.readline()
+            self.assertIn(b"Bad request", line, request)
+        self.assertTrue(ipc.request("status", path=self.path)["ok"])
+
+    def test_no_daemon(self):
+        self.server.stop()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertIsNone(ipc.request("status", path=self.path))
+
+    def test_socket_is_private(self):
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+
+class TestRuntimeDir(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        env = {k: v for k, v in os.environ.items() if k != "XDG_RUNTIME_DIR"}
+        self.patchers = [
+            patch.dict(os.environ, env, clear=True),
+            patch("rheolwyr.ipc.tempfile.gettempdir", return_value=self.tmp.name),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        self.path = os.path.join(self.tmp.name, f"rheolwyr-{os.getuid()}")
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        self.tmp.cleanup()
+
+    def test_created_private(self):
+        self.assertEqual(ipc.runtime_dir(), self.path)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o700)
+        # And reused
+        self.assertEqual(ipc.runtime_dir(), self.path)
+
+    def test_xdg_runtime_dir_preferred(self):
+        with patch.dict(os.environ, {"XDG_RUNTIME_DIR": self.tmp.name}):
+            self.assertEqual(ipc.runtime_dir(), self.tmp.name)
+
+    def test_open_directory_refused(self):
+        os.mkdir(self.path)
+        os.chmod(self.path, 0o755)
+        with self.assertRaises(PermissionError):
+            ipc.runtime_dir()
+
+    def test_symlink_refused(self):
+        target = os.path.join(self.tmp.name, "elsewhere")
+        os.mkdir(target, 0o700)
+        os.symlink(target, self.path)
+        with self.assertRaises(PermissionError):
+            ipc.runtime_dir()
+
+    def test_other_owner_refused(self):
+        uid = os.getuid() + 1
+        os.mkdir(os.path.join(self.tmp.name, f"rheolwyr-{uid}"), 0o700)
+        with patch("rheolwyr.ipc.os.getuid", return_value=uid):
+            with self.assertRaises(PermissionError):
+                ipc.runtime_dir()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+import os
+import sys
+import tempfile
+import unittest
+
+# Add src to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from evdev import ecodes as e
+
+from rheolwyr import keymap
+from rheolwyr.keymap import CAPS, LEVEL3, SHIFT, STATES, DeadKey
+
+SYMBOLS = """
+default partial alphanumeric_keys
+xkb_symbols "basic" {
+    include "latin"
+    key <AD06> { [ z, Z ] };
+    key <AB01> { [ y, Y ] };
+    key <AD03> { [ e, E, EuroSign ] };
+    key <AE12> { [ dead_acute, dead_grave ] };
+    include "level3(ralt_switch)"
+};
+"""
+
+LATIN = """
+default xkb_symbols "basic" {
+    key <AD01> { [ q, Q, at ] };
+    key <AD03> { [ e, E ] };
+};
+"""
+
+LEVEL3_SYMBOLS = """
+xkb_symbols "ralt_switch" {
+    key <RALT> { type[Group1]="ONE_LEVEL", symbols[Group1] = [ ISO_Level3_Shift ] };
+};
+"""
+
+
+class TestKeymap(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        for name, text in (("xx", SYMBOLS), ("latin", LATIN), ("level3", LEVEL3_SYMBOLS)):
+            with open(os.path.join(self.tmp.name, name), "w") as f:
+                f.write(text)
+        self.layout = keymap.load_layout("xx", search_path=(self.tmp.name,))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_layout_overrides_and_includes(self):
+        self.assertEqual(self.layout.symbol(e.KEY_Y, 0), "z")
+        self.assertEqual(self.layout.symbol(e.KEY_Z, SHIFT), "Y")
+        # Included from "latin"; the later definition keeps its AltGr level
+        self.assertEqual(self.layout.symbol(e.KEY_Q, LEVEL3), "@")
+        self.assertEqual(self.layout.symbol(e.KEY_E, LEVEL3), "€")
+        # Untouched keys keep their US meaning
+        self.assertEqual(self.layout.symbol(e.KEY_SLASH, SHIFT), "?")
+        self.assertIn(e.KEY_RIGHTALT, self.layout.level3_keys)
+
+    def test_caps_lock(self):
+        self.assertEqual(self.layout.symbol(e.KEY_Y, CAPS), "Z")
+        self.assertEqual(self.layout.symbol(e.KEY_Y, CAPS | SHIFT), "z")
+        self.assertEqual(self.layout.symbol(e.KEY_1, CAPS), "1")
+
+    def test_dead_keys(self):
+        self.assertEqual(self.layout.symbol(e.KEY_EQUAL, 0), DeadKey("\u0301"))
+        self.assertEqual(keymap.compose("\u0301", "e"), "é")
+        self.assertEqual(keymap.compose("\u0301", " "), "´")
+        self.assertEqual(keymap.compose("\u0301", "q"), "q")
+
+    def test_decode_table(self):
+        table = self.layout.decode_table()
+        self.assertEqual(table[e.KEY_Y * STATES | SHIFT], "Z")
+        self.assertEqual(table[e.KEY_E * STATES | LEVEL3 | SHIFT], "€")
+
+    def test_char_table(self):
+        table = self.layout.char_table()
+        self.assertEqual(table["z"], ((e.KEY_Y, 0),))
+        self.assertEqual(table["Z"], ((e.KEY_Y, SHIFT),))
+        self.assertEqual(table["€"], ((e.KEY_E, LEVEL3),))
+        # Reached through the acute dead key
+        self.assertEqual(table["\u00e9"], ((e.KEY_EQUAL, 0), (e.KEY_E, 0)))
+        self.assertEqual(table["\u00c8"], ((e.KEY_EQUAL, SHIFT), (e.KEY_E, SHIFT)))
+        self.assertEqual(self.layout.level3_key, e.KEY_RIGHTALT)
+
+    def test_compile_plan_on_layout(self):
+        plan = keymap.compile_plan("z\u00e9!\u2603", self.layout.char_table())
+        self.assertEqual(plan.untypable, frozenset("\u2603"))
+        self.assertEqual(plan.keystrokes[:3], ((e.KEY_Y, 0), (e.KEY_EQUAL, 0), (e.KEY_E, 0)))
+
+    def test_resolve_keysym(self):
+        self.assertEqual(keymap.resolve_keysym("at"), "@")
+        self.assertEqual(keymap.resolve_keysym("U00E9"), "é")
+        self.assertEqual(keymap.resolve_keysym("odiaeresis"), "ö")
+        self.assertIsInstance(keymap.resolve_keysym("dead_grave"), DeadKey)
+
+    def test_missing_layout_falls_back_to_us(self):
+        self.assertIs(keymap.load_keymap("no-such-layout"), keymap.US)
+
+
+if __name__ == '__main__':
+    unittest.main()
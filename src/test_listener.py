@@ -19,7 +19,9 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 # Now we can import real classes for typing/constants if needed, or mock them
 from pynput.keyboard import Key
 
-from rheolwyr.listener import SnippetListener
+from rheolwyr.keymap import compile_plan
+from rheolwyr.listener import PLAN_CACHE_SIZE, SnippetListener
+from rheolwyr.strategy import InjectionStrategy
 
 
 class TestListener(unittest.TestCase):
@@ -28,13 +30,15 @@ class TestListener(unittest.TestCase):
         self.db_patcher = patch('rheolwyr.listener.Database')
         self.mock_db_cls = self.db_patcher.start()
         self.mock_db = self.mock_db_cls.return_value
+        # No trigger index; the listener compiles the automaton itself
+        self.mock_db.open_trigger_index.return_value = None
 
         # Patch clipboard
         self.clipboard_patcher = patch('rheolwyr.listener.clipboard')
         self.mock_clipboard = self.clipboard_patcher.start()
 
         # Patch Controller
-        self.controller_patcher = patch('rheolwyr.listener.Controller')
+        self.controller_patcher = patch('rheolwyr.listener.PynputController')
         self.mock_controller_cls = self.controller_patcher.start()
         self.mock_controller = self.mock_controller_cls.return_value
 
@@ -62,40 +66,185 @@ class TestListener(unittest.TestCase):
         self.assertEqual(self.listener.buffer, 'ab')
 
     def test_backspace(self):
-        self.listener.buffer = "abc"
+        key = MagicMock()
+        for char in "abc":
+            key.char = char
+            self.listener.on_press(key)
         self.listener.on_press(Key.backspace)
         self.assertEqual(self.listener.buffer, "ab")
 
-    def test_trigger_match(self):
-        self.listener.buffer = "test;sig"
+    def test_buffer_keeps_newest_keys(self):
+        key = MagicMock()
+        for char in "x" * self.listener.max_buffer_size + "yz":
+            key.char = char
+            self.listener.on_press(key)
+        self.assertEqual(len(self.listener.buffer), self.listener.max_buffer_size)
+        self.assertTrue(self.listener.buffer.endswith("xyz"))
 
+    def test_trigger_match(self):
         # Setup mock db
-        self.mock_db.get_all_snippets.return_value = [
-            (1, "Signature", "My Name", ";sig")
-        ]
+        self.mock_db.get_trigger_map.return_value = {";sig": 1}
+        self.listener.reload_snippets()
+
+        for char in "test;sig":
+            key = MagicMock()
+            key.char = char
+            self.listener.on_press(key)
+        self.assertEqual(self.listener._expansions.get_nowait(), (";sig", 1))
+        self.assertEqual(self.listener.buffer, "")
+
+    def test_trigger_match_after_backspace(self):
+        self.mock_db.get_trigger_map.return_value = {";sig": 1}
+        self.listener.reload_snippets()
+
+        for char in ";sx":
+            key = MagicMock()
+            key.char = char
+            self.listener.on_press(key)
+        self.listener.on_press(Key.backspace)
+        key = MagicMock()
+        key.char = 'i'
+        self.listener.on_press(key)
+        key.char = 'g'
+        self.listener.on_press(key)
+        self.assertEqual(self.listener._expansions.get_nowait(), (";sig", 1))
+        self.assertTrue(self.listener._expansions.empty())
+
+    def test_library_change_rebuilds_matcher(self):
+        self.mock_db.generation = 1
+        self.mock_db.get_trigger_map.return_value = {";sig": 1}
+        self.listener._on_library_changed("added", 1)
+
+        for char in ";sig":
+            key = MagicMock()
+            key.char = char
+            self.listener.on_press(key)
+        self.assertEqual(self.listener._expansions.get_nowait(), (";sig", 1))
+
+    def test_status(self):
+        self.mock_db.generation = 4
+        self.mock_db.get_trigger_map.return_value = {";sig": 1, ";addr": 2}
+        self.listener.reload_snippets()
+        status = self.listener.status()
+        self.assertEqual(status["triggers"], 2)
+        self.assertEqual(status["generation"], 4)
+        self.assertTrue(status["running"])
+
+    def test_evdev_without_keyboards_fails_to_start(self):
+        # EvdevListener stays stopped when no device can be opened
+        self.listener.running = False
+        self.listener.is_wayland = True
+        with patch('rheolwyr.listener.EvdevListener') as evdev_cls:
+            evdev_cls.return_value.running = False
+            with self.assertRaises(PermissionError) as raised:
+                self.listener.start()
+        self.assertIn("'input' group", str(raised.exception))
+
+    def test_keys_during_injection_are_replayed(self):
+        self.mock_db.get_trigger_map.return_value = {";sig": 1}
+        self.listener.reload_snippets()
+
+        for char in ";sigab":
+            key = MagicMock()
+            key.char = char
+            self.listener.on_press(key)
+        # Keys typed after the trigger wait for the injection to finish
+        self.assertEqual(self.listener.buffer, "")
+        self.listener._finish_injection()
+        self.assertEqual(self.listener.buffer, "ab")
+
+    def test_injected_keys_are_ignored(self):
+        self.mock_db.get_trigger_map.return_value = {";sig": 1}
+        self.listener.reload_snippets()
+        # The pynput listener sees our own keys as they are injected
+        self.listener._sees_injection = True
 
-        # Mock expand_snippet
-        with patch.object(self.listener, 'expand_snippet') as mock_expand:
-            self.listener.check_match()
-            mock_expand.assert_called_with(";sig", "My Name")
-            self.assertEqual(self.listener.buffer, "")
+        for char in ";sig" + "My Name":
+            key = MagicMock()
+            key.char = char
+            self.listener.on_press(key)
+        self.listener._finish_injection()
+        self.assertEqual(self.listener.buffer, "")
+
+        key = MagicMock()
+        key.char = "x"
+        self.listener.on_press(key, injected=True)
+        self.assertEqual(self.listener.buffer, "")
 
     def test_expansion_logic(self):
         trigger = ";trig"
-        content = "Expansion"
+        # The snowman cannot be typed on any layout, so this is pasted
+        content = "Expansion \u2603 " * 10
 
         self.listener.expand_snippet(trigger, content)
 
-        # Verify backspaces (one tap per char)
-        self.assertEqual(self.mock_controller.tap.call_count, len(trigger) + 1) # +1 for 'v'
+        # Verify backspaces (one batch for the whole trigger)
+        self.mock_controller.tap_repeated.assert_called_once_with(Key.backspace, len(trigger))
 
         # Verify clipboard copy
-        self.mock_clipboard.copy.assert_called_with(content)
+        self.mock_clipboard.copy.assert_any_call(content)
 
         # Verify paste (ctrl+v)
         self.mock_controller.pressed.assert_called_with(Key.ctrl)
         # Verify 'v' was tapped (the last tap)
         self.mock_controller.tap.assert_called_with('v')
 
+    def test_short_expansion_is_typed(self):
+        plan = compile_plan("Expansion")
+        self.listener.expand_snippet(";trig", "Expansion", plan)
+        self.mock_controller.send_plan.assert_called_once_with(plan)
+        self.mock_clipboard.copy.assert_not_called()
+
+    def test_long_expansion_is_typed(self):
+        content = "Expansion " * 10
+        self.listener.expand_snippet(";trig", content)
+        self.mock_controller.send_plan.assert_called_once_with(compile_plan(content))
+        self.mock_clipboard.copy.assert_not_called()
+
+    def test_untypable_expansion_is_pasted(self):
+        self.listener.expand_snippet(";trig", "Caf\u00e9")
+        self.mock_controller.send_plan.assert_not_called()
+        self.mock_clipboard.copy.assert_any_call("Caf\u00e9")
+
+    def test_failed_paste_discards_snapshot(self):
+        self.mock_clipboard.copy.side_effect = RuntimeError("no clipboard")
+        with self.assertRaises(RuntimeError):
+            self.listener.expand_snippet(";trig", "Caf\u00e9")
+        self.mock_clipboard.discard.assert_called_once_with(
+            self.mock_clipboard.snapshot.return_value)
+        self.mock_clipboard.restore_later.assert_not_called()
+
+    def test_slow_typing_switches_to_paste(self):
+        # Typing has measured at 50 ms a key; a clipboard round trip is cheaper
+        self.listener.strategy = InjectionStrategy(key_cost=0.05, paste_cost=0.1)
+        self.listener.expand_snippet(";trig", "Expansion")
+        self.mock_controller.send_plan.assert_not_called()
+        self.mock_clipboard.copy.assert_any_call("Expansion")
+        self.assertEqual(self.listener.status()["strategy"]["pasted"], 1)
+
+    def test_plans_compiled_on_first_use(self):
+        self.mock_db.get_content.return_value = "My Name"
+        content, plan = self.listener._load_expansion(1)
+        self.assertEqual((content, plan), ("My Name", compile_plan("My Name")))
+        # Reused while the content is unchanged
+        self.assertIs(self.listener._load_expansion(1)[1], plan)
+
+        self.mock_db.get_content.return_value = "New Name"
+        self.assertEqual(self.listener._load_expansion(1)[1], compile_plan("New Name"))
+
+        self.mock_db.get_content.return_value = None
+        self.assertIsNone(self.listener._load_expansion(1))
+
+    def test_plans_are_bounded(self):
+        self.mock_db.get_content.return_value = "My Name"
+        for snippet_id in range(PLAN_CACHE_SIZE):
+            self.listener._load_expansion(snippet_id)
+        # Expanding the oldest again keeps it; the next oldest is evicted
+        self.listener._load_expansion(0)
+        self.listener._load_expansion(PLAN_CACHE_SIZE)
+        self.assertEqual(len(self.listener.plans), PLAN_CACHE_SIZE)
+        self.assertIn(0, self.listener.plans)
+        self.assertNotIn(1, self.listener.plans)
+
 if __name__ == '__main__':
     unittest.main()
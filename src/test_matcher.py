@@ -0,0 +1,163 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+# Add src to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from rheolwyr.matcher import (
+    KeystrokeBuffer,
+    MappedTriggerMatcher,
+    TriggerMatcher,
+    trigger_fingerprint,
+)
+
+
+class TestTriggerMatcher(unittest.TestCase):
+    def test_suffix_match(self):
+        matcher = TriggerMatcher([(";sig", 1), (";addr", 2)])
+        state = matcher.feed("hello ;sig")
+        self.assertEqual(matcher.match(state), (";sig", 1))
+
+        state = matcher.feed("hello ;si")
+        self.assertIsNone(matcher.match(state))
+
+    def test_overlapping_triggers_use_priority(self):
+        # "sig" is a suffix of ";sig"; the entry listed first wins
+        matcher = TriggerMatcher([("sig", 1), (";sig", 2)])
+        self.assertEqual(matcher.match(matcher.feed("x;sig")), ("sig", 1))
+
+        matcher = TriggerMatcher([(";sig", 2), ("sig", 1)])
+        self.assertEqual(matcher.match(matcher.feed("x;sig")), (";sig", 2))
+        self.assertEqual(matcher.match(matcher.feed("xsig")), ("sig", 1))
+
+    def test_failure_links(self):
+        matcher = TriggerMatcher([("abcd", 1), ("bce", 2)])
+        self.assertEqual(matcher.match(matcher.feed("abce")), ("bce", 2))
+        self.assertEqual(matcher.match(matcher.feed("ababcd")), ("abcd", 1))
+
+    def test_duplicate_and_empty_triggers(self):
+        matcher = TriggerMatcher([("", 1), (";x", 2), (";x", 3)])
+        self.assertEqual(len(matcher), 1)
+        self.assertEqual(matcher.match(matcher.feed(";x")), (";x", 2))
+
+    def test_step_is_incremental(self):
+        matcher = TriggerMatcher([(";sig", 1)])
+        state = TriggerMatcher.ROOT
+        for char in "a;;si":
+            state = matcher.step(state, char)
+        self.assertIsNone(matcher.match(state))
+        state = matcher.step(state, "g")
+        self.assertEqual(matcher.match(state), (";sig", 1))
+
+
+class TestMappedTriggerMatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "snippets.idx")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _map(self, matcher):
+        with open(self.path, "wb") as f:
+            f.write(matcher.to_bytes())
+        mapped = MappedTriggerMatcher(self.path)
+        self.addCleanup(mapped.close)
+        return mapped
+
+    def test_matches_like_compiled(self):
+        rng = random.Random(7)
+        alphabet = ";abc\u00e9\u20ac"
+        triggers = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 5)))
+                    for _ in range(200)]
+        matcher = TriggerMatcher((trigger, i) for i, trigger in enumerate(triggers))
+        mapped = self._map(matcher)
+        self.assertEqual(len(mapped), len(matcher))
+
+        text = "".join(rng.choice(alphabet + "xy") for _ in range(2000))
+        state = mapped_state = TriggerMatcher.ROOT
+        for char in text:
+            state = matcher.step(state, char)
+            mapped_state = mapped.step(mapped_state, char)
+            self.assertEqual(mapped_state, state)
+            self.assertEqual(mapped.match(mapped_state), matcher.match(state))
+
+    def test_priority_preserved(self):
+        mapped = self._map(TriggerMatcher([(";sig", 2), ("sig", 1)]))
+        self.assertEqual(mapped.match(mapped.feed("x;sig")), (";sig", 2))
+        self.assertEqual(mapped.match(mapped.feed("xsig")), ("sig", 1))
+
+    def test_fingerprint(self):
+        entries = [(";sig", 1), (";addr", 2)]
+        with open(self.path, "wb") as f:
+            f.write(TriggerMatcher(entries).to_bytes(trigger_fingerprint(entries)))
+        mapped = MappedTriggerMatcher(self.path)
+        self.addCleanup(mapped.close)
+        self.assertEqual(mapped.fingerprint, trigger_fingerprint(entries))
+        self.assertNotEqual(mapped.fingerprint, trigger_fingerprint([(";sig", 1), (";adr", 2)]))
+        self.assertNotEqual(mapped.fingerprint, trigger_fingerprint(entries[::-1]))
+
+    def test_empty_matcher(self):
+        mapped = self._map(TriggerMatcher())
+        self.assertEqual(len(mapped), 0)
+        self.assertIsNone(mapped.match(mapped.feed(";sig")))
+
+    def test_rejects_other_files(self):
+        for data in (b"", b"RHTI", b"not an index at all"):
+            with open(self.path, "wb") as f:
+                f.write(data)
+            with self.assertRaises(ValueError):
+                MappedTriggerMatcher(self.path)
+
+
+class TestKeystrokeBuffer(unittest.TestCase):
+    def test_wraps_and_keeps_newest(self):
+        keys = KeystrokeBuffer(4)
+        for char in "abcdef":
+            keys.push(char, 0)
+        self.assertEqual(len(keys), 4)
+        self.assertEqual(str(keys), "cdef")
+        self.assertEqual(keys.suffix(2), "ef")
+
+    def test_pop_rewinds_state(self):
+        matcher = TriggerMatcher([(";sig", 1)])
+        keys = KeystrokeBuffer(8)
+        for char in ";six":
+            keys.push(char, matcher.step(keys.state, char))
+        self.assertEqual(keys.pop(), matcher.feed(";si"))
+        keys.push("g", matcher.step(keys.state, "g"))
+        self.assertEqual(matcher.match(keys.state), (";sig", 1))
+
+    def test_pop_past_start(self):
+        keys = KeystrokeBuffer(2)
+        keys.push("a", 5)
+        keys.pop()
+        keys.pop()
+        self.assertEqual(len(keys), 0)
+        self.assertEqual(keys.state, TriggerMatcher.ROOT)
+
+    def test_rebase(self):
+        keys = KeystrokeBuffer(8)
+        for char in "x;si":
+            keys.push(char, TriggerMatcher.ROOT)
+        matcher = TriggerMatcher([(";sig", 1)])
+        keys.rebase(matcher)
+        keys.push("g", matcher.step(keys.state, "g"))
+        self.assertEqual(matcher.match(keys.state), (";sig", 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+import os
+import sys
+import unittest
+
+# Add src to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from rheolwyr.strategy import PASTE, TYPE, InjectionStrategy
+
+
+class TestInjectionStrategy(unittest.TestCase):
+    def test_cheaper_method_wins(self):
+        strategy = InjectionStrategy(key_cost=0.001, paste_cost=0.1)
+        self.assertEqual(strategy.crossover(), 100)
+        self.assertEqual(strategy.choose(50), TYPE)
+        self.assertEqual(strategy.choose(500), PASTE)
+        self.assertEqual(strategy.choose(5, typable=False), PASTE)
+
+    def test_uinput_pacing(self):
+        fast = InjectionStrategy.for_uinput(key_delay=0.0, burst_size=16, burst_delay=0.002)
+        slow = InjectionStrategy.for_uinput(key_delay=0.01, burst_size=16, burst_delay=0.002)
+        self.assertGreater(fast.crossover(), 400)
+        self.assertLess(slow.crossover(), 20)
+
+    def test_measurements_move_the_choice(self):
+        strategy = InjectionStrategy(key_cost=0.001, paste_cost=0.1)
+        self.assertEqual(strategy.choose(80), TYPE)
+        # Typing turns out to be slow on this compositor
+        for _ in range(20):
+            strategy.record(TYPE, 80, 0.4)
+        self.assertAlmostEqual(strategy.key_cost, 0.005, places=3)
+        self.assertEqual(strategy.choose(80), PASTE)
+        # ...and pasting fast
+        for _ in range(20):
+            strategy.record(PASTE, 80, 0.01)
+        self.assertLess(strategy.paste_cost, 0.02)
+
+    def test_forced_method(self):
+        strategy = InjectionStrategy(key_cost=0.001, paste_cost=0.1, method=PASTE)
+        self.assertEqual(strategy.choose(1), PASTE)
+        strategy = InjectionStrategy(key_cost=0.001, paste_cost=0.1, method=TYPE)
+        self.assertEqual(strategy.choose(10000), TYPE)
+        # Untypable content is pasted regardless
+        self.assertEqual(strategy.choose(1, typable=False), PASTE)
+
+    def test_stats(self):
+        strategy = InjectionStrategy(key_cost=0.001, paste_cost=0.1)
+        strategy.choose(10)
+        strategy.record(TYPE, 10, 0.02)
+        stats = strategy.stats()
+        self.assertEqual((stats["typed"], stats["pasted"]), (1, 0))
+        self.assertEqual(stats["last"], {"method": TYPE, "keystrokes": 10, "seconds": 0.02})
+        self.assertAlmostEqual(stats["key_cost_ms"], 1.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# Copyright (C) 2026 Chuck Talk <cwtalk1@gmail.com>
+# This file is part of Rheolwyr.
+#
+# Rheolwyr is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, version 3.
+#
+# Rheolwyr is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY. See the GNU AGPL v3 for details.
+
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# Add src to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from evdev import ecodes as e
+
+from rheolwyr import uinput_controller
+from rheolwyr.keymap import LEVEL3, SHIFT
+from rheolwyr.uinput_controller import _EVENT, EV_KEY, EV_SYN, UInputController
+
+
+def decode(data):
+    """(type, code, value) for every event in ``data``."""
+    return [_EVENT.unpack_from(data, offset)[2:]
+            for offset in range(0, len(data), _EVENT.size)]
+
+
+class TestUInputController(unittest.TestCase):
+    def setUp(self):
+        patcher = patch.object(uinput_controller, "UInput")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.controller = UInputController(burst_delay=0)
+        # The US layout has no AltGr; pretend it does
+        self.level3 = self.controller.level3_key = e.KEY_RIGHTALT
+
+    def test_encode_one_chunk_per_keystroke(self):
+        chunks = self.controller._encode([(e.KEY_A, 0), (e.KEY_B, 0)])
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(decode(chunks[0]), [
+            (EV_KEY, e.KEY_A, 1), (EV_SYN, 0, 0), (EV_KEY, e.KEY_A, 0), (EV_SYN, 0, 0),
+        ])
+
+    def test_encode_modifiers_change_only_when_needed(self):
+        chunks = self.controller._encode(
+            [(e.KEY_A, SHIFT), (e.KEY_B, SHIFT), (e.KEY_Q, LEVEL3), (e.KEY_C, 0)]
+        )
+        events = [decode(chunk) for chunk in chunks]
+        self.assertEqual(events[0][0], (EV_KEY, e.KEY_LEFTSHIFT, 1))
+        # Shift stays down for the second capital
+        self.assertEqual(events[1][0], (EV_KEY, e.KEY_B, 1))
+        self.assertEqual(events[2][:2], [(EV_KEY, e.KEY_LEFTSHIFT, 0), (EV_KEY, self.level3, 1)])
+        self.assertEqual(events[3][0], (EV_KEY, self.level3, 0))
+        # Nothing is left held at the end
+        self.assertEqual(events[3][-1], (EV_SYN, 0, 0))
+
+    def test_encode_releases_trailing_modifier(self):
+        chunks = self.controller._encode([(e.KEY_A, SHIFT)])
+        self.assertEqual(decode(chunks[-1])[-2:], [(EV_KEY, e.KEY_LEFTSHIFT, 0), (EV_SYN, 0, 0)])
+
+    def test_bursts_fit_the_evdev_client_buffer(self):
+        self.controller.burst_size = 100
+        keystrokes = [(e.KEY_A, SHIFT if i % 2 else 0) for i in range(50)]
+        bursts = list(self.controller._bursts(self.controller._encode(keystrokes)))
+        self.assertGreater(len(bursts), 1)
+        for burst in bursts:
+            self.assertLessEqual(len(decode(burst)), uinput_controller.MAX_BURST_EVENTS)
+        # Nothing lost or reordered
+        self.assertEqual(b"".join(bursts), b"".join(self.controller._encode(keystrokes)))
+
+    def test_bursts_respect_burst_size(self):
+        self.controller.burst_size = 3
+        bursts = list(self.controller._bursts(self.controller._encode([(e.KEY_A, 0)] * 7)))
+        self.assertEqual([len(decode(burst)) // 4 for burst in bursts], [3, 3, 1])
+
+    def test_send_writes_each_burst(self):
+        with patch.object(uinput_controller.os, "write") as write:
+            self.controller.send([(e.KEY_A, 0)] * 20)
+        self.assertEqual(len(write.call_args_list), 3)
+        for call in write.call_args_list:
+            self.assertLessEqual(len(decode(call.args[1])), uinput_controller.MAX_BURST_EVENTS)
+
+
+if __name__ == '__main__':
+    unittest.main()
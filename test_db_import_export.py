@@ -50,8 +50,11 @@ def test_import_export():
     print("Import/Export mechanism works properly!")
 
     # Cleanup
-    os.remove("test_snippets.db")
-    os.remove("test_snippets2.db")
-    os.remove("exported.json")
+    db.close()
+    db2.close()
+    for path in ("test_snippets.db", "test_snippets2.db", db.index_path, db2.index_path,
+                 "exported.json"):
+        if os.path.exists(path):
+            os.remove(path)
 
 test_import_export()